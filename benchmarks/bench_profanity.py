@@ -0,0 +1,79 @@
+"""
+Микробенчмарк локального фильтра мата: старый подход (цикл по словарю
+с `in` + profanityfilter.is_profane) против скомпилированного матчера
+на словарях разного размера.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_profanity --sizes 30 1000 10000 50000
+"""
+import argparse
+import random
+import time
+
+from profanityfilter import ProfanityFilter
+
+from bot.services import moderation
+from bot.services.profanity import ProfanityMatcher
+
+_ALPHABET = "абвгдежзийклмнопрстуфхцчшщыэюя"
+
+_MESSAGES = [
+    "Привет! Подскажи, пожалуйста, как написать функцию сортировки на Python?",
+    "Расскажи коротко про историю Казани и что там стоит посмотреть летом.",
+    "Можешь объяснить простыми словами, что такое градиентный спуск?",
+    "ну ты и сука, ничего не понимаешь",
+    "What is the difference between a list and a tuple in Python?",
+]
+
+
+def _random_words(n: int) -> list:
+    rnd = random.Random(n)
+    return [
+        "".join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(5, 10)))
+        for _ in range(n)
+    ]
+
+
+def _throughput(check, messages, seconds: float = 1.0) -> float:
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for text in messages:
+            check(text)
+        done += len(messages)
+    return done / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 1000, 10000, 50000])
+    parser.add_argument("--seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    library_words = moderation._library_words()
+
+    print(f"{'words':>8} {'build, ms':>10} {'old, msg/s':>12} {'new, msg/s':>12}")
+    for size in args.sizes:
+        words = set(moderation._EXTRA_WORDS) | set(_random_words(size))
+
+        pf = ProfanityFilter(extra_censor_list=list(words))
+
+        def old_check(text: str) -> bool:
+            low = text.lower()
+            for bad in words:
+                if bad in low:
+                    return True
+            return pf.is_profane(text)
+
+        started = time.perf_counter()
+        matcher = ProfanityMatcher(substrings=words, words=library_words)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        old = _throughput(old_check, _MESSAGES, args.seconds)
+        new = _throughput(matcher.search, _MESSAGES, args.seconds)
+        print(f"{size:>8} {build_ms:>10.1f} {old:>12.1f} {new:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Бенчмарк холодного старта: время импорта модулей бота и время
+до готового приложения (build_application + клиент OpenAI).
+Каждый замер — отдельный процесс Python, чтобы модули не были
+закешированы в sys.modules.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Код, который выполняется в дочернем процессе; печатает миллисекунды
+_IMPORT = """
+import time
+started = time.perf_counter()
+import bot.main
+print((time.perf_counter() - started) * 1000)
+"""
+
+_COLD_START = """
+import time
+started = time.perf_counter()
+import bot.main
+from bot.services import moderation, openai_client
+bot.main.build_application()
+openai_client.get_client()
+moderation.get_matcher()
+print((time.perf_counter() - started) * 1000)
+"""
+
+_TOKENS = {"TELEGRAM_BOT_TOKEN": "123456:bench", "OPENAI_API_KEY": "sk-bench"}
+
+
+def _run(code: str, with_tokens: bool) -> float:
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in _TOKENS
+    }
+    if with_tokens:
+        env.update(_TOKENS)
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def _measure(code: str, with_tokens: bool, runs: int) -> str:
+    try:
+        timings = [_run(code, with_tokens) for _ in range(runs)]
+    except RuntimeError as e:
+        return f"failed: {e}"
+    return f"median_ms={statistics.median(timings):.0f} min_ms={min(timings):.0f}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print("import bot.main, no env:   ", _measure(_IMPORT, False, args.runs))
+    print("import bot.main, with env: ", _measure(_IMPORT, True, args.runs))
+    print("cold start, with env:      ", _measure(_COLD_START, True, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Бенчмарк get_last_messages на большой таблице messages:
+до миграции с индексом (user_id, id) и после неё.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_storage --rows 1000000 --users 10000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from bot.config import SETTINGS
+from bot.services import storage
+
+
+def _fill(rows: int, users: int) -> None:
+    shard = storage._get_shard()
+    conn = shard.get_conn()
+    now = datetime.utcnow().isoformat()
+    batch = []
+    with shard.lock:
+        conn.executemany(
+            "INSERT INTO users (user_id, registered_at, last_reset_at) VALUES (?, ?, ?)",
+            ((uid, now, now) for uid in range(users)),
+        )
+        for i in range(rows):
+            role = "user" if i % 2 == 0 else "assistant"
+            batch.append((random.randrange(users), role, f"message {i} " * 8, now))
+            if len(batch) >= 50_000:
+                conn.executemany(
+                    "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    batch,
+                )
+                batch.clear()
+        if batch:
+            conn.executemany(
+                "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+        conn.commit()
+
+
+def _measure(users: int, queries: int) -> dict:
+    timings = []
+    for _ in range(queries):
+        user_id = random.randrange(users)
+        started = time.perf_counter()
+        storage.get_last_messages(user_id, limit=20)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": statistics.median(timings),
+        "p95_ms": timings[int(len(timings) * 0.95) - 1],
+        "max_ms": timings[-1],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        SETTINGS.db_path = os.path.join(tmp, "bench.db")
+        storage.close_db()
+
+        # Исходная схема: таблицы без индекса по user_id
+        storage.migrate(target_version=1)
+        started = time.perf_counter()
+        _fill(args.rows, args.users)
+        print(f"filled {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+        before = _measure(args.users, args.queries)
+        print("before migration:", _format(before))
+
+        started = time.perf_counter()
+        storage.init_db()
+        print(
+            f"migrated to v{storage.get_schema_version()} "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+        after = _measure(args.users, args.queries)
+        print("after migration: ", _format(after))
+        print(f"speedup p50: x{before['p50_ms'] / after['p50_ms']:.0f}")
+
+        storage.close_db()
+
+
+def _format(stats: dict) -> str:
+    return " ".join(f"{key}={value:.3f}" for key, value in stats.items())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+"""
+Сквозной нагрузочный тест: синтетические апдейты Telegram проходят через
+handle_text_message / handle_paraphrase_callback с фейковым Bot API
+и локальной заглушкой OpenAI API на временной SQLite-базе.
+
+Считаем по сценариям:
+- сообщений в секунду и перцентили задержки обработки апдейта;
+- SQL-запросов, вызовов OpenAI и Bot API на одно сообщение;
+- отказы admission, неудачные вызовы модели (failed) и необработанные ошибки;
+- долю токенов промпта, которую заглушка «взяла из кэша префиксов» (cached%).
+
+Запуск из корня проекта:
+
+    python -m benchmarks.load_test --messages 2000 --users 200 --concurrency 64
+    python -m benchmarks.load_test --scenarios clean hot_user --latency-ms 300 --error-rate 0.05
+    python -m benchmarks.load_test --scenarios hot_user --prefix-slack 0
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackContext, ExtBot
+from telegram.request import BaseRequest, RequestData
+
+from bot.config import SETTINGS
+from bot.handlers.callbacks import handle_paraphrase_callback
+from bot.handlers.messages import handle_text_message
+from bot.http_server import HttpServer, Request, Response
+from bot.services import admission, metrics, openai_client, result_cache, storage, usage
+from bot.services.context_window import count_message_tokens
+
+CLEAN_MESSAGES = [
+    "Привет! Подскажи, как написать функцию сортировки на Python?",
+    "Расскажи коротко про историю Казани и что там посмотреть летом.",
+    "Объясни простыми словами, что такое градиентный спуск.",
+    "Какие книги почитать, чтобы лучше понимать экономику?",
+    "What is the difference between a list and a tuple in Python?",
+]
+PROFANE_MESSAGES = [
+    "ну ты и сука, ничего не понимаешь",
+    "бля, опять ничего не работает",
+]
+# Такие сообщения заглушка модерации помечает как нарушающие правила
+FLAGGED_MESSAGES = [
+    "я тебя ненавижу и найду",
+]
+_FLAG_MARKERS = ("ненавижу",)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+# --- Заглушка OpenAI API ---
+
+
+class OpenAIStub:
+    """
+    Локальный HTTP-сервер с эндпоинтами /v1/chat/completions (включая SSE
+    при stream=true) и /v1/moderations. Задержка — логнормальная
+    с медианой latency_ms, error_rate — доля ответов 500, slow_rate —
+    доля «хвостовых» ответов в 10 раз медленнее.
+
+    usage считается как у провайдера с кэшем префиксов: cached_tokens —
+    самый длинный уже встречавшийся префикс из целых сообщений, если он
+    не короче _CACHE_MIN_TOKENS, округлённый вниз до _CACHE_STEP.
+    """
+
+    _CACHE_MIN_TOKENS = 1024
+    _CACHE_STEP = 128
+
+    def __init__(
+        self, latency_ms: float, error_rate: float, slow_rate: float = 0.0, seed: int = 1
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.calls: Counter = Counter()
+        self._random = random.Random(seed)
+        self._prefixes: set = set()
+        self.server = HttpServer("127.0.0.1", 0)
+        self.server.route("POST", "/v1/chat/completions", self._chat)
+        self.server.route("POST", "/v1/moderations", self._moderations)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.port}/v1"
+
+    async def _delay(self) -> Optional[Response]:
+        if self.latency_ms > 0:
+            seconds = self._random.lognormvariate(math.log(self.latency_ms / 1000), 0.5)
+            if self._random.random() < self.slow_rate:
+                seconds *= 10
+            await asyncio.sleep(seconds)
+        if self._random.random() < self.error_rate:
+            self.calls["error"] += 1
+            body = {"error": {"message": "stub error", "type": "server_error"}}
+            return Response(
+                status=500,
+                body=json.dumps(body).encode(),
+                content_type="application/json",
+            )
+        return None
+
+    def _usage(self, messages: List[Dict[str, str]], answer: str) -> Dict[str, Any]:
+        digest = hashlib.sha1()
+        prompt = cached = 0
+        for message in messages:
+            digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode())
+            prompt += count_message_tokens(message)
+            key = digest.hexdigest()
+            if key in self._prefixes:
+                cached = prompt
+            self._prefixes.add(key)
+        if cached < self._CACHE_MIN_TOKENS:
+            cached = 0
+        completion = count_message_tokens({"content": answer})
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "prompt_tokens_details": {"cached_tokens": cached - cached % self._CACHE_STEP},
+        }
+
+    async def _chat(self, request: Request) -> Response:
+        payload = json.loads(request.body)
+        self.calls["chat"] += 1
+        error = await self._delay()
+        if error is not None:
+            return error
+
+        question = payload["messages"][-1]["content"]
+        answer = f"Ответ на вопрос ({len(question)} символов): " + "текст ответа " * 20
+        model = payload.get("model", "stub")
+        usage_block = self._usage(payload["messages"], answer)
+        if payload.get("stream"):
+            events = []
+            for piece in answer.split(" "):
+                chunk = {
+                    "id": "stub",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "delta": {"content": piece + " "}, "finish_reason": None}
+                    ],
+                }
+                events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                chunk = {
+                    "id": "stub",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage_block,
+                }
+                events.append(f"data: {json.dumps(chunk)}\n\n")
+            events.append("data: [DONE]\n\n")
+            return Response(
+                body="".join(events).encode(),
+                content_type="text/event-stream",
+            )
+
+        body = {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage_block,
+        }
+        return Response(body=json.dumps(body).encode(), content_type="application/json")
+
+    async def _moderations(self, request: Request) -> Response:
+        payload = json.loads(request.body)
+        self.calls["moderation"] += 1
+        error = await self._delay()
+        if error is not None:
+            return error
+
+        inputs = payload["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        results = []
+        for text in inputs:
+            flagged = any(marker in text.lower() for marker in _FLAG_MARKERS)
+            results.append(
+                {
+                    "flagged": flagged,
+                    "categories": {"harassment": flagged},
+                    "category_scores": {"harassment": 0.9 if flagged else 0.0},
+                }
+            )
+        body = {"id": "stub", "model": payload.get("model"), "results": results}
+        return Response(body=json.dumps(body).encode(), content_type="application/json")
+
+
+# --- Фейковый Bot API ---
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Вместо HTTP-запросов к Telegram отвечаем правдоподобным JSON.
+    Сообщения с inline-клавиатурой запоминаем, чтобы потом «нажать» кнопку.
+    """
+
+    def __init__(self, latency_ms: float = 0.0) -> None:
+        self.latency_ms = latency_ms
+        self.calls: Counter = Counter()
+        self.keyboards: Dict[int, Dict[str, Any]] = {}
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000)
+        params = request_data.parameters if request_data is not None else {}
+
+        result: Any = True
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            message_id = params.get("message_id") or next(self._message_ids)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                "text": params.get("text", ""),
+            }
+            markup = params.get("reply_markup")
+            if isinstance(markup, dict) and markup.get("inline_keyboard"):
+                result["reply_markup"] = markup
+                self.keyboards[chat_id] = result
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# --- Подсчёт SQL-запросов ---
+
+
+class _SqlCounter:
+    def __init__(self) -> None:
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, statement: str) -> None:
+        if statement.startswith("PRAGMA"):
+            return
+        with self._lock:
+            self.count += 1
+
+
+_sql = _SqlCounter()
+_original_connect = storage._connect
+
+
+def _counting_connect(path: str):
+    conn = _original_connect(path)
+    conn.set_trace_callback(_sql)
+    return conn
+
+
+storage._connect = _counting_connect
+
+
+# --- Сценарии ---
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": f"User{user_id}",
+        "username": f"user{user_id}",
+    }
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def _callback_update(update_id: int, user_id: int, keyboard_message: Dict[str, Any]) -> Dict[str, Any]:
+    data = keyboard_message["reply_markup"]["inline_keyboard"][0][0]["callback_data"]
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "bench",
+            "from": _user(user_id),
+            "data": data,
+            "message": keyboard_message,
+        },
+    }
+
+
+def _scenario_traffic(name: str, messages: int, users: int, base_user: int) -> List[Tuple[int, str]]:
+    rnd = random.Random(name)
+    traffic = []
+    for i in range(messages):
+        if name == "hot_user":
+            user_id = base_user
+        else:
+            user_id = base_user + rnd.randrange(users)
+        if name == "profanity_wave":
+            # Волна одинаковых грубостей вперемешку с обычными вопросами
+            text = rnd.choice(PROFANE_MESSAGES) if i % 2 == 0 else rnd.choice(CLEAN_MESSAGES)
+        elif name == "moderation_wave":
+            text = rnd.choice(FLAGGED_MESSAGES) if i % 2 == 0 else rnd.choice(CLEAN_MESSAGES)
+        else:
+            text = rnd.choice(CLEAN_MESSAGES)
+        traffic.append((user_id, text))
+    return traffic
+
+
+SCENARIOS = ("clean", "profanity_wave", "moderation_wave", "many_users", "hot_user")
+
+
+async def _run_scenario(
+    name: str,
+    args: argparse.Namespace,
+    application,
+    telegram: FakeTelegramRequest,
+    stub: OpenAIStub,
+    base_user: int,
+) -> Dict[str, Any]:
+    users = args.users * 10 if name == "many_users" else args.users
+    traffic = _scenario_traffic(name, args.messages, users, base_user)
+
+    sql_before = _sql.count
+    tg_before = sum(telegram.calls.values())
+    openai_before = sum(v for k, v in stub.calls.items() if k != "error")
+    rejected_before = sum(
+        admission.get_stats()[k] for k in ("rejected_queue_full", "rejected_rate_limited")
+    )
+    failed_before = _failed_calls()
+    prompt_before, cached_before = _prompt_tokens()
+    errors = 0
+    latencies: List[float] = []
+    callback_latencies: List[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    update_ids = itertools.count(1)
+
+    async def process(data: Dict[str, Any], handler, sink: List[float]) -> None:
+        nonlocal errors
+        update = Update.de_json(data, application.bot)
+        context = CallbackContext.from_update(update, application)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await handler(update, context)
+            except Exception:
+                errors += 1
+            sink.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            process(_message_update(next(update_ids), user_id, text), handle_text_message, latencies)
+            for user_id, text in traffic
+        )
+    )
+
+    # Часть пользователей соглашается на предложенный вариант перефразирования
+    rnd = random.Random(name + ":accept")
+    keyboards = [
+        (chat_id, message)
+        for chat_id, message in telegram.keyboards.items()
+        if chat_id >= base_user and rnd.random() < args.accept_rate
+    ]
+    telegram.keyboards.clear()
+    await asyncio.gather(
+        *(
+            process(
+                _callback_update(next(update_ids), chat_id, message),
+                handle_paraphrase_callback,
+                callback_latencies,
+            )
+            for chat_id, message in keyboards
+        )
+    )
+    await storage.flush()
+    elapsed = time.perf_counter() - started
+
+    total = len(latencies) + len(callback_latencies)
+    prompt_after, cached_after = _prompt_tokens()
+    prompt_tokens = prompt_after - prompt_before
+    rejected_after = sum(
+        admission.get_stats()[k] for k in ("rejected_queue_full", "rejected_rate_limited")
+    )
+    return {
+        "scenario": name,
+        "updates": total,
+        "per_sec": total / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "callbacks": len(callback_latencies),
+        "sql_per_msg": (_sql.count - sql_before) / total if total else 0.0,
+        "openai_per_msg": (
+            sum(v for k, v in stub.calls.items() if k != "error") - openai_before
+        ) / total if total else 0.0,
+        "tg_per_msg": (sum(telegram.calls.values()) - tg_before) / total if total else 0.0,
+        "rejected": rejected_after - rejected_before,
+        "failed": _failed_calls() - failed_before,
+        "cached_pct": (
+            100 * (cached_after - cached_before) / prompt_tokens if prompt_tokens else 0.0
+        ),
+        "errors": errors,
+    }
+
+
+def _prompt_tokens() -> Tuple[int, int]:
+    stats = usage.get_stats().values()
+    return (
+        sum(s["prompt_tokens"] for s in stats),
+        sum(s["cached_tokens"] for s in stats),
+    )
+
+
+def _failed_calls() -> float:
+    # Ответы, которые пользователь получил вместо результата модели
+    return sum(metrics.errors_total.value(stage=stage) for stage in ("answer", "paraphrase"))
+
+
+def _format_row(row: Dict[str, Any]) -> str:
+    return (
+        f"{row['scenario']:<16} {row['updates']:>7} {row['per_sec']:>9.1f} "
+        f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+        f"{row['sql_per_msg']:>8.2f} {row['openai_per_msg']:>8.2f} "
+        f"{row['tg_per_msg']:>6.2f} {row['rejected']:>8} {row['failed']:>6.0f} "
+        f"{row['cached_pct']:>7.1f} {row['errors']:>6}"
+    )
+
+
+async def _main(args: argparse.Namespace) -> None:
+    stub = OpenAIStub(
+        latency_ms=args.latency_ms, error_rate=args.error_rate, slow_rate=args.slow_rate
+    )
+    await stub.server.start()
+    SETTINGS.openai_max_retries = args.openai_retries
+    openai_client.get_client().base_url = stub.base_url
+
+    telegram = FakeTelegramRequest(latency_ms=args.telegram_latency_ms)
+    bot = ExtBot(SETTINGS.telegram_token, request=telegram, get_updates_request=telegram)
+    application = ApplicationBuilder().bot(bot).updater(None).build()
+
+    print(
+        f"{'scenario':<16} {'updates':>7} {'upd/s':>9} {'p50, ms':>8} {'p95, ms':>8} "
+        f"{'p99, ms':>8} {'sql/msg':>8} {'oai/msg':>8} {'tg/msg':>6} {'rejected':>8} {'failed':>6} "
+        f"{'cached%':>7} {'errors':>6}"
+    )
+    async with application:
+        await application.start()
+        try:
+            for index, name in enumerate(args.scenarios):
+                # Каждый сценарий — на чистой базе и пустых кэшах
+                storage.close_db()
+                result_cache.moderation_cache.clear()
+                result_cache.paraphrase_cache.clear()
+                storage.init_db()
+                row = await _run_scenario(
+                    name, args, application, telegram, stub, base_user=(index + 1) * 1_000_000
+                )
+                print(_format_row(row))
+        finally:
+            await application.stop()
+            await stub.server.stop()
+            storage.close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="медиана задержки OpenAI")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов OpenAI с ошибкой 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля ответов OpenAI в 10 раз медленнее")
+    parser.add_argument("--openai-retries", type=int, default=0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=5.0)
+    parser.add_argument("--accept-rate", type=float, default=0.5, help="доля нажатий «Отправить этот вариант»")
+    parser.add_argument("--stream", action="store_true", help="STREAM_ANSWERS=1")
+    parser.add_argument("--speculative", action="store_true", help="SPECULATIVE_ANSWERS=1")
+    parser.add_argument("--write-behind", action="store_true", help="DB_WRITE_BEHIND=1")
+    parser.add_argument("--answer-cache", action="store_true", help="ANSWER_CACHE=1")
+    parser.add_argument("--hedge", action="store_true", help="HEDGE_REQUESTS=1")
+    parser.add_argument(
+        "--prefix-slack",
+        type=float,
+        default=SETTINGS.context_prefix_slack,
+        help="CONTEXT_PREFIX_SLACK (0 — окно истории сдвигается на каждом ходе)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Наружу запросы не уходят, токены нужны только для формы
+        SETTINGS.telegram_token = SETTINGS.telegram_token or "123456:bench"
+        SETTINGS.openai_api_key = SETTINGS.openai_api_key or "sk-bench"
+        SETTINGS.db_path = os.path.join(tmp, "load.db")
+        SETTINGS.stream_answers = args.stream
+        SETTINGS.speculative_answers = args.speculative
+        SETTINGS.db_write_behind = args.write_behind
+        SETTINGS.answer_cache_enabled = args.answer_cache
+        SETTINGS.hedge_requests = args.hedge
+        SETTINGS.context_prefix_slack = args.prefix_slack
+        asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import os
 import sys
+import threading
 from dataclasses import dataclass
+from typing import Any, Callable, Optional
 
 
 @dataclass
@@ -8,7 +10,123 @@ class Settings:
     telegram_token: str
     openai_api_key: str
     db_path: str = "bot.db"
+    # Число файлов SQLite, по которым users/messages делятся по user_id
+    # (1 — один файл; менять только через python -m bot.tools.reshard)
+    db_shards: int = 1
+    # Режим write-behind: запись через отдельный поток с групповыми коммитами
+    db_write_behind: bool = False
+    # Максимум операций в одной транзакции писателя
+    db_batch_size: int = 100
+    # Сколько миллисекунд писатель ждёт, набирая пачку
+    db_batch_interval_ms: float = 5.0
+    # Кэш строк users в памяти: максимум записей и время жизни, сек
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 600.0
+    # Сколько последних сообщений диалога отправляем модели как контекст
+    dialog_context_limit: int = 20
+    # Бюджет памяти на буферы контекста активных диалогов, МБ
+    dialog_context_memory_mb: float = 64.0
+    # Бюджет токенов на историю диалога в одном запросе к модели
+    context_token_budget: int = 1500
+    # Сколько вышедших из окна сообщений копим, прежде чем обновить summary
+    summary_min_messages: int = 4
+    # Доля бюджета, которую освобождаем, когда окну истории приходится
+    # сдвинуться: дальше несколько ходов начало промпта не меняется
+    # и провайдер берёт его из кэша (0 — сдвиг на каждом ходе)
+    context_prefix_slack: float = 0.25
+    # Ограничение длины summary, слов
+    summary_max_words: int = 150
     chat_model: str = "gpt-4.1-mini"
+    # Дешёвая быстрая модель для коротких вопросов, summary и перефразирования
+    # (пусто — всё идёт в chat_model) и отдельная модель перефразирования
+    fast_model: Optional[str] = None
+    paraphrase_model: Optional[str] = None
+    # Вопрос «короткий», если не длиннее стольких символов и контекста не больше N сообщений
+    route_short_chars: int = 200
+    route_max_context: int = 4
+    # Если сглаженная задержка модели выше, сек, — пробуем другую (0 — выключено)
+    route_latency_slo: float = 0.0
+    # Сколько одновременных HTTP-соединений к OpenAI держим в пуле
+    openai_max_connections: int = 200
+    # Сколько секунд держать простаивающее keep-alive соединение
+    openai_keepalive_expiry: float = 30.0
+    # Таймауты запросов к OpenAI: установка соединения и весь запрос, сек
+    openai_connect_timeout: float = 5.0
+    openai_timeout: float = 60.0
+    # Повторы запроса при таймаутах, сетевых ошибках, 429 и 5xx (resilience.call)
+    openai_max_retries: int = 2
+    # Дедлайн на вызов вместе с повторами: ответ/перефразирование и модерация, сек
+    openai_deadline: float = 40.0
+    moderation_deadline: float = 5.0
+    # Circuit breaker: сколько ошибок подряд размыкают и через сколько секунд проба
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: float = 30.0
+    # Хеджирование: второй запрос, если первый дольше наблюдаемого p95
+    hedge_requests: bool = False
+    # Писать токены каждого вызова (prompt, completion, cached) в token_usage;
+    # с DB_WRITE_BEHIND запись уходит в очередь писателя и не ждётся
+    usage_log: bool = True
+    # Передавать prompt_cache_key по пользователю: запросы одного диалога
+    # попадают на один кэш префиксов у провайдера
+    prompt_cache_key: bool = False
+    # Файл с дополнительным словарём мата (одно слово на строку)
+    profanity_lexicon_path: Optional[str] = None
+    # Кэш результатов модерации и перефразирования
+    result_cache_size: int = 10000
+    moderation_cache_ttl: float = 86400.0
+    paraphrase_cache_ttl: float = 86400.0
+    # Дублировать кэш результатов в SQLite, чтобы он переживал перезапуск
+    result_cache_persistent: bool = False
+    # Кэш ответов модели на вопросы без контекста («привет», «что ты умеешь»)
+    answer_cache_enabled: bool = False
+    answer_cache_ttl: float = 3600.0
+    # Кэш применяется, если в контексте не больше стольких сообщений и нет summary
+    answer_cache_max_context: int = 0
+    # Пакетная модерация: окно сбора текстов, мс, и максимум текстов в запросе
+    # (размер пакета 1 — отключить и проверять каждый текст отдельно)
+    moderation_batch_window_ms: float = 20.0
+    moderation_batch_size: int = 32
+    # Сессии перефразирования: время жизни, сек, и максимум в памяти
+    paraphrase_session_ttl: float = 86400.0
+    paraphrase_session_limit: int = 10000
+    # Хранить сессии перефразирования в SQLite (переживают перезапуск)
+    paraphrase_sessions_persistent: bool = False
+    # Спекулятивная генерация ответа параллельно с OpenAI-модерацией
+    speculative_answers: bool = False
+    # Потоковая выдача ответа с прогрессивным редактированием сообщения
+    stream_answers: bool = False
+    # Минимальный интервал между правками сообщения при стриминге, сек
+    stream_edit_interval: float = 1.0
+    # Допуск запросов к модели: одновременно в работе и максимум в очереди
+    admission_max_concurrent: int = 50
+    admission_queue_size: int = 200
+    # Лимит на пользователя: запросов в минуту и сколько можно сразу (0 — без лимита)
+    user_rate_limit: float = 20.0
+    user_rate_burst: int = 5
+    # Сколько апдейтов обрабатывать одновременно (0 — строго по одному)
+    concurrent_updates: int = 64
+    # Очистка старых сообщений: сколько последних хранить на пользователя
+    # и/или сколько дней (0 — правило выключено)
+    retention_keep_messages: int = 0
+    retention_days: float = 0.0
+    retention_interval: float = 3600.0
+    retention_batch_size: int = 500
+    # Каталог для архива удалённых сообщений (.jsonl.gz); пусто — без архива
+    retention_archive_dir: Optional[str] = None
+    # Эндпоинт метрик Prometheus (GET /metrics); порт 0 — выключен
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9464
+    # Режим получения апдейтов: polling или webhook
+    bot_mode: str = "polling"
+    # Публичный URL вебхука; пустой — set_webhook не вызываем (локальная проверка)
+    webhook_url: Optional[str] = None
+    webhook_listen: str = "0.0.0.0"
+    webhook_port: int = 8443
+    webhook_path: str = "/telegram"
+    # Секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token
+    webhook_secret: Optional[str] = None
+    # Число процессов-воркеров; апдейты распределяются по user_id
+    webhook_workers: int = 1
     system_prompt: str = (
         "Ты — дружелюбный и полезный ассистент в Telegram-боте, "
         "созданном в рамках хакатона TATAR SAN командой «Инь Ян». "
@@ -22,11 +140,168 @@ def load_settings() -> Settings:
     tg_token = os.getenv("TELEGRAM_BOT_TOKEN")
     openai_key = os.getenv("OPENAI_API_KEY")
     db_path = os.getenv("DB_PATH", "bot.db")
+    db_shards = int(os.getenv("DB_SHARDS", "1"))
+    db_write_behind = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+    db_batch_size = int(os.getenv("DB_BATCH_SIZE", "100"))
+    db_batch_interval_ms = float(os.getenv("DB_BATCH_INTERVAL_MS", "5"))
+    user_cache_size = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    user_cache_ttl = float(os.getenv("USER_CACHE_TTL", "600"))
+    dialog_context_limit = int(os.getenv("DIALOG_CONTEXT_LIMIT", "20"))
+    dialog_context_memory_mb = float(os.getenv("DIALOG_CONTEXT_MEMORY_MB", "64"))
+    context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+    summary_min_messages = int(os.getenv("SUMMARY_MIN_MESSAGES", "4"))
+    context_prefix_slack = float(os.getenv("CONTEXT_PREFIX_SLACK", "0.25"))
+    chat_model = os.getenv("CHAT_MODEL", "gpt-4.1-mini")
+    fast_model = os.getenv("FAST_MODEL") or None
+    paraphrase_model = os.getenv("PARAPHRASE_MODEL") or None
+    route_short_chars = int(os.getenv("ROUTE_SHORT_CHARS", "200"))
+    route_max_context = int(os.getenv("ROUTE_MAX_CONTEXT", "4"))
+    route_latency_slo = float(os.getenv("ROUTE_LATENCY_SLO", "0"))
+    openai_max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+    openai_keepalive_expiry = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+    openai_connect_timeout = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+    openai_timeout = float(os.getenv("OPENAI_TIMEOUT", "60"))
+    openai_max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+    openai_deadline = float(os.getenv("OPENAI_DEADLINE", "40"))
+    moderation_deadline = float(os.getenv("MODERATION_DEADLINE", "5"))
+    circuit_failure_threshold = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    circuit_reset_timeout = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+    hedge_requests = os.getenv("HEDGE_REQUESTS", "0") == "1"
+    usage_log = os.getenv("USAGE_LOG", "1") == "1"
+    prompt_cache_key = os.getenv("PROMPT_CACHE_KEY", "0") == "1"
+    profanity_lexicon_path = os.getenv("PROFANITY_LEXICON_PATH") or None
+    result_cache_size = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+    moderation_cache_ttl = float(os.getenv("MODERATION_CACHE_TTL", "86400"))
+    paraphrase_cache_ttl = float(os.getenv("PARAPHRASE_CACHE_TTL", "86400"))
+    result_cache_persistent = os.getenv("RESULT_CACHE_PERSISTENT", "0") == "1"
+    answer_cache_enabled = os.getenv("ANSWER_CACHE", "0") == "1"
+    answer_cache_ttl = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    answer_cache_max_context = int(os.getenv("ANSWER_CACHE_MAX_CONTEXT", "0"))
+    moderation_batch_window_ms = float(os.getenv("MODERATION_BATCH_WINDOW_MS", "20"))
+    moderation_batch_size = int(os.getenv("MODERATION_BATCH_SIZE", "32"))
+    paraphrase_session_ttl = float(os.getenv("PARAPHRASE_SESSION_TTL", "86400"))
+    paraphrase_session_limit = int(os.getenv("PARAPHRASE_SESSION_LIMIT", "10000"))
+    paraphrase_sessions_persistent = (
+        os.getenv("PARAPHRASE_SESSIONS_PERSISTENT", "0") == "1"
+    )
+    speculative_answers = os.getenv("SPECULATIVE_ANSWERS", "0") == "1"
+    stream_answers = os.getenv("STREAM_ANSWERS", "0") == "1"
+    stream_edit_interval = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+    admission_max_concurrent = int(os.getenv("ADMISSION_MAX_CONCURRENT", "50"))
+    admission_queue_size = int(os.getenv("ADMISSION_QUEUE_SIZE", "200"))
+    user_rate_limit = float(os.getenv("USER_RATE_LIMIT", "20"))
+    user_rate_burst = int(os.getenv("USER_RATE_BURST", "5"))
+    concurrent_updates = int(os.getenv("CONCURRENT_UPDATES", "64"))
+    retention_keep_messages = int(os.getenv("RETENTION_KEEP_MESSAGES", "0"))
+    retention_days = float(os.getenv("RETENTION_DAYS", "0"))
+    retention_interval = float(os.getenv("RETENTION_INTERVAL", "3600"))
+    retention_batch_size = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+    retention_archive_dir = os.getenv("RETENTION_ARCHIVE_DIR") or None
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+    metrics_port = int(os.getenv("METRICS_PORT", "9464"))
+    bot_mode = os.getenv("BOT_MODE", "polling").strip().lower()
+    webhook_url = os.getenv("WEBHOOK_URL") or None
+    webhook_listen = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    webhook_port = int(os.getenv("WEBHOOK_PORT", "8443"))
+    webhook_path = os.getenv("WEBHOOK_PATH", "/telegram")
+    webhook_secret = os.getenv("WEBHOOK_SECRET") or None
+    webhook_workers = int(os.getenv("WEBHOOK_WORKERS", "1"))
+
+    return Settings(
+        telegram_token=tg_token or "",
+        openai_api_key=openai_key or "",
+        db_path=db_path,
+        db_shards=db_shards,
+        db_write_behind=db_write_behind,
+        db_batch_size=db_batch_size,
+        db_batch_interval_ms=db_batch_interval_ms,
+        user_cache_size=user_cache_size,
+        user_cache_ttl=user_cache_ttl,
+        dialog_context_limit=dialog_context_limit,
+        dialog_context_memory_mb=dialog_context_memory_mb,
+        context_token_budget=context_token_budget,
+        summary_min_messages=summary_min_messages,
+        context_prefix_slack=context_prefix_slack,
+        chat_model=chat_model,
+        fast_model=fast_model,
+        paraphrase_model=paraphrase_model,
+        route_short_chars=route_short_chars,
+        route_max_context=route_max_context,
+        route_latency_slo=route_latency_slo,
+        openai_max_connections=openai_max_connections,
+        openai_keepalive_expiry=openai_keepalive_expiry,
+        openai_connect_timeout=openai_connect_timeout,
+        openai_timeout=openai_timeout,
+        openai_max_retries=openai_max_retries,
+        openai_deadline=openai_deadline,
+        moderation_deadline=moderation_deadline,
+        circuit_failure_threshold=circuit_failure_threshold,
+        circuit_reset_timeout=circuit_reset_timeout,
+        hedge_requests=hedge_requests,
+        usage_log=usage_log,
+        prompt_cache_key=prompt_cache_key,
+        profanity_lexicon_path=profanity_lexicon_path,
+        result_cache_size=result_cache_size,
+        moderation_cache_ttl=moderation_cache_ttl,
+        paraphrase_cache_ttl=paraphrase_cache_ttl,
+        result_cache_persistent=result_cache_persistent,
+        answer_cache_enabled=answer_cache_enabled,
+        answer_cache_ttl=answer_cache_ttl,
+        answer_cache_max_context=answer_cache_max_context,
+        moderation_batch_window_ms=moderation_batch_window_ms,
+        moderation_batch_size=moderation_batch_size,
+        paraphrase_session_ttl=paraphrase_session_ttl,
+        paraphrase_session_limit=paraphrase_session_limit,
+        paraphrase_sessions_persistent=paraphrase_sessions_persistent,
+        speculative_answers=speculative_answers,
+        stream_answers=stream_answers,
+        stream_edit_interval=stream_edit_interval,
+        admission_max_concurrent=admission_max_concurrent,
+        admission_queue_size=admission_queue_size,
+        user_rate_limit=user_rate_limit,
+        user_rate_burst=user_rate_burst,
+        concurrent_updates=concurrent_updates,
+        retention_keep_messages=retention_keep_messages,
+        retention_days=retention_days,
+        retention_interval=retention_interval,
+        retention_batch_size=retention_batch_size,
+        retention_archive_dir=retention_archive_dir,
+        metrics_host=metrics_host,
+        metrics_port=metrics_port,
+        bot_mode=bot_mode,
+        webhook_url=webhook_url,
+        webhook_listen=webhook_listen,
+        webhook_port=webhook_port,
+        webhook_path=webhook_path,
+        webhook_secret=webhook_secret,
+        webhook_workers=webhook_workers,
+    )
+
+
+_settings: Optional[Settings] = None
 
+
+def get_settings() -> Settings:
+    """
+    Настройки читаются из окружения при первом обращении, а не при
+    импорте: модули бота можно импортировать без токенов (тесты,
+    утилиты, бенчмарки).
+    """
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
+
+
+def check_required() -> None:
+    """
+    Проверка перед запуском бота: без токенов работать нельзя.
+    """
+    settings = get_settings()
     missing = []
-    if not tg_token:
+    if not settings.telegram_token:
         missing.append("TELEGRAM_BOT_TOKEN")
-    if not openai_key:
+    if not settings.openai_api_key:
         missing.append("OPENAI_API_KEY")
 
     if missing:
@@ -35,11 +310,58 @@ def load_settings() -> Settings:
         )
         sys.exit(1)
 
-    return Settings(
-        telegram_token=tg_token,
-        openai_api_key=openai_key,
-        db_path=db_path,
-    )
 
+class _LazySettings:
+    """
+    SETTINGS — прокси к get_settings(): чтение и запись атрибутов
+    уходят в настоящий объект Settings.
+    """
+
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(get_settings(), name, value)
+
+    def __repr__(self) -> str:
+        return repr(get_settings())
+
+
+SETTINGS: Settings = _LazySettings()  # type: ignore[assignment]
+
+
+class Lazy:
+    """
+    Прокси к объекту, который строится из настроек при первом обращении:
+    кэши, breaker-ы, контроллеры уровня модуля. При импорте модуля
+    SETTINGS не читаются, а тесты и утилиты успевают поменять настройки
+    до того, как объект понадобится.
+    """
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get(self) -> Any:
+        target = self._target
+        if target is None:
+            # Кэши storage трогают и потоки-писатели: строим ровно один раз
+            with self._lock:
+                target = self._target
+                if target is None:
+                    target = self._factory()
+                    object.__setattr__(self, "_target", target)
+        return target
+
+    def __getattr__(self, name: str):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._get(), name, value)
+
+    def __len__(self) -> int:
+        return len(self._get())
 
-SETTINGS = load_settings()
+    def __repr__(self) -> str:
+        return f"Lazy({self._get()!r})"
@@ -1,30 +1,45 @@
 import logging
-from typing import Dict
-from uuid import uuid4
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from bot.services import storage, ai_client
+from bot.config import SETTINGS
+from bot.services import (
+    storage,
+    ai_client,
+    context_window,
+    admission,
+    metrics,
+    resilience,
+)
+from bot.services.sessions import paraphrase_sessions
+from bot.services.user_locks import user_locks
 
 logger = logging.getLogger(__name__)
 
-PENDING_PARAPHRASES: Dict[str, Dict] = {}
 
-
-def create_paraphrase_session(user_id: int, original: str, paraphrased: str) -> str:
-    token = str(uuid4())
-    PENDING_PARAPHRASES[token] = {
-        "user_id": user_id,
-        "original": original,
-        "paraphrased": paraphrased,
-    }
-    return token
+async def create_paraphrase_session(
+    user_id: int, original: str, paraphrased: str
+) -> str:
+    return await paraphrase_sessions.create(user_id, original, paraphrased)
 
 
 async def handle_paraphrase_callback(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
+) -> None:
+    query = update.callback_query
+    if not query:
+        return
+    # Нажатие кнопки встаёт в ту же очередь, что и сообщения пользователя
+    with metrics.stage_seconds.time(stage="handle_callback"):
+        async with user_locks.hold(query.from_user.id):
+            await _process_paraphrase_callback(update, context)
+
+
+async def _process_paraphrase_callback(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
 ) -> None:
     query = update.callback_query
     await query.answer()
@@ -38,7 +53,7 @@ async def handle_paraphrase_callback(
     except ValueError:
         return
 
-    session = PENDING_PARAPHRASES.get(token)
+    session = await paraphrase_sessions.get(token)
     if not session:
         await query.edit_message_text(
             "Сессия перефразирования уже недоступна. Попробуйте сформулировать запрос заново."
@@ -51,16 +66,38 @@ async def handle_paraphrase_callback(
         return
 
     if action == "PARAPHRASE_ACCEPT":
+        # Забираем сессию сразу: повторное нажатие уже ничего не отправит
+        if await paraphrase_sessions.pop(token) is None:
+            return
         paraphrased = session["paraphrased"]
-        PENDING_PARAPHRASES.pop(token, None)
 
-        dialog = storage.get_last_messages(user_id, limit=20)
-        answer = ai_client.generate_answer(dialog, paraphrased)
+        dialog = storage.get_last_messages(
+            user_id, limit=SETTINGS.dialog_context_limit
+        )
+        window = context_window.build_window(user_id, dialog, paraphrased)
+        try:
+            with metrics.stage_seconds.time(stage="answer"):
+                answer = await ai_client.generate_answer(
+                    window.history, paraphrased, window.summary, user_id=user_id
+                )
+        except (admission.AdmissionRejected, resilience.CircuitOpen) as e:
+            # Возвращаем сессию, чтобы кнопку можно было нажать ещё раз
+            await paraphrase_sessions.restore(token, session)
+            await query.edit_message_text(
+                f"{e.user_text}\n\nВариант: «{paraphrased}»",
+                reply_markup=query.message.reply_markup,
+            )
+            return
 
         storage.add_message(user_id, "user", paraphrased)
         storage.add_message(user_id, "assistant", answer)
         storage.increment_requests(user_id, 1)
 
+        if context_window.needs_fold(window):
+            context.application.create_task(
+                context_window.fold_overflow(user_id, window)
+            )
+
         await query.edit_message_text(
             text=(
                 "Отправляю перефразированный запрос и отвечаю на него:\n\n"
@@ -69,7 +106,7 @@ async def handle_paraphrase_callback(
             )
         )
     elif action == "PARAPHRASE_REJECT":
-        PENDING_PARAPHRASES.pop(token, None)
+        await paraphrase_sessions.pop(token)
         await query.edit_message_text(
             "Окей, не буду отправлять этот вариант 😊\n"
             "Ты можешь сам отредактировать свой запрос и прислать его заново — "
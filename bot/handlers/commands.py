@@ -4,6 +4,7 @@ from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from bot.services import storage
+from bot.services.user_locks import user_locks
 
 START_KEYBOARD = ReplyKeyboardMarkup(
     [
@@ -20,7 +21,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     username: Optional[str] = user.username
     first_name: Optional[str] = user.first_name
 
-    storage.get_or_create_user(user_id, username, first_name)
+    # Тот же замок, что у обработчика сообщений: запись пользователя
+    # не пересекается с его же сообщением, которое обрабатывается сейчас
+    async with user_locks.hold(user_id):
+        await storage.get_or_create_user_async(user_id, username, first_name)
 
     text = (
         f"Привет, {first_name or 'друг'}! 👋\n\n"
@@ -65,9 +69,16 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user = update.effective_user
     if not user:
         return
-    user_id = user.id
+    async with user_locks.hold(user.id):
+        await reset_dialog(update, context)
+
 
-    storage.reset_dialog(user_id)
+async def reset_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Сброс контекста без захвата замка пользователя — для обработчика
+    сообщений, который уже его держит (кнопка «Сбросить контекст»).
+    """
+    storage.reset_dialog(update.effective_user.id)
 
     text = (
         "Контекст нашего диалога очищен 🧹\n"
@@ -1,10 +1,24 @@
 import logging
+import time
+from typing import Optional
 
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Message, Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
 
-from bot.services import storage, moderation, ai_client
+from bot.config import SETTINGS
+from bot.services import (
+    storage,
+    moderation,
+    ai_client,
+    streaming,
+    context_window,
+    admission,
+    metrics,
+    resilience,
+)
+from bot.services.speculation import Speculation
+from bot.services.user_locks import user_locks
 from bot.handlers.callbacks import create_paraphrase_session
 from bot.handlers import commands
 
@@ -14,7 +28,40 @@ MAX_MESSAGE_LENGTH = 2000
 MAX_VIOLATIONS_BEFORE_MUTE = 3
 
 
+async def _reply_or_edit(
+    message: Message,
+    placeholder: Optional[Message],
+    text: str,
+) -> None:
+    # Если уже отправлена заглушка стриминга — заменяем её текст, иначе отвечаем
+    if placeholder is not None:
+        await placeholder.edit_text(text)
+    else:
+        await message.reply_text(text)
+
+
+def _build_window(user_id: int, text: str) -> context_window.ContextWindow:
+    dialog = storage.get_last_messages(
+        user_id, limit=SETTINGS.dialog_context_limit
+    )
+    return context_window.build_window(user_id, dialog, text)
+
+
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Сообщения одного пользователя обрабатываем строго по очереди: иначе
+    при concurrent_updates две быстрые реплики читают историю до того,
+    как любая из них запишется. Разные пользователи идут параллельно.
+    """
+    user = update.effective_user
+    if not update.message or not user:
+        return
+    with metrics.stage_seconds.time(stage="handle_message"):
+        async with user_locks.hold(user.id):
+            await _process_text_message(update, context)
+
+
+async def _process_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.message
     if not message:
         return
@@ -23,6 +70,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not user:
         return
 
+    started = time.monotonic()
     user_id = user.id
     username = user.username
     first_name = user.first_name
@@ -35,7 +83,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     if text == "🧹 Сбросить контекст":
-        await commands.reset_command(update, context)
+        await commands.reset_dialog(update, context)
         return
 
     if text == "💬 Задать вопрос":
@@ -53,7 +101,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
     # Регистрируем / обновляем пользователя
-    user_row = storage.get_or_create_user(user_id, username, first_name)
+    user_row = await storage.get_or_create_user_async(user_id, username, first_name)
 
     # --- ПОВЕДЕНИЕ, ЕСЛИ ПОЛЬЗОВАТЕЛЬ В МЬЮТЕ ---
     if user_row.get("is_muted"):
@@ -87,8 +135,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
     # -------- ЛОКАЛЬНЫЙ ФИЛЬТР МАТА --------
-    if moderation.contains_local_profanity(text):
-        new_count = storage.increment_violations(user_id, 1)
+    with metrics.stage_seconds.time(stage="local_profanity"):
+        has_profanity = moderation.contains_local_profanity(text)
+    if has_profanity:
+        new_count = await storage.increment_violations_async(user_id, 1)
         logger.info(
             "LOCAL_PROFANITY_DETECTED user_id=%s violations=%s text=%r",
             user_id,
@@ -107,8 +157,15 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
 
         # Пытаемся перефразировать через OpenAI
         try:
-            paraphrased = ai_client.paraphrase_message(text, reason="profanity")
+            with metrics.stage_seconds.time(stage="paraphrase"):
+                paraphrased = await ai_client.paraphrase_message(
+                    text, reason="profanity", user_id=user_id
+                )
+        except (admission.AdmissionRejected, resilience.CircuitOpen) as e:
+            await message.reply_text(e.user_text)
+            return
         except Exception as e:
+            metrics.errors_total.inc(stage="paraphrase")
             logger.exception(
                 "PARAPHRASE_ERROR_LOCAL user_id=%s error=%s", user_id, e
             )
@@ -119,7 +176,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return
 
-        token = create_paraphrase_session(user_id, text, paraphrased)
+        token = await create_paraphrase_session(user_id, text, paraphrased)
 
         keyboard = InlineKeyboardMarkup(
             [
@@ -148,9 +205,31 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     # -------- MODERATION OPENAI --------
-    mod_result = moderation.check_openai_moderation(text)
+    # В спекулятивном режиме ответ начинает генерироваться одновременно
+    # с модерацией и показывается, только если модерация пройдена.
+    window = None
+    speculation = None
+    if SETTINGS.speculative_answers:
+        window = _build_window(user_id, text)
+        speculation = Speculation(
+            ai_client.stream_answer(
+                window.history, text, window.summary, user_id=user_id
+            ),
+            prompt_tokens=window.stats.prompt_tokens,
+        )
+
+    try:
+        with metrics.stage_seconds.time(stage="openai_moderation"):
+            mod_result = await moderation.check_openai_moderation(text)
+    except BaseException:
+        if speculation is not None:
+            await speculation.discard()
+        raise
+
     if mod_result.blocked:
-        new_count = storage.increment_violations(user_id, 1)
+        if speculation is not None:
+            await speculation.discard()
+        new_count = await storage.increment_violations_async(user_id, 1)
         logger.info(
             "OPENAI_MODERATION_BLOCKED user_id=%s violations=%s categories=%s text=%r",
             user_id,
@@ -169,8 +248,15 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
 
         try:
-            paraphrased = ai_client.paraphrase_message(text, reason="moderation")
+            with metrics.stage_seconds.time(stage="paraphrase"):
+                paraphrased = await ai_client.paraphrase_message(
+                    text, reason="moderation", user_id=user_id
+                )
+        except (admission.AdmissionRejected, resilience.CircuitOpen) as e:
+            await message.reply_text(e.user_text)
+            return
         except Exception as e:
+            metrics.errors_total.inc(stage="paraphrase")
             logger.exception(
                 "PARAPHRASE_ERROR_OPENAI user_id=%s error=%s", user_id, e
             )
@@ -181,7 +267,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return
 
-        token = create_paraphrase_session(user_id, text, paraphrased)
+        token = await create_paraphrase_session(user_id, text, paraphrased)
 
         keyboard = InlineKeyboardMarkup(
             [
@@ -210,23 +296,68 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     # -------- ЗАПРОС К AI-МОДЕЛИ --------
-    dialog = storage.get_last_messages(user_id, limit=20)
+    if window is None:
+        window = _build_window(user_id, text)
 
+    # В потоковом режиме сразу отправляем заглушку и дописываем в неё ответ
+    placeholder = None
+    answer_started = time.monotonic()
     try:
-        answer = ai_client.generate_answer(dialog, text)
+        if SETTINGS.stream_answers:
+            placeholder = await message.reply_text(streaming.PLACEHOLDER_TEXT)
+            if speculation is not None:
+                chunks = speculation.release()
+            else:
+                chunks = ai_client.stream_answer(
+                    window.history, text, window.summary, user_id=user_id
+                )
+            result = await streaming.stream_into_message(
+                placeholder,
+                chunks,
+                min_edit_interval=SETTINGS.stream_edit_interval,
+                started=started,
+            )
+            answer = result.text
+            logger.info(
+                "AI_STREAM user_id=%s first_token_ms=%s total_ms=%d edits=%d",
+                user_id,
+                (
+                    int(result.first_token_latency * 1000)
+                    if result.first_token_latency is not None
+                    else None
+                ),
+                int(result.total_latency * 1000),
+                result.edits,
+            )
+        elif speculation is not None:
+            answer = await speculation.result()
+        else:
+            answer = await ai_client.generate_answer(
+                window.history, text, window.summary, user_id=user_id
+            )
+    except (admission.AdmissionRejected, resilience.CircuitOpen) as e:
+        await _reply_or_edit(message, placeholder, e.user_text)
+        return
     except Exception as e:
+        metrics.errors_total.inc(stage="answer")
         logger.exception("AI_ERROR user_id=%s error=%s", user_id, e)
-        await message.reply_text(
+        await _reply_or_edit(
+            message,
+            placeholder,
             "Сейчас у меня не получилось получить ответ от модели 🤖\n"
-            "Попробуй, пожалуйста, ещё раз чуть позже или переформулируй вопрос."
+            "Попробуй, пожалуйста, ещё раз чуть позже или переформулируй вопрос.",
         )
         return
 
+    metrics.stage_seconds.observe(time.monotonic() - answer_started, stage="answer")
+
     if not answer or not answer.strip():
         logger.warning("EMPTY_AI_RESPONSE user_id=%s text=%r", user_id, text)
-        await message.reply_text(
+        await _reply_or_edit(
+            message,
+            placeholder,
             "Модель вернула пустой ответ 😕\n"
-            "Попробуй задать вопрос по-другому."
+            "Попробуй задать вопрос по-другому.",
         )
         return
 
@@ -241,4 +372,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     storage.add_message(user_id, "assistant", answer)
     storage.increment_requests(user_id, 1)
 
-    await message.reply_text(answer)
+    # Старые реплики сворачиваем в summary в фоне, не задерживая ответ
+    if context_window.needs_fold(window):
+        context.application.create_task(context_window.fold_overflow(user_id, window))
+
+    # При стриминге ответ уже показан в сообщении-заглушке
+    if placeholder is None:
+        await message.reply_text(answer)
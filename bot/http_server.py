@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на размер тела запроса (апдейт Telegram — единицы КБ)
+MAX_BODY_SIZE = 1024 * 1024
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes = b""
+
+
+@dataclass
+class Response:
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HttpServer:
+    """
+    Минимальный HTTP/1.1-сервер на asyncio для служебных эндпоинтов
+    бота (вебхук Telegram, метрики). Работает в том же event loop,
+    что и бот, поддерживает keep-alive; маршрут — (метод, путь).
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Открытые keep-alive соединения: закрываем их при остановке
+        self._connections: Set[asyncio.StreamWriter] = set()
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        # При port=0 ОС выбирает свободный порт — запоминаем настоящий
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("HTTP_SERVER_STARTED host=%s port=%d", self.host, self.port)
+
+    async def stop(self) -> None:
+        """
+        Остановить приём соединений и закрыть открытые keep-alive
+        соединения: иначе wait_closed ждёт простаивающих клиентов,
+        а их задачи отменяются уже при остановке loop.
+        """
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                if isinstance(request, Response):
+                    await self._write_response(writer, request, keep_alive=False)
+                    break
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Клиент закрыл соединение посреди запроса
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            # Заголовки длиннее лимита буфера StreamReader (64 КБ)
+            return Response(status=413)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return Response(status=400)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            return Response(status=400)
+        if length < 0:
+            return Response(status=400)
+        if length > MAX_BODY_SIZE:
+            return Response(status=413)
+        body = await reader.readexactly(length) if length else b""
+        path = target.split("?", 1)[0]
+        return Request(method=method.upper(), path=path, headers=headers, body=body)
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self._routes)
+            return Response(status=405 if known_path else 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.exception("HTTP_HANDLER_ERROR path=%s error=%s", request.path, e)
+            return Response(status=500)
+
+    @staticmethod
+    async def _write_response(
+        writer: asyncio.StreamWriter,
+        response: Response,
+        keep_alive: bool,
+    ) -> None:
+        reason = _REASONS.get(response.status, "")
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {response.status} {reason}\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
@@ -1,6 +1,7 @@
 import logging
 
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
@@ -9,9 +10,17 @@ from telegram.ext import (
     filters,
 )
 
-from bot.config import SETTINGS
+from bot import webhook
+from bot.config import SETTINGS, check_required
 from bot.handlers import commands, messages, callbacks
-from bot.services import storage
+from bot.services import (
+    storage,
+    openai_client,
+    metrics,
+    retention,
+    moderation,
+    result_cache,
+)
 
 
 def setup_logging() -> None:
@@ -21,15 +30,52 @@ def setup_logging() -> None:
     )
 
 
-def main() -> None:
-    setup_logging()
-    logger = logging.getLogger(__name__)
+async def on_startup(application) -> None:
+    await metrics.start_server(SETTINGS.metrics_host, SETTINGS.metrics_port)
+    # Пул соединений и словарь мата готовим до первого апдейта
+    openai_client.get_client()
+    moderation.get_matcher()
+    # Очистку БД ведёт один процесс, даже если воркеров несколько
+    if webhook.is_primary_worker():
+        retention.start()
+        # Сменились промпт или модель — ответы из SQLite-кэша больше не годятся
+        if SETTINGS.answer_cache_enabled:
+            result_cache.check_answer_fingerprint()
 
-    logger.info("Starting bot with DB at %s", SETTINGS.db_path)
 
-    storage.init_db()
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    metrics.errors_total.inc(stage="unhandled")
+    logging.getLogger(__name__).error(
+        "UNHANDLED_ERROR error=%s", context.error, exc_info=context.error
+    )
+
+
+async def on_shutdown(application) -> None:
+    await metrics.stop_server()
+    await retention.stop()
+    await openai_client.aclose()
+    # Дописываем очередь write-behind до выхода
+    storage.close_db()
 
-    application = ApplicationBuilder().token(SETTINGS.telegram_token).build()
+
+def build_application() -> Application:
+    """
+    Собираем Application со всеми обработчиками. Вынесено в отдельную
+    функцию уровня модуля: в режиме вебхука с несколькими воркерами её
+    вызывает каждый процесс-воркер.
+    """
+    application = (
+        ApplicationBuilder()
+        .token(SETTINGS.telegram_token)
+        # Замеряем каждый запрос к Bot API (кроме long polling getUpdates)
+        .request(metrics.TelegramRequest(connection_pool_size=256))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        # Апдейты разных пользователей обрабатываются параллельно,
+        # одного пользователя — по очереди (bot.services.user_locks)
+        .concurrent_updates(SETTINGS.concurrent_updates or False)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", commands.start))
     application.add_handler(CommandHandler("help", commands.help_command))
@@ -44,6 +90,23 @@ def main() -> None:
             messages.handle_text_message,
         )
     )
+    application.add_error_handler(on_error)
+    return application
+
+
+def main() -> None:
+    check_required()
+    setup_logging()
+    logger = logging.getLogger(__name__)
+
+    logger.info("Starting bot with DB at %s", SETTINGS.db_path)
+
+    if SETTINGS.bot_mode == "webhook":
+        webhook.run(build_application, setup_logging)
+        return
+
+    storage.init_db()
+    application = build_application()
 
     logger.info("Bot is running. Waiting for updates...")
     application.run_polling(allowed_updates=None)
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from bot.config import SETTINGS, Lazy
+from bot.services import metrics
+from bot.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Текст для пользователя, когда запрос к модели не пропущен
+BUSY_TEXT = (
+    "Сейчас слишком много запросов, и я не успеваю ответить всем 🙈\n"
+    "Попробуй, пожалуйста, ещё раз через минуту."
+)
+RATE_LIMITED_TEXT = (
+    "Ты отправляешь запросы слишком часто ⏳\n"
+    "Подожди немного ({seconds} сек.) и попробуй снова."
+)
+
+
+_wait_seconds = metrics.Histogram(
+    "bot_admission_wait_seconds",
+    "Сколько запрос к модели ждал слота в очереди",
+)
+
+
+class AdmissionRejected(Exception):
+    """
+    Запрос к модели не допущен: очередь заполнена (reason="queue_full")
+    или пользователь исчерпал свой лимит (reason="rate_limited").
+    """
+
+    def __init__(self, reason: str, retry_after: float = 0.0) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def user_text(self) -> str:
+        if self.reason == "rate_limited":
+            return RATE_LIMITED_TEXT.format(seconds=max(1, int(self.retry_after + 0.999)))
+        return BUSY_TEXT
+
+
+@dataclass
+class TokenBucket:
+    """
+    Ведро токенов: burst запросов сразу, дальше rate запросов в секунду.
+    """
+
+    rate: float
+    burst: float
+    tokens: float
+    updated: float
+
+    def take(self, now: float) -> float:
+        """
+        Пробуем взять токен. 0 — взяли; иначе через сколько секунд появится.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Totals:
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_rate_limited = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, field: str, value: float = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    def add_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_rate_limited": self.rejected_rate_limited,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class AdmissionController:
+    """
+    Допуск запросов к модели.
+
+    - не больше max_concurrent запросов одновременно (глобальный семафор);
+    - у каждого пользователя своё ведро токенов: rate запросов в секунду
+      с запасом burst; превысил — сразу AdmissionRejected;
+    - кто не попал в свободный слот, ждёт в очереди не длиннее max_queue;
+      слоты раздаются по кругу между пользователями, поэтому один
+      «болтливый» пользователь не занимает всю очередь;
+    - очередь полна — сразу AdmissionRejected, без ожидания.
+
+    user_id=None (фоновые задачи, например summary) — только общий лимит.
+    Экземпляр используется из одного event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: int,
+        user_rate: float = 0.0,
+        user_burst: float = 1.0,
+        max_users: int = 100000,
+    ) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.user_rate = user_rate
+        self.user_burst = max(1.0, user_burst)
+        # Полное ведро ничем не отличается от отсутствующего, поэтому
+        # ведра неактивных пользователей можно просто забывать
+        bucket_ttl = self.user_burst / user_rate if user_rate > 0 else None
+        self._buckets = TTLCache(maxsize=max_users, ttl=bucket_ttl)
+        self._active = 0
+        self._waiting: "OrderedDict[Optional[int], Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        self.totals = _Totals()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def _check_rate(self, user_id: Optional[int]) -> None:
+        if user_id is None or self.user_rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst, self.user_burst, now)
+        retry_after = bucket.take(now)
+        self._buckets.set(user_id, bucket)
+        if retry_after > 0:
+            self.totals.add("rejected_rate_limited")
+            logger.info(
+                "ADMISSION_RATE_LIMITED user_id=%s retry_after=%.1f",
+                user_id,
+                retry_after,
+            )
+            raise AdmissionRejected("rate_limited", retry_after)
+
+    async def _enter(self, user_id: Optional[int]) -> None:
+        self._check_rate(user_id)
+
+        if self._active < self.max_concurrent and not self._queued:
+            self._active += 1
+            self.totals.add("admitted")
+            return
+
+        if self._queued >= self.max_queue:
+            self.totals.add("rejected_queue_full")
+            logger.warning(
+                "ADMISSION_QUEUE_FULL user_id=%s depth=%d active=%d",
+                user_id,
+                self._queued,
+                self._active,
+            )
+            raise AdmissionRejected("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        self._queued += 1
+        self.totals.add("queued")
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но ждавший ушёл — возвращаем слот
+                self._leave()
+            else:
+                self._forget(user_id, future)
+            raise
+
+        waited = time.monotonic() - started
+        self.totals.add("admitted")
+        self.totals.add_wait(waited)
+        _wait_seconds.observe(waited)
+        logger.info(
+            "ADMISSION_WAITED user_id=%s wait_ms=%d depth=%d",
+            user_id,
+            int(waited * 1000),
+            self._queued,
+        )
+
+    def _forget(self, user_id: Optional[int], future: asyncio.Future) -> None:
+        waiters = self._waiting.get(user_id)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        self._queued -= 1
+        if not waiters:
+            del self._waiting[user_id]
+
+    def _leave(self) -> None:
+        self._active -= 1
+        # Раздаём освободившиеся слоты по кругу: первый пользователь
+        # в очереди получает слот и уходит в её конец
+        while self._active < self.max_concurrent and self._waiting:
+            user_id, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def acquire(self, user_id: Optional[int] = None) -> AsyncIterator[None]:
+        await self._enter(user_id)
+        try:
+            yield
+        finally:
+            self._leave()
+
+    def stats(self) -> Dict[str, float]:
+        stats = self.totals.as_dict()
+        stats["active"] = self._active
+        stats["queue_depth"] = self._queued
+        return stats
+
+
+_controller: AdmissionController = Lazy(  # type: ignore[assignment]
+    lambda: AdmissionController(
+        max_concurrent=SETTINGS.admission_max_concurrent,
+        max_queue=SETTINGS.admission_queue_size,
+        user_rate=SETTINGS.user_rate_limit / 60.0,
+        user_burst=SETTINGS.user_rate_burst,
+    )
+)
+
+
+def acquire(user_id: Optional[int] = None):
+    """
+    async with admission.acquire(user_id): ... — обёртка вокруг
+    каждого обращения к модели.
+    """
+    return _controller.acquire(user_id)
+
+
+def get_stats() -> Dict[str, float]:
+    return _controller.stats()
+
+
+metrics.StatsGauges(
+    "bot_admission",
+    "Допуск запросов к модели: очередь, ожидание, отказы",
+    get_stats,
+)
@@ -1,72 +1,223 @@
-from typing import List, Dict
-
-from openai import OpenAI
+import time
+from typing import AsyncIterator, List, Dict, Optional
 
 from bot.config import SETTINGS
+from bot.services import (
+    admission,
+    openai_client,
+    resilience,
+    result_cache,
+    routing,
+    usage,
+)
+from bot.services.state import chat_entry
+
 
-# Клиент OpenAI. Ключ берём из настроек.
-_client = OpenAI(api_key=SETTINGS.openai_api_key)
+def _message(role: str, content: str) -> Dict[str, str]:
+    return {"role": role, "content": content}
+
+
+def _summary_message(summary: str) -> Dict[str, str]:
+    return _message(
+        "system", f"Краткое содержание предыдущей части диалога:\n{summary}"
+    )
 
 
 def build_chat_input(
     dialog_context: List[Dict[str, str]],
     user_message: str,
+    summary: Optional[str] = None,
 ) -> list:
     """
     Собираем список сообщений для chat.completions:
     - системное сообщение с ролью бота,
+    - краткое содержание ранней части диалога (если есть),
     - контекст диалога (предыдущие реплики),
     - текущий запрос пользователя.
+
+    Порядок — от неизменного к новому, и в промпт не попадает ничего
+    переменного (времени, id): от хода к ходу начало промпта совпадает
+    байт в байт, и провайдер берёт его из кэша префиксов. Сообщения
+    истории не пересоздаются на каждом ходе: берутся готовые неизменяемые
+    записи из буфера контекста (state.chat_entry).
     """
-    messages = [
-        {
-            "role": "system",
-            "content": SETTINGS.system_prompt,
-        }
-    ]
-    for msg in dialog_context:
-        messages.append(
-            {
-                "role": msg["role"],
-                "content": msg["content"],
-            }
-        )
-    messages.append(
-        {
-            "role": "user",
-            "content": user_message,
-        }
-    )
+    messages = [_message("system", SETTINGS.system_prompt)]
+    if summary:
+        messages.append(_summary_message(summary))
+    messages.extend(chat_entry(msg) for msg in dialog_context)
+    messages.append({"role": "user", "content": user_message})
     return messages
 
 
-def generate_answer(
+async def _create(
+    op: str,
+    hedge: Optional[bool] = None,
+    user_id: Optional[int] = None,
+    **kwargs,
+):
+    """
+    chat.completions.create через resilience.call: дедлайн, повторы,
+    breaker. Стриминг не хеджируем — второй поток читать некуда.
+    Время ответа модели (для стриминга — до начала потока) уходит
+    в routing для выбора по задержке, токены ответа — в usage
+    (для стриминга их считает вызывающий по последнему чанку).
+    """
+    if kwargs.get("stream"):
+        hedge = False
+        kwargs["stream_options"] = {"include_usage": True}
+    if SETTINGS.prompt_cache_key and user_id is not None:
+        kwargs["prompt_cache_key"] = f"user-{user_id}"
+    started = time.monotonic()
+    resp = await resilience.call(
+        op,
+        lambda: openai_client.get_client().chat.completions.create(**kwargs),
+        breaker=resilience.chat_breaker,
+        deadline=SETTINGS.openai_deadline,
+        hedge=hedge,
+    )
+    routing.observe(kwargs["model"], time.monotonic() - started)
+    if not kwargs.get("stream"):
+        usage.record(op, kwargs["model"], getattr(resp, "usage", None), user_id)
+    return resp
+
+
+def _fail_fast() -> None:
+    # Пока breaker разомкнут, не занимаем место в очереди admission
+    if resilience.chat_breaker.is_open():
+        raise resilience.CircuitOpen(resilience.chat_breaker.name)
+
+
+def _answer_cache_key(
+    dialog_context: List[Dict[str, str]],
+    user_message: str,
+    summary: Optional[str],
+) -> Optional[str]:
+    """
+    Ключ кэша ответов или None, если кэш к запросу не применим:
+    выключен, есть summary или контекст длиннее ANSWER_CACHE_MAX_CONTEXT.
+    """
+    if not SETTINGS.answer_cache_enabled:
+        return None
+    if summary or len(dialog_context) > SETTINGS.answer_cache_max_context:
+        return None
+    return result_cache.answer_key(user_message)
+
+
+async def generate_answer(
     dialog_context: List[Dict[str, str]],
     user_message: str,
+    summary: Optional[str] = None,
+    user_id: Optional[int] = None,
 ) -> str:
     """
     Основная функция: отправляем контекст + запрос в модель и
     возвращаем текст её ответа.
+
+    Запрос проходит через admission.acquire(user_id) и может быть
+    отклонён с AdmissionRejected. Ответ из кэша admission не занимает.
+    Пока breaker разомкнут — сразу CircuitOpen, без очереди.
     """
-    messages = build_chat_input(dialog_context, user_message)
+    cache_key = _answer_cache_key(dialog_context, user_message, summary)
+    if cache_key is not None:
+        cached = result_cache.answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-    resp = _client.chat.completions.create(
-        model=SETTINGS.chat_model,  # например, gpt-4.1-mini или gpt-4o-mini
-        messages=messages,
-    )
+    messages = build_chat_input(dialog_context, user_message, summary)
+    route = routing.choose("answer", user_message, dialog_context, summary)
+
+    _fail_fast()
+    async with admission.acquire(user_id):
+        started = time.monotonic()
+        resp = await _create(
+            "answer",
+            user_id=user_id,
+            model=route.model,  # например, gpt-4.1-mini или gpt-4.1-nano
+            messages=messages,
+        )
 
     # Берём текст первого ответа
-    return resp.choices[0].message.content.strip()
+    answer = resp.choices[0].message.content.strip()
+    if cache_key is not None and answer:
+        result_cache.answer_cache.record_upstream(time.monotonic() - started)
+        result_cache.answer_cache.set(cache_key, answer)
+    return answer
+
+
+async def stream_answer(
+    dialog_context: List[Dict[str, str]],
+    user_message: str,
+    summary: Optional[str] = None,
+    user_id: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """
+    То же, что generate_answer, но ответ приходит потоком:
+    отдаём текст по кусочкам по мере генерации. Слот admission
+    занят, пока поток не дочитан. Ответ из кэша отдаётся одним куском.
+    """
+    cache_key = _answer_cache_key(dialog_context, user_message, summary)
+    if cache_key is not None:
+        cached = result_cache.answer_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
 
+    messages = build_chat_input(dialog_context, user_message, summary)
+    route = routing.choose("answer", user_message, dialog_context, summary)
+    parts: List[str] = []
 
-def paraphrase_message(
+    _fail_fast()
+    async with admission.acquire(user_id):
+        started = time.monotonic()
+        # Повторы и дедлайн — только до начала потока
+        stream = await _create(
+            "answer_stream",
+            user_id=user_id,
+            model=route.model,
+            messages=messages,
+            stream=True,
+        )
+
+        # Контекстный менеджер закрывает HTTP-ответ, даже если чтение
+        # прервали (например, отменили спекулятивную генерацию)
+        async with stream:
+            async for chunk in stream:
+                # usage приходит последним чанком, без choices
+                chunk_usage = getattr(chunk, "usage", None)
+                if chunk_usage is not None:
+                    usage.record("answer_stream", route.model, chunk_usage, user_id)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+    # Кэшируем только поток, дочитанный до конца
+    answer = "".join(parts).strip()
+    if cache_key is not None and answer:
+        result_cache.answer_cache.record_upstream(time.monotonic() - started)
+        result_cache.answer_cache.set(cache_key, answer)
+
+
+async def paraphrase_message(
     original_text: str,
     reason: str = "profanity",
+    user_id: Optional[int] = None,
 ) -> str:
     """
     Перефразирование сообщения, чтобы убрать мат/токсичность, но
     сохранить смысл и язык.
+
+    Одинаковые сообщения (волна спама, повтор оскорбления)
+    перефразируются один раз — дальше ответ берётся из кэша.
     """
+    route = routing.choose("paraphrase", original_text)
+    key = result_cache.make_key(original_text, reason, route.model)
+    cached = result_cache.paraphrase_cache.get(key)
+    if cached is not None:
+        return cached
+
     prompt = (
         "Перефразируй сообщение пользователя так, чтобы оно не содержало мата, "
         "оскорблений, дискриминации или призывов к насилию. "
@@ -75,15 +226,66 @@ def paraphrase_message(
         f"Исходное сообщение: «{original_text}»"
     )
 
-    resp = _client.chat.completions.create(
-        model=SETTINGS.chat_model,
-        messages=[
-            {
-                "role": "system",
-                "content": "Ты помощник по перефразированию сообщений.",
-            },
-            {"role": "user", "content": prompt},
-        ],
+    _fail_fast()
+    async with admission.acquire(user_id):
+        started = time.monotonic()
+        resp = await _create(
+            "paraphrase",
+            user_id=user_id,
+            model=route.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Ты помощник по перефразированию сообщений.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+        )
+        result_cache.paraphrase_cache.record_upstream(time.monotonic() - started)
+
+    paraphrased = resp.choices[0].message.content.strip()
+    if paraphrased:
+        result_cache.paraphrase_cache.set(key, paraphrased)
+    return paraphrased
+
+
+async def summarize_dialog(
+    previous_summary: Optional[str],
+    messages: List[Dict[str, str]],
+    user_id: Optional[int] = None,
+) -> str:
+    """
+    Обновляем краткое содержание диалога: к прежнему summary
+    добавляем реплики, которые больше не помещаются в контекст.
+    """
+    transcript = "\n".join(
+        f"{'Пользователь' if m['role'] == 'user' else 'Ассистент'}: {m['content']}"
+        for m in messages
+    )
+    prompt = (
+        "Обнови краткое содержание диалога пользователя с ассистентом. "
+        "Сохрани факты, договорённости и важные детали, которые могут "
+        "понадобиться для продолжения разговора. Пиши кратко, не более "
+        f"{SETTINGS.summary_max_words} слов, на языке диалога. "
+        "Верни только новое краткое содержание.\n\n"
+        f"Текущее краткое содержание:\n{previous_summary or '(пока пусто)'}\n\n"
+        f"Новые реплики:\n{transcript}"
     )
 
+    # Фоновая задача: только общий лимит, без лимита пользователя
+    async with admission.acquire():
+        resp = await _create(
+            "summary",
+            hedge=False,
+            user_id=user_id,
+            model=routing.choose("summary").model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Ты помощник, который ведёт краткое содержание диалога.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+        )
+
     return resp.choices[0].message.content.strip()
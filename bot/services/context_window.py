@@ -0,0 +1,314 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from bot.config import SETTINGS, Lazy
+from bot.services import ai_client, metrics, storage
+from bot.services.cache import TTLCache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken необязателен: без него считаем приблизительно
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены, которые добавляются к каждому сообщению чата
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Локальный подсчёт токенов. С tiktoken — точно, без него —
+    оценка «~3 символа на токен» (для русского текста чуть с запасом).
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 2) // 3
+
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message["content"]) + _MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class PromptStats:
+    # Сколько токенов уходит в модель (system + summary + история + запрос)
+    prompt_tokens: int
+    history_tokens: int
+    summary_tokens: int
+    # Сколько ушло бы, если отправлять всю историю как есть
+    full_prompt_tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.full_prompt_tokens - self.prompt_tokens)
+
+
+@dataclass
+class ContextWindow:
+    history: List[Dict[str, str]]
+    summary: Optional[str]
+    stats: PromptStats
+    # Сообщения, не попавшие в бюджет и ещё не свёрнутые в summary
+    overflow: List[Dict[str, str]] = field(default_factory=list)
+
+
+class _Totals:
+    """
+    Накопленная статистика по промптам с момента запуска.
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.full_prompt_tokens = 0
+        self.summaries = 0
+        self.window_shifts = 0
+        self._lock = threading.Lock()
+
+    def add(self, stats: PromptStats) -> None:
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += stats.prompt_tokens
+            self.full_prompt_tokens += stats.full_prompt_tokens
+
+    def add_summary(self) -> None:
+        with self._lock:
+            self.summaries += 1
+
+    def add_shift(self) -> None:
+        with self._lock:
+            self.window_shifts += 1
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "full_prompt_tokens": self.full_prompt_tokens,
+                "saved_tokens": self.full_prompt_tokens - self.prompt_tokens,
+                "summaries": self.summaries,
+                "window_shifts": self.window_shifts,
+            }
+
+
+_totals = _Totals()
+
+# (covered_until_id summary, метка первого сообщения истории) прошлого
+# окна пользователя, метка — см. _anchor_key. Пока история от него помещается в бюджет, окно
+# не сдвигается и начало промпта не меняется — провайдер берёт его
+# из кэша префиксов. После обновления summary окно подбирается заново.
+_window_starts: TTLCache = Lazy(  # type: ignore[assignment]
+    lambda: TTLCache(maxsize=SETTINGS.user_cache_size, ttl=SETTINGS.user_cache_ttl)
+)
+
+# Пользователи, для которых прямо сейчас пересчитывается summary
+_folding: set = set()
+_folding_lock = threading.Lock()
+
+
+def get_stats() -> Dict[str, int]:
+    return _totals.as_dict()
+
+
+def _fit(tokens: List[int], budget: float) -> int:
+    """
+    Индекс, с которого сообщения (с конца) помещаются в budget.
+    """
+    used = 0
+    split = len(tokens)
+    while split > 0 and used + tokens[split - 1] <= budget:
+        split -= 1
+        used += tokens[split]
+    return split
+
+
+def _anchor_key(message: Dict[str, str]) -> tuple:
+    # created_at у соседних сообщений может совпадать, поэтому окно
+    # держим по id; created_at — только у ещё не записанных (write-behind)
+    if message.get("id") is not None:
+        return ("id", message["id"])
+    return ("created_at", message.get("created_at"))
+
+
+def _window_start(
+    user_id: int,
+    covered_until_id: int,
+    fresh: List[Dict[str, str]],
+    tokens: List[int],
+    split: int,
+) -> int:
+    """
+    Начало истории в fresh. Пока прошлое начало есть в dialog и история
+    от него помещается в бюджет, оставляем его. Если нет — сдвигаем окно
+    с запасом context_prefix_slack (и по бюджету, и по числу сообщений
+    DIALOG_CONTEXT_LIMIT), чтобы следующие несколько ходов начало снова
+    не менялось: префикс ломается раз в несколько ходов, а не на каждом.
+    split — начало, если просто заполнить бюджет с конца; всё, что
+    раньше возвращённого начала, уходит в overflow.
+    """
+    budget = SETTINGS.context_token_budget
+    anchor = _window_starts.get(user_id)
+    start = split
+    if anchor is not None and anchor[0] == covered_until_id:
+        previous = next(
+            (i for i, m in enumerate(fresh) if _anchor_key(m) == anchor[1]), None
+        )
+        if previous is not None and previous >= split:
+            start = previous
+        else:
+            slack = SETTINGS.context_prefix_slack
+            start = max(
+                split,
+                _fit(tokens, budget * (1 - slack)),
+                int(len(fresh) * slack),
+            )
+            _totals.add_shift()
+
+    if start < len(fresh):
+        _window_starts.set(user_id, (covered_until_id, _anchor_key(fresh[start])))
+    else:
+        _window_starts.pop(user_id)
+    return start
+
+
+def build_window(
+    user_id: int,
+    dialog: List[Dict[str, str]],
+    user_message: str,
+) -> ContextWindow:
+    """
+    Подбираем историю под бюджет SETTINGS.context_token_budget:
+    берём сообщения с конца, пока помещаются. Всё, что уже свёрнуто
+    в summary, в историю не попадает; более старые сообщения,
+    не поместившиеся в бюджет, возвращаются в overflow.
+
+    Начало окна от хода к ходу по возможности не меняется,
+    см. _window_start.
+    """
+    summary_row = storage.get_summary(user_id)
+    summary = summary_row["summary"] if summary_row else None
+    covered_until_id = summary_row["covered_until_id"] if summary_row else 0
+
+    # Сообщение без id ещё не записано (write-behind) — оно новее summary
+    fresh = [m for m in dialog if m.get("id") is None or m["id"] > covered_until_id]
+
+    tokens = [count_message_tokens(m) for m in fresh]
+    split = _fit(tokens, SETTINGS.context_token_budget)
+    start = _window_start(user_id, covered_until_id, fresh, tokens, split)
+    history = fresh[start:]
+    # Всё, что раньше начала окна, — и не влезшее в бюджет, и пропущенное
+    # при сдвиге с запасом, — сворачивается в summary: каждое несвёрнутое
+    # сообщение попадает либо в историю, либо в overflow
+    overflow = fresh[:start]
+    history_tokens = sum(tokens[start:])
+
+    base_tokens = (
+        count_tokens(SETTINGS.system_prompt)
+        + count_tokens(user_message)
+        + 2 * _MESSAGE_OVERHEAD_TOKENS
+    )
+    summary_tokens = (
+        count_tokens(summary) + _MESSAGE_OVERHEAD_TOKENS if summary else 0
+    )
+    full_history_tokens = sum(count_message_tokens(m) for m in dialog)
+
+    stats = PromptStats(
+        prompt_tokens=base_tokens + summary_tokens + history_tokens,
+        history_tokens=history_tokens,
+        summary_tokens=summary_tokens,
+        full_prompt_tokens=base_tokens + full_history_tokens,
+    )
+    _totals.add(stats)
+    logger.info(
+        "PROMPT_STATS user_id=%s prompt_tokens=%d history_tokens=%d "
+        "summary_tokens=%d full_prompt_tokens=%d saved_tokens=%d",
+        user_id,
+        stats.prompt_tokens,
+        stats.history_tokens,
+        stats.summary_tokens,
+        stats.full_prompt_tokens,
+        stats.saved_tokens,
+    )
+    return ContextWindow(
+        history=history,
+        summary=summary,
+        stats=stats,
+        overflow=overflow,
+    )
+
+
+def needs_fold(window: ContextWindow) -> bool:
+    """
+    Summary пересчитываем не на каждом ходе, а когда вне окна
+    накопилось достаточно несвёрнутых сообщений.
+    """
+    return len(window.overflow) >= SETTINGS.summary_min_messages
+
+
+async def fold_overflow(user_id: int, window: ContextWindow) -> None:
+    """
+    Сворачиваем вышедшие из окна сообщения в summary пользователя.
+    Новое summary = старое summary + эти сообщения, поэтому каждое
+    сообщение проходит через модель один раз.
+    """
+    if not window.overflow:
+        return
+    with _folding_lock:
+        if user_id in _folding:
+            return
+        _folding.add(user_id)
+    try:
+        user = storage.get_user(user_id)
+        reset_marker = user["last_reset_at"] if user else None
+
+        summary = await ai_client.summarize_dialog(
+            window.summary, window.overflow, user_id=user_id
+        )
+
+        # Если за это время диалог сбросили — старое summary не нужно
+        user = storage.get_user(user_id)
+        if user and user["last_reset_at"] != reset_marker:
+            return
+        last = window.overflow[-1]
+        if last.get("id") is None:
+            # id появится после записи очереди write-behind
+            await storage.flush()
+        if last.get("id") is None:
+            logger.warning("DIALOG_SUMMARY_SKIPPED user_id=%s reason=no_message_id", user_id)
+            return
+        storage.save_summary(
+            user_id,
+            summary,
+            covered_until_id=last["id"],
+            covered_until=last["created_at"],
+        )
+        _totals.add_summary()
+        logger.info(
+            "DIALOG_SUMMARY_UPDATED user_id=%s folded=%d summary_tokens=%d",
+            user_id,
+            len(window.overflow),
+            count_tokens(summary),
+        )
+    except Exception as e:
+        metrics.errors_total.inc(stage="summary")
+        logger.exception("DIALOG_SUMMARY_ERROR user_id=%s error=%s", user_id, e)
+    finally:
+        with _folding_lock:
+            _folding.discard(user_id)
+
+
+metrics.StatsGauges(
+    "bot_prompt",
+    "Статистика промптов: запросы, токены, сэкономленные токены, summary",
+    get_stats,
+)
@@ -0,0 +1,276 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from telegram.request import HTTPXRequest
+
+from bot.http_server import HttpServer, Request, Response
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, сек
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Монотонный счётчик: counter.inc(stage="answer").
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self.header()
+        for key, value in items:
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма длительностей. Перцентили (p50/p95/p99) считает
+    Prometheus по корзинам: histogram_quantile(0.95, rate(..._bucket[5m])).
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счётчики по корзинам..., +Inf], сумма
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        with histogram.time(stage="answer"): ... — работает и вокруг await.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), ()))
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v), self._sums[k]) for k, v in self._counts.items())
+        lines = self.header()
+        bucket_labels = self.labelnames + ("le",)
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(bucket_labels, key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class StatsGauges(_Metric):
+    """
+    Уже существующая статистика модуля (get_stats()) в виде набора
+    gauge-метрик {name}_{ключ}. Если get_stats() возвращает словарь
+    словарей, внешний ключ становится значением метки label.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        get_stats: Callable[[], Dict],
+        label: Optional[str] = None,
+    ) -> None:
+        super().__init__(name, help, (label,) if label else ())
+        self.get_stats = get_stats
+
+    def render(self) -> List[str]:
+        stats = self.get_stats()
+        groups = stats.items() if self.labelnames else [((), stats)]
+        series: Dict[str, List[str]] = {}
+        for group, values in groups:
+            key = (group,) if self.labelnames else ()
+            labels = _format_labels(self.labelnames, key)
+            for field, value in values.items():
+                series.setdefault(field, []).append(f"{labels} {_format_value(value)}")
+        lines = []
+        for field, samples in series.items():
+            name = f"{self.name}_{field}"
+            lines.append(f"# HELP {name} {self.help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{sample}" for sample in samples)
+        return lines
+
+
+_registry: List[_Metric] = []
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in list(_registry):
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logger.exception("METRICS_RENDER_ERROR metric=%s error=%s", metric.name, e)
+    return "\n".join(lines) + "\n"
+
+
+# --- Общие метрики бота ---
+
+stage_seconds = Histogram(
+    "bot_stage_seconds",
+    "Длительность этапов обработки сообщения",
+    ("stage",),
+)
+storage_seconds = Histogram(
+    "bot_storage_seconds",
+    "Длительность вызовов storage",
+    ("op",),
+)
+telegram_seconds = Histogram(
+    "bot_telegram_request_seconds",
+    "Длительность запросов к Telegram Bot API",
+    ("method",),
+)
+errors_total = Counter(
+    "bot_errors_total",
+    "Ошибки по этапам обработки",
+    ("stage",),
+)
+
+
+class TelegramRequest(HTTPXRequest):
+    """
+    HTTP-клиент Bot API с замером каждого запроса (sendMessage,
+    editMessageText, sendChatAction, ...) в bot_telegram_request_seconds.
+    """
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        try:
+            with telegram_seconds.time(method=api_method):
+                return await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            errors_total.inc(stage="telegram")
+            raise
+
+
+# --- HTTP-эндпоинт /metrics ---
+
+_server: Optional[HttpServer] = None
+
+
+async def _handle_metrics(request: Request) -> Response:
+    return Response(body=render().encode("utf-8"), content_type=CONTENT_TYPE)
+
+
+async def start_server(host: str, port: int) -> Optional[HttpServer]:
+    """
+    Поднимаем GET /metrics в текущем event loop. port=0 в настройках
+    означает «не поднимать».
+    """
+    global _server
+    if not port or _server is not None:
+        return _server
+    server = HttpServer(host, port)
+    server.route("GET", "/metrics", _handle_metrics)
+    await server.start()
+    _server = server
+    return server
+
+
+async def stop_server() -> None:
+    global _server
+    if _server is not None:
+        await _server.stop()
+        _server = None
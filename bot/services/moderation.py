@@ -1,10 +1,17 @@
-from dataclasses import dataclass
-from typing import Dict, Any
+import asyncio
+import logging
+import re
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
 
 from profanityfilter import ProfanityFilter
-from openai import OpenAI
 
 from bot.config import SETTINGS
+from bot.services import metrics, openai_client, resilience, result_cache
+from bot.services.profanity import ProfanityMatcher
+
+logger = logging.getLogger(__name__)
 
 # Наш дополнительный список матерных/оскорбительных слов
 _EXTRA_WORDS = {
@@ -43,7 +50,72 @@ _EXTRA_WORDS = {
 # Библиотека сама знает англ. список, мы добавляем свои слова
 _pf = ProfanityFilter(extra_censor_list=list(_EXTRA_WORDS))
 
-_openai_client = OpenAI(api_key=SETTINGS.openai_api_key)
+
+def _library_words() -> Set[str]:
+    # Английский словарь profanityfilter без наших слов
+    # (слова там экранированы под regex)
+    return {
+        re.sub(r"\\(.)", r"\1", w)
+        for w in ProfanityFilter().get_profane_words()
+    }
+
+
+def load_lexicon(path: Optional[str]) -> Tuple[Set[str], Set[str]]:
+    """
+    Читаем словарь из файла: одно слово на строку, «#» — комментарий.
+    Слова с префиксом «=» ищутся только целиком, остальные — как подстроки.
+    Возвращает (подстроки, целые слова).
+    """
+    substrings: Set[str] = set()
+    words: Set[str] = set()
+    if not path:
+        return substrings, words
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = line.strip()
+            if not entry or entry.startswith("#"):
+                continue
+            if entry.startswith("="):
+                words.add(entry[1:])
+            else:
+                substrings.add(entry)
+    return substrings, words
+
+
+def build_matcher(
+    substrings: Iterable[str] = (),
+    words: Iterable[str] = (),
+) -> ProfanityMatcher:
+    return ProfanityMatcher(
+        substrings=set(_EXTRA_WORDS) | set(substrings),
+        words=_library_words() | set(words),
+    )
+
+
+def reload_lexicon(path: Optional[str] = None) -> int:
+    """
+    Пересобрать матчер (например, после правки файла словаря).
+    Новый матчер подменяет старый целиком, поэтому проверки,
+    идущие в это время, не видят полусобранного состояния.
+    Возвращает размер словаря.
+    """
+    global _matcher
+    if path is None:
+        path = SETTINGS.profanity_lexicon_path
+    matcher = build_matcher(*load_lexicon(path))
+    _matcher = matcher
+    logger.info("PROFANITY_LEXICON_LOADED size=%d path=%s", matcher.size, path)
+    return matcher.size
+
+
+# Матчер собирается при первой проверке (или в reload_lexicon)
+_matcher: Optional[ProfanityMatcher] = None
+
+
+def get_matcher() -> ProfanityMatcher:
+    if _matcher is None:
+        reload_lexicon()
+    return _matcher
 
 
 @dataclass
@@ -57,17 +129,13 @@ def contains_local_profanity(text: str) -> bool:
     """
     Быстрый локальный чек на мат/брань.
 
-    Делаем двойную защиту:
-    1) Явно ищем наши слова-подстроки в тексте (lowercase).
-    2) Потом даём поработать библиотеке profanityfilter.
+    Текст нормализуется (регистр, латиница вместо кириллицы, «б л я»)
+    и проверяется одним проходом по скомпилированному словарю:
+    наши слова ищутся как подстроки, английский список
+    profanityfilter — как целые слова.
     """
     try:
-        low = text.lower()
-        for bad in _EXTRA_WORDS:
-            if bad in low:
-                return True
-
-        return _pf.is_profane(text)
+        return get_matcher().search(text) is not None
     except Exception:
         # Если что-то пошло не так — не валим бота
         return False
@@ -83,24 +151,196 @@ def censor_local(text: str) -> str:
         return text
 
 
-def check_openai_moderation(text: str) -> ModerationResult:
+_MODERATION_MODEL = "omni-moderation-latest"
+
+# Пакеты больше этого при ошибке не перепроверяем поштучно
+_SPLIT_MAX_BATCH = 16
+
+
+async def _moderate_single(text: str) -> Any:
+    resp = await openai_client.get_client().moderations.create(
+        model=_MODERATION_MODEL,
+        input=text,
+    )
+    return resp.results[0]
+
+
+def _should_split(error: BaseException, size: int) -> bool:
+    """
+    Перепроверять ли пакет поштучно: только если сервис жив (ошибка 4xx,
+    кроме 429, breaker не разомкнут), а пакет небольшой.
+    """
+    status = getattr(error, "status_code", None)
+    return (
+        status is not None
+        and 400 <= status < 500
+        and status != 429
+        and size <= _SPLIT_MAX_BATCH
+        and not resilience.moderation_breaker.is_open()
+    )
+
+
+class ModerationBatcher:
     """
-    Проверка через OpenAI Moderation API.
-    Если что-то ломается — считаем, что текст "чистый",
-    чтобы не блокировать пользователя из-за проблем сервиса.
+    Склеивает проверки от разных пользователей в один запрос к OpenAI.
+
+    Тексты, пришедшие в течение window секунд (или пока не набралось
+    max_batch штук), уходят одним moderations.create(input=[...]),
+    результаты раздаются ждущим вызовам по порядку. Если пакет отвергнут
+    как некорректный (4xx: один «плохой» текст валит весь пакет), breaker
+    замкнут и пакет не больше _SPLIT_MAX_BATCH — тексты перепроверяются
+    по одному. При сбое сервиса ошибку получают все ждущие вызовы:
+    повторы и переход на локальную проверку делает check_openai_moderation,
+    а поштучные вызовы во время сбоя только умножили бы число запросов.
     """
+
+    def __init__(self, window: float, max_batch: int) -> None:
+        self.window = window
+        self.max_batch = max_batch
+        self.loop = asyncio.get_running_loop()
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def check(self, text: str) -> Any:
+        fut = self.loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = self.loop.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            resp = await openai_client.get_client().moderations.create(
+                model=_MODERATION_MODEL,
+                input=[text for text, _ in batch],
+            )
+            if len(resp.results) != len(batch):
+                raise ValueError(
+                    f"moderation returned {len(resp.results)} results for {len(batch)} inputs"
+                )
+        except Exception as e:
+            if _should_split(e, len(batch)):
+                logger.warning(
+                    "MODERATION_BATCH_FALLBACK size=%d error=%r", len(batch), e
+                )
+                await asyncio.gather(
+                    *(self._send_single(text, fut) for text, fut in batch)
+                )
+                return
+            logger.warning("MODERATION_BATCH_FAILED size=%d error=%r", len(batch), e)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for (_, fut), result in zip(batch, resp.results):
+            if not fut.done():
+                fut.set_result(result)
+
+    @staticmethod
+    async def _send_single(text: str, fut: asyncio.Future) -> None:
+        # Без повторов: если упадёт и одиночный вызов, повторит вызывающий
+        try:
+            result = await _moderate_single(text)
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+            return
+        if not fut.done():
+            fut.set_result(result)
+
+
+_batcher: Optional[ModerationBatcher] = None
+
+
+def _get_batcher() -> Optional[ModerationBatcher]:
+    global _batcher
+    if SETTINGS.moderation_batch_size <= 1:
+        return None
+    # Батчер привязан к event loop, в котором создан
+    if _batcher is None or _batcher.loop is not asyncio.get_running_loop():
+        _batcher = ModerationBatcher(
+            window=SETTINGS.moderation_batch_window_ms / 1000,
+            max_batch=SETTINGS.moderation_batch_size,
+        )
+    return _batcher
+
+
+def _local_only(text: str) -> ModerationResult:
+    # Запасной вариант, пока OpenAI недоступен: только локальный словарь
+    blocked = contains_local_profanity(text)
+    return ModerationResult(
+        blocked=blocked,
+        source="local" if blocked else "none",
+        categories={},
+    )
+
+
+async def _moderate(text: str) -> Any:
+    batcher = _get_batcher()
+    if batcher is not None:
+        return await batcher.check(text)
+    return await _moderate_single(text)
+
+
+async def check_openai_moderation(text: str) -> ModerationResult:
+    """
+    Проверка через OpenAI Moderation API с дедлайном MODERATION_DEADLINE
+    и повторами. Если OpenAI недоступен (ошибка, дедлайн, разомкнутый
+    breaker) — остаётся только локальная проверка, чтобы не блокировать
+    пользователя из-за проблем сервиса и не ждать таймаутов.
+
+    Результаты кэшируются по хэшу нормализованного текста:
+    волна одинаковых сообщений проверяется в OpenAI один раз.
+    Промахи кэша по возможности склеиваются в пакетные запросы.
+    """
+    key = result_cache.make_key(text, _MODERATION_MODEL)
+    cached = result_cache.moderation_cache.get(key)
+    if cached is not None:
+        return ModerationResult(**cached)
+
     try:
-        resp = _openai_client.moderations.create(
-            model="omni-moderation-latest",
-            input=text,
+        started = time.monotonic()
+        result = await resilience.call(
+            "moderation",
+            lambda: _moderate(text),
+            breaker=resilience.moderation_breaker,
+            deadline=SETTINGS.moderation_deadline,
         )
-        result = resp.results[0]
+        result_cache.moderation_cache.record_upstream(time.monotonic() - started)
         categories = dict(result.categories)
         blocked = bool(result.flagged)
-        return ModerationResult(
+        mod_result = ModerationResult(
             blocked=blocked,
             source="openai" if blocked else "none",
             categories=categories,
         )
-    except Exception:
-        return ModerationResult(blocked=False, source="none", categories={})
+    except resilience.CircuitOpen:
+        metrics.errors_total.inc(stage="openai_moderation")
+        return _local_only(text)
+    except Exception as e:
+        metrics.errors_total.inc(stage="openai_moderation")
+        logger.warning("OPENAI_MODERATION_ERROR error=%r", e)
+        return _local_only(text)
+
+    # Кэшируем только настоящие ответы, а не «чистый» результат из-за ошибки
+    result_cache.moderation_cache.set(key, asdict(mod_result))
+    return mod_result
@@ -0,0 +1,58 @@
+from typing import TYPE_CHECKING, Optional
+
+from bot.config import SETTINGS
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Единственный клиент OpenAI на процесс: ответы, перефразирование,
+# summary и модерация идут через один пул HTTP-соединений.
+# Создаётся при первом обращении — пакет openai тяжёлый (~0.7 с импорта),
+# и без ключа OPENAI_API_KEY импорт модулей бота не должен падать.
+_client: Optional["AsyncOpenAI"] = None
+
+
+def _build_client() -> "AsyncOpenAI":
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    # Keep-alive соединения переиспользуются, поэтому параллельные
+    # запросы не открывают каждый раз новое TLS-соединение
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=SETTINGS.openai_max_connections,
+            max_keepalive_connections=SETTINGS.openai_max_connections,
+            keepalive_expiry=SETTINGS.openai_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            SETTINGS.openai_timeout,
+            connect=SETTINGS.openai_connect_timeout,
+        ),
+    )
+    # Асинхронный клиент: запрос к модели не блокирует event loop,
+    # пока ждём ответа, бот продолжает обслуживать других пользователей.
+    # Повторы делает resilience.call (с дедлайном и breaker-ом),
+    # собственные повторы SDK выключены, чтобы они не умножались.
+    return AsyncOpenAI(
+        api_key=SETTINGS.openai_api_key,
+        http_client=http_client,
+        timeout=SETTINGS.openai_timeout,
+        max_retries=0,
+    )
+
+
+def get_client() -> "AsyncOpenAI":
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+async def aclose() -> None:
+    """
+    Закрываем пул соединений при остановке бота.
+    """
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.close()
@@ -0,0 +1,144 @@
+import re
+from typing import Dict, Iterable, Optional
+
+# Латинские буквы и цифры, похожие на кириллические. Заменяем их
+# только в словах, где уже есть кириллица («xyй», «бл9ть», «cyка»),
+# чтобы не ломать обычные английские слова.
+_HOMOGLYPHS = str.maketrans(
+    {
+        "a": "а",
+        "b": "в",
+        "c": "с",
+        "e": "е",
+        "h": "н",
+        "k": "к",
+        "m": "м",
+        "o": "о",
+        "p": "р",
+        "t": "т",
+        "x": "х",
+        "y": "у",
+        "0": "о",
+        "3": "з",
+        "4": "ч",
+        "6": "б",
+        "@": "а",
+    }
+)
+
+_TOKEN_RE = re.compile(r"\S+")
+_CYRILLIC_RE = re.compile(r"[а-я]")
+_NON_CYRILLIC_RE = re.compile(r"[a-z0-9@]")
+
+# Три и больше одиночных буквы через пробелы/точки/дефисы: «б л я», «х.у.й»
+_SPACED_LETTERS_RE = re.compile(r"(?<!\w)[^\W\d_](?:[\W_]{1,3}[^\W\d_](?!\w)){2,}")
+_SEPARATORS_RE = re.compile(r"[\W_]+")
+
+_REPEATS_RE = re.compile(r"(.)\1+")
+
+
+def _fix_mixed_script(match: "re.Match") -> str:
+    token = match.group(0)
+    if _CYRILLIC_RE.search(token) and _NON_CYRILLIC_RE.search(token):
+        return token.translate(_HOMOGLYPHS)
+    return token
+
+
+def normalize(text: str) -> str:
+    """
+    Приводим текст к виду, в котором ищем мат:
+    - нижний регистр, «ё» → «е»;
+    - латиница/цифры внутри кириллических слов → похожие кириллические буквы;
+    - буквы, разделённые пробелами или знаками, склеиваются в слово.
+
+    Повторы букв («бляяяя») здесь не схлопываем — их допускает сам шаблон.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _TOKEN_RE.sub(_fix_mixed_script, text)
+    return _SPACED_LETTERS_RE.sub(
+        lambda m: _SEPARATORS_RE.sub("", m.group(0)), text
+    )
+
+
+def _trie_pattern(words: Iterable[str], repeats: bool) -> Optional[str]:
+    """
+    Строим из списка слов одно регулярное выражение в форме префиксного
+    дерева: «(?:б(?:ля|...)|х(?:уй|...))». Движок regex ветвится по
+    очередной букве, поэтому скорость почти не зависит от размера словаря.
+
+    repeats=True — каждая буква может повторяться («б+л+я+»), а слово,
+    у которого есть более короткий префикс в словаре, отбрасывается
+    (для поиска подстроки достаточно короткого).
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        end = "" in node
+        if end and (repeats or len(node) == 1):
+            return ""
+        alternatives = []
+        for ch in sorted(k for k in node if k):
+            atom = re.escape(ch) + ("+" if repeats else "")
+            alternatives.append(atom + build(node[ch]))
+        if len(alternatives) == 1:
+            pattern = alternatives[0]
+        else:
+            pattern = "(?:" + "|".join(alternatives) + ")"
+        if end:
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    if not trie:
+        return None
+    return build(trie)
+
+
+def _prepare(word: str, repeats: bool) -> str:
+    word = normalize(word.strip())
+    if repeats:
+        word = _REPEATS_RE.sub(r"\1", word)
+    return word
+
+
+class ProfanityMatcher:
+    """
+    Однопроходный поиск мата по словарю.
+
+    - substrings — ищутся как подстроки, с допуском повторов букв
+      (наш русский/английский список: «блядь», «хуй», ...);
+    - words — ищутся только целыми словами и буквально
+      (большой английский список profanityfilter: «ass» не должен
+      находиться в «class»).
+
+    Всё собирается в одно скомпилированное регулярное выражение.
+    """
+
+    def __init__(self, substrings: Iterable[str], words: Iterable[str] = ()) -> None:
+        substrings = {_prepare(w, repeats=True) for w in substrings}
+        words = {_prepare(w, repeats=False) for w in words}
+        self.size = len(substrings) + len(words)
+
+        parts = []
+        sub_pattern = _trie_pattern(substrings, repeats=True)
+        if sub_pattern:
+            parts.append(sub_pattern)
+        word_pattern = _trie_pattern(words, repeats=False)
+        if word_pattern:
+            parts.append(r"(?<!\w)" + word_pattern + r"(?!\w)")
+        self._regex = re.compile("|".join(parts)) if parts else None
+
+    def search(self, text: str) -> Optional[str]:
+        """
+        Возвращает найденный фрагмент (в нормализованном виде) или None.
+        """
+        if self._regex is None:
+            return None
+        match = self._regex.search(normalize(text))
+        return match.group(0) if match else None
@@ -0,0 +1,315 @@
+"""
+Устойчивые вызовы OpenAI: дедлайн на вызов, повторы с джиттером,
+circuit breaker и (по желанию) хеджирование.
+
+- Дедлайн ограничивает весь вызов вместе с повторами и паузами.
+- Повторяем только то, что может пройти со второго раза: таймауты,
+  сетевые ошибки, 408/409/429 и 5xx. Пауза — «full jitter»:
+  случайная от 0 до base * 2^попытка, чтобы повторы разных
+  пользователей не били в API одновременно.
+- Breaker после failure_threshold ошибок подряд размыкается: вызовы
+  сразу получают CircuitOpen, не дожидаясь таймаутов. Через
+  reset_timeout пропускается одна пробная попытка: успех замыкает
+  breaker, ошибка снова размыкает.
+- Хеджирование: если ответ не пришёл за наблюдаемый p95 этой операции,
+  параллельно отправляется второй такой же запрос, берём первый ответ.
+  Только для идемпотентных вызовов без стриминга.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from bot.config import SETTINGS, Lazy
+from bot.services import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+UNAVAILABLE_TEXT = (
+    "Сервис модели сейчас недоступен 🤖\n"
+    "Попробуй, пожалуйста, ещё раз через минуту."
+)
+
+# Пауза перед повтором: случайная в [0, min(cap, base * 2^попытка)]
+_BACKOFF_BASE = 0.2
+_BACKOFF_CAP = 2.0
+# Хеджируем, только когда накоплено достаточно замеров для p95
+_HEDGE_QUANTILE = 0.95
+_HEDGE_MIN_SAMPLES = 20
+_LATENCY_WINDOW = 200
+
+_RETRYABLE_STATUSES = (408, 409, 429)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, upstream: str) -> None:
+        super().__init__(f"circuit for {upstream} is open")
+        self.upstream = upstream
+
+    @property
+    def user_text(self) -> str:
+        return UNAVAILABLE_TEXT
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_total = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        """
+        Разомкнут и время пробы ещё не пришло. Ничего не меняет —
+        удобно для проверки до постановки в очередь.
+        """
+        return (
+            self.state == self.OPEN
+            and time.monotonic() - self._opened_at < self.reset_timeout
+        )
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        # Полуоткрыт: пропускаем ровно одну пробу
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def release(self) -> None:
+        # Проба отменена, не дождавшись ответа: следующий вызов пробует снова
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probe_in_flight = False
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            logger.info("CIRCUIT_CLOSED upstream=%s", self.name)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self.opened_total += 1
+            logger.warning(
+                "CIRCUIT_OPEN upstream=%s failures=%d reset_timeout=%s",
+                self.name,
+                self.failures,
+                self.reset_timeout,
+            )
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            # 0 — замкнут, 1 — полуоткрыт, 2 — разомкнут
+            "state": (self.CLOSED, self.HALF_OPEN, self.OPEN).index(self.state),
+            "consecutive_failures": self.failures,
+            "opened_total": self.opened_total,
+        }
+
+
+class LatencyWindow:
+    """
+    Последние _LATENCY_WINDOW успешных вызовов операции — для порога
+    хеджирования.
+    """
+
+    def __init__(self, size: int = _LATENCY_WINDOW) -> None:
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._samples) < _HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@dataclass
+class _OpStats:
+    calls: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    retries: int = 0
+    rejected: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+
+
+def _breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name, SETTINGS.circuit_failure_threshold, SETTINGS.circuit_reset_timeout
+    )
+
+
+chat_breaker: CircuitBreaker = Lazy(lambda: _breaker("chat"))  # type: ignore[assignment]
+moderation_breaker: CircuitBreaker = Lazy(  # type: ignore[assignment]
+    lambda: _breaker("moderation")
+)
+
+_stats: Dict[str, _OpStats] = {}
+_windows: Dict[str, LatencyWindow] = {}
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in _RETRYABLE_STATUSES or status >= 500
+    # К этому моменту клиент создан, значит пакет openai уже загружен
+    import openai
+
+    # APITimeoutError — подкласс APIConnectionError
+    return isinstance(error, openai.APIConnectionError)
+
+
+def backoff(attempt: int) -> float:
+    return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+
+
+async def _hedged(
+    factory: Callable[[], Awaitable[T]], delay: float, stats: _OpStats
+) -> T:
+    first = asyncio.ensure_future(factory())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return first.result()
+        stats.hedges += 1
+        tasks.append(asyncio.ensure_future(factory()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        stats.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        assert error is not None
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call(
+    op: str,
+    factory: Callable[[], Awaitable[T]],
+    *,
+    breaker: CircuitBreaker,
+    deadline: float,
+    retries: Optional[int] = None,
+    hedge: Optional[bool] = None,
+) -> T:
+    """
+    Выполнить factory() с дедлайном, повторами и breaker-ом.
+    factory вызывается заново на каждую попытку.
+
+    CircuitOpen — breaker разомкнут, запрос не отправлялся;
+    TimeoutError — дедлайн истёк; иначе — последняя ошибка API.
+    """
+    if retries is None:
+        retries = SETTINGS.openai_max_retries
+    if hedge is None:
+        hedge = SETTINGS.hedge_requests
+    stats = _stats.setdefault(op, _OpStats())
+    window = _windows.setdefault(op, LatencyWindow())
+    stats.calls += 1
+    if not breaker.allow():
+        stats.rejected += 1
+        raise CircuitOpen(breaker.name)
+
+    deadline_at = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        hedge_after = window.quantile(_HEDGE_QUANTILE) if hedge else None
+        try:
+            if hedge_after is not None:
+                attempt_coro = _hedged(factory, hedge_after, stats)
+            else:
+                attempt_coro = factory()
+            result = await asyncio.wait_for(attempt_coro, deadline_at - started)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                # API ответил (400, 401, ...) — сервис жив, повтор не поможет
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            stats.failures += 1
+            if isinstance(e, asyncio.TimeoutError):
+                stats.timeouts += 1
+            remaining = deadline_at - time.monotonic()
+            if attempt >= retries or remaining <= 0 or not breaker.allow():
+                metrics.errors_total.inc(stage=f"upstream_{op}")
+                logger.warning(
+                    "UPSTREAM_FAILED op=%s attempts=%d error=%r", op, attempt + 1, e
+                )
+                raise
+            attempt += 1
+            stats.retries += 1
+            await asyncio.sleep(min(backoff(attempt), remaining))
+            continue
+
+        window.observe(time.monotonic() - started)
+        breaker.record_success()
+        return result
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    return {op: asdict(stats) for op, stats in _stats.items()}
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, float]]:
+    return {
+        breaker.name: breaker.stats()
+        for breaker in (chat_breaker, moderation_breaker)
+    }
+
+
+metrics.StatsGauges(
+    "bot_upstream",
+    "Вызовы OpenAI по операциям: ошибки, таймауты, повторы, хеджирование",
+    get_stats,
+    label="op",
+)
+
+metrics.StatsGauges(
+    "bot_circuit",
+    "Circuit breaker-ы OpenAI: состояние (0 — замкнут, 2 — разомкнут), срабатывания",
+    get_breaker_stats,
+    label="upstream",
+)
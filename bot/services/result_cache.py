@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from bot.config import SETTINGS, Lazy
+from bot.services import metrics, storage
+from bot.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    # Одинаковые по смыслу сообщения («Привет  мир» / «привет мир») — один ключ
+    return " ".join(text.casefold().split())
+
+
+def make_key(text: str, *extra: str) -> str:
+    """
+    Ключ кэша — хэш нормализованного текста (и доп. параметров вызова).
+    Сам текст в ключе не хранится.
+    """
+    payload = "\x1f".join((normalize_text(text),) + extra)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Кэш результатов внешних вызовов по хэшу содержимого.
+
+    Первый уровень — LRU с TTL в памяти; при persistent=True
+    записи дублируются в SQLite (таблица result_cache) и переживают
+    перезапуск бота. Значения хранятся в JSON.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        maxsize: int,
+        ttl: float,
+        persistent: bool = False,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        # Суммарное время реальных вызовов — чтобы оценить, сколько сэкономили
+        self.upstream_seconds = 0.0
+        self.upstream_calls = 0
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._memory.get(key)
+        if value is None and self.persistent:
+            try:
+                raw = storage.cache_get(self.namespace, key)
+            except Exception as e:
+                logger.warning("RESULT_CACHE_READ_ERROR ns=%s error=%s", self.namespace, e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._memory.set(key, value)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._memory.set(key, value)
+        if self.persistent:
+            try:
+                storage.cache_set(
+                    self.namespace,
+                    key,
+                    json.dumps(value, ensure_ascii=False),
+                    expires_at=time.time() + self.ttl,
+                )
+            except Exception as e:
+                logger.warning("RESULT_CACHE_WRITE_ERROR ns=%s error=%s", self.namespace, e)
+
+    def record_upstream(self, seconds: float) -> None:
+        with self._lock:
+            self.upstream_seconds += seconds
+            self.upstream_calls += 1
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self.persistent:
+            storage.cache_purge(self.namespace)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            avg = (
+                self.upstream_seconds / self.upstream_calls
+                if self.upstream_calls
+                else 0.0
+            )
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._memory),
+                "avg_upstream_seconds": avg,
+                "saved_seconds": self.hits * avg,
+            }
+
+
+def _build(name: str, ttl: float) -> ResultCache:
+    return ResultCache(
+        name,
+        maxsize=SETTINGS.result_cache_size,
+        ttl=ttl,
+        persistent=SETTINGS.result_cache_persistent,
+    )
+
+
+moderation_cache: ResultCache = Lazy(  # type: ignore[assignment]
+    lambda: _build("moderation", SETTINGS.moderation_cache_ttl)
+)
+
+paraphrase_cache: ResultCache = Lazy(  # type: ignore[assignment]
+    lambda: _build("paraphrase", SETTINGS.paraphrase_cache_ttl)
+)
+
+answer_cache: ResultCache = Lazy(  # type: ignore[assignment]
+    lambda: _build("answer", SETTINGS.answer_cache_ttl)
+)
+
+# Отпечаток system_prompt и моделей, под которым лежат ответы в кэше.
+# В SQLite хранится в отдельном пространстве имён, чтобы после
+# перезапуска с другим промптом старые ответы были удалены.
+_META_NAMESPACE = "answer_meta"
+_FINGERPRINT_TTL = 10 * 365 * 86400
+_answer_fingerprint: Optional[str] = None
+_fingerprint_lock = threading.Lock()
+
+
+def answer_fingerprint() -> str:
+    payload = "\x1f".join(
+        (SETTINGS.system_prompt, SETTINGS.chat_model, SETTINGS.fast_model or "")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def check_answer_fingerprint() -> str:
+    """
+    Сбросить кэш ответов, если с прошлого раза сменились
+    system_prompt, chat_model или fast_model (в том числе между перезапусками).
+    """
+    global _answer_fingerprint
+    fingerprint = answer_fingerprint()
+    if fingerprint == _answer_fingerprint:
+        return fingerprint
+    with _fingerprint_lock:
+        if fingerprint == _answer_fingerprint:
+            return fingerprint
+        previous = _answer_fingerprint
+        if previous is None and answer_cache.persistent:
+            try:
+                previous = storage.cache_get(_META_NAMESPACE, "fingerprint")
+            except Exception as e:
+                logger.warning("RESULT_CACHE_READ_ERROR ns=%s error=%s", _META_NAMESPACE, e)
+        if previous is not None and previous != fingerprint:
+            invalidate_answers()
+        _answer_fingerprint = fingerprint
+        if answer_cache.persistent:
+            storage.cache_set(
+                _META_NAMESPACE,
+                "fingerprint",
+                fingerprint,
+                expires_at=time.time() + _FINGERPRINT_TTL,
+            )
+    return fingerprint
+
+
+def answer_key(question: str) -> str:
+    """
+    Ключ кэша ответов: нормализованный вопрос + отпечаток промпта и модели.
+    """
+    return make_key(question, check_answer_fingerprint())
+
+
+def invalidate_answers() -> None:
+    answer_cache.clear()
+    logger.info("ANSWER_CACHE_INVALIDATED model=%s", SETTINGS.chat_model)
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    return {
+        cache.namespace: cache.stats()
+        for cache in (moderation_cache, paraphrase_cache, answer_cache)
+    }
+
+
+metrics.StatsGauges(
+    "bot_result_cache",
+    "Кэш результатов модерации, перефразирования и ответов",
+    get_stats,
+    label="namespace",
+)
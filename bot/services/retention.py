@@ -0,0 +1,289 @@
+"""
+Очистка старых сообщений диалогов.
+
+В модель уходят только последние DIALOG_CONTEXT_LIMIT сообщений
+(остальное — в summary), а таблица messages растёт бесконечно.
+Фоновая задача периодически удаляет:
+- всё, кроме последних RETENTION_KEEP_MESSAGES сообщений пользователя;
+- и/или сообщения старше RETENTION_DAYS дней.
+
+Удаление идёт маленькими пачками с паузами, чтобы не задерживать
+запись новых сообщений. Удалённое можно сохранять в архив — сжатые
+JSONL-сегменты в RETENTION_ARCHIVE_DIR. После прохода место
+возвращается через PRAGMA incremental_vacuum.
+
+Удалённые сообщения сбрасывают буфер контекста затронутых пользователей
+(в процессе, где идёт очистка): следующий ход перечитает историю из БД.
+
+Разовый запуск — python -m bot.tools.retention.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bot.config import SETTINGS
+from bot.services import metrics, storage
+
+logger = logging.getLogger(__name__)
+
+# Сколько свободных страниц возвращаем за один шаг incremental_vacuum
+_VACUUM_PAGES_PER_STEP = 1000
+
+
+class _Totals:
+    def __init__(self) -> None:
+        self.runs = 0
+        self.pruned_total = 0
+        self.archived_total = 0
+        self.last_pruned = 0
+        self.last_run_seconds = 0.0
+        self.last_rows_per_second = 0.0
+        self.db_bytes = 0
+        self.freelist_pages = 0
+        self._lock = threading.Lock()
+
+    def record(self, report: "RetentionReport") -> None:
+        with self._lock:
+            self.runs += 1
+            self.pruned_total += report.pruned
+            self.archived_total += report.archived
+            self.last_pruned = report.pruned
+            self.last_run_seconds = report.seconds
+            self.last_rows_per_second = report.rows_per_second
+            self.db_bytes = report.db_bytes_after
+            self.freelist_pages = report.freelist_pages
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "pruned_total": self.pruned_total,
+                "archived_total": self.archived_total,
+                "last_pruned": self.last_pruned,
+                "last_run_seconds": self.last_run_seconds,
+                "last_rows_per_second": self.last_rows_per_second,
+                "db_bytes": self.db_bytes,
+                "freelist_pages": self.freelist_pages,
+            }
+
+
+_totals = _Totals()
+
+
+def get_stats() -> Dict[str, float]:
+    return _totals.as_dict()
+
+
+class RetentionReport:
+    def __init__(self) -> None:
+        self.pruned = 0
+        self.archived = 0
+        self.seconds = 0.0
+        self.db_bytes_before = 0
+        self.db_bytes_after = 0
+        self.freelist_pages = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.pruned / self.seconds if self.seconds else 0.0
+
+
+class _Archive:
+    """
+    Один сегмент архива на проход: messages-<время>.jsonl.gz.
+    Файл создаётся только если есть что архивировать.
+    """
+
+    def __init__(self, directory: Optional[str]) -> None:
+        self.directory = directory
+        self.path: Optional[str] = None
+        self._file = None
+
+    def write(self, rows: List[Dict[str, Any]]) -> int:
+        if not self.directory or not rows:
+            return 0
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+            self.path = os.path.join(self.directory, f"messages-{stamp}.jsonl.gz")
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        for row in rows:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        # Сбрасываем на диск до удаления строк из БД
+        self._file.flush()
+        return len(rows)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _db_size_total() -> Dict[str, int]:
+    sizes = [storage.db_size(shard) for shard in range(storage.shard_count())]
+    return {
+        "bytes": sum(size["bytes"] for size in sizes),
+        "freelist_pages": sum(size["freelist_pages"] for size in sizes),
+    }
+
+
+async def _prune_batches(
+    select, shard: int, archive: _Archive, report: RetentionReport, pause: float
+) -> None:
+    while True:
+        rows = await asyncio.to_thread(select)
+        if not rows:
+            return
+        report.archived += await asyncio.to_thread(archive.write, rows)
+        report.pruned += await asyncio.to_thread(
+            storage.delete_messages, [row["id"] for row in rows], shard
+        )
+        # Удалённое не должно и дальше отдаваться из памяти
+        storage.forget_context({row["user_id"] for row in rows})
+        # Пауза между пачками — окно для обычных записей
+        await asyncio.sleep(pause)
+
+
+async def _vacuum(shard: int, pause: float) -> None:
+    # Возвращаем освободившиеся страницы кусками, а не одним долгим VACUUM
+    size = await asyncio.to_thread(storage.db_size, shard)
+    if size["auto_vacuum"] != 2:
+        return
+    freelist = size["freelist_pages"]
+    while freelist > 0:
+        left = await asyncio.to_thread(storage.incremental_vacuum, _VACUUM_PAGES_PER_STEP, shard)
+        if left >= freelist:
+            break
+        freelist = left
+        await asyncio.sleep(pause)
+
+
+async def run_once(
+    keep: int = 0,
+    days: float = 0,
+    batch_size: int = 500,
+    pause: float = 0.05,
+    archive_dir: Optional[str] = None,
+) -> RetentionReport:
+    """
+    Один проход очистки. keep=0 и days=0 — соответствующее правило
+    выключено. Последние DIALOG_CONTEXT_LIMIT сообщений пользователя
+    правило keep не трогает никогда. При DB_SHARDS > 1 шарды
+    обходятся по очереди.
+    """
+    report = RetentionReport()
+    started = time.monotonic()
+    report.db_bytes_before = (await asyncio.to_thread(_db_size_total))["bytes"]
+    archive = _Archive(archive_dir)
+    before = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    if keep > 0:
+        keep = max(keep, SETTINGS.dialog_context_limit)
+    try:
+        for shard in range(storage.shard_count()):
+            if keep > 0:
+                user_ids = await asyncio.to_thread(
+                    storage.users_with_messages_over, keep, shard
+                )
+                for user_id in user_ids:
+                    await _prune_batches(
+                        lambda: storage.select_old_messages(user_id, keep, batch_size),
+                        shard,
+                        archive,
+                        report,
+                        pause,
+                    )
+            if days > 0:
+                await _prune_batches(
+                    lambda: storage.select_expired_messages(before, batch_size, shard),
+                    shard,
+                    archive,
+                    report,
+                    pause,
+                )
+    finally:
+        await asyncio.to_thread(archive.close)
+
+    for shard in range(storage.shard_count()):
+        await _vacuum(shard, pause)
+    size = await asyncio.to_thread(_db_size_total)
+
+    report.seconds = time.monotonic() - started
+    report.db_bytes_after = size["bytes"]
+    report.freelist_pages = size["freelist_pages"]
+    _totals.record(report)
+    logger.info(
+        "RETENTION_RUN pruned=%d archived=%d seconds=%.2f rows_per_sec=%.0f "
+        "db_bytes_before=%d db_bytes_after=%d freelist_pages=%d archive=%s",
+        report.pruned,
+        report.archived,
+        report.seconds,
+        report.rows_per_second,
+        report.db_bytes_before,
+        report.db_bytes_after,
+        report.freelist_pages,
+        archive.path,
+    )
+    return report
+
+
+async def run_forever() -> None:
+    while True:
+        try:
+            await run_once(
+                keep=SETTINGS.retention_keep_messages,
+                days=SETTINGS.retention_days,
+                batch_size=SETTINGS.retention_batch_size,
+                archive_dir=SETTINGS.retention_archive_dir,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.errors_total.inc(stage="retention")
+            logger.exception("RETENTION_ERROR error=%s", e)
+        await asyncio.sleep(SETTINGS.retention_interval)
+
+
+_task: Optional[asyncio.Task] = None
+
+
+def start() -> None:
+    """
+    Запустить фоновую очистку, если включено хотя бы одно правило.
+    """
+    global _task
+    if _task is not None:
+        return
+    if not (SETTINGS.retention_keep_messages or SETTINGS.retention_days):
+        return
+    _task = asyncio.get_running_loop().create_task(run_forever())
+    logger.info(
+        "RETENTION_STARTED keep=%d days=%s interval=%s",
+        SETTINGS.retention_keep_messages,
+        SETTINGS.retention_days,
+        SETTINGS.retention_interval,
+    )
+
+
+async def stop() -> None:
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+
+
+metrics.StatsGauges(
+    "bot_retention",
+    "Очистка старых сообщений: удалено строк, скорость, размер БД",
+    get_stats,
+)
@@ -0,0 +1,167 @@
+"""
+Выбор модели на каждый вызов.
+
+Политика (сверху вниз):
+- paraphrase → PARAPHRASE_MODEL, иначе FAST_MODEL;
+- summary (фоновая задача) → FAST_MODEL;
+- answer: короткий вопрос (до ROUTE_SHORT_CHARS символов) без summary
+  и с контекстом не длиннее ROUTE_MAX_CONTEXT сообщений → FAST_MODEL,
+  остальное → CHAT_MODEL;
+- если у выбранной модели сглаженная задержка выше ROUTE_LATENCY_SLO
+  (по крайней мере по _MIN_SAMPLES замерам), а у второй кандидатки
+  меньше — уходим на неё. Каждый _PROBE_EVERY-й обход всё же идёт
+  в медленную модель пробным вызовом (reason="probe"): без свежих
+  замеров её задержка не обновится и модель не вернётся в работу.
+
+Без FAST_MODEL все вызовы идут в CHAT_MODEL, как раньше.
+Выбор пишется в bot_route_total{task, model, reason}, задержки моделей —
+в bot_route_model_*.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from bot.config import SETTINGS
+from bot.services import metrics
+
+# Вес нового замера в экспоненциальном среднем задержки
+_EWMA_ALPHA = 0.2
+# Сколько замеров нужно, чтобы обходить модель по задержке:
+# один медленный ответ не должен уводить с неё весь трафик
+_MIN_SAMPLES = 5
+# Каждый какой обход медленной модели превращается в пробный вызов к ней
+_PROBE_EVERY = 20
+
+route_total = metrics.Counter(
+    "bot_route_total",
+    "Выбор модели по задаче и причине",
+    ("task", "model", "reason"),
+)
+
+
+@dataclass(frozen=True)
+class Route:
+    model: str
+    reason: str
+
+
+class _LatencyEWMA:
+    """
+    Сглаженная задержка по моделям: время до ответа,
+    для стриминга — до начала потока.
+    """
+
+    def __init__(self) -> None:
+        self._values: Dict[str, float] = {}
+        self._calls: Dict[str, int] = {}
+        # Сколько раз подряд модель обошли после последней пробы
+        self._bypassed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, seconds: float) -> None:
+        with self._lock:
+            previous = self._values.get(model)
+            self._values[model] = (
+                seconds
+                if previous is None
+                else previous + _EWMA_ALPHA * (seconds - previous)
+            )
+            self._calls[model] = self._calls.get(model, 0) + 1
+
+    def get(self, model: str) -> Optional[float]:
+        with self._lock:
+            if self._calls.get(model, 0) < _MIN_SAMPLES:
+                return None
+            return self._values.get(model)
+
+    def bypass(self, model: str) -> bool:
+        """
+        Учесть обход модели; True — пора отправить в неё пробный вызов.
+        """
+        with self._lock:
+            count = self._bypassed.get(model, 0) + 1
+            self._bypassed[model] = 0 if count >= _PROBE_EVERY else count
+            return count >= _PROBE_EVERY
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                model: {"latency_seconds": value, "calls": self._calls[model]}
+                for model, value in self._values.items()
+            }
+
+
+_latency = _LatencyEWMA()
+
+
+def observe(model: str, seconds: float) -> None:
+    _latency.observe(model, seconds)
+
+
+def _fast_model() -> str:
+    return SETTINGS.fast_model or SETTINGS.chat_model
+
+
+def _by_policy(
+    task: str,
+    text: str,
+    context_messages: int,
+    has_summary: bool,
+) -> Route:
+    if task == "paraphrase":
+        if SETTINGS.paraphrase_model:
+            return Route(SETTINGS.paraphrase_model, "paraphrase")
+        return Route(_fast_model(), "paraphrase")
+    if task == "summary":
+        return Route(_fast_model(), "background")
+    if (
+        len(text) <= SETTINGS.route_short_chars
+        and context_messages <= SETTINGS.route_max_context
+        and not has_summary
+    ):
+        return Route(_fast_model(), "short")
+    return Route(SETTINGS.chat_model, "default")
+
+
+def choose(
+    task: str,
+    text: str = "",
+    context: Optional[List[Dict[str, str]]] = None,
+    summary: Optional[str] = None,
+) -> Route:
+    """
+    Модель для вызова: task — "answer", "paraphrase" или "summary".
+    """
+    route = _by_policy(task, text, len(context or ()), bool(summary))
+
+    slo = SETTINGS.route_latency_slo
+    if slo > 0:
+        candidates = {SETTINGS.chat_model, _fast_model()}
+        if task == "paraphrase":
+            candidates.add(route.model)
+        current = _latency.get(route.model)
+        if current is not None and current > slo:
+            for model in candidates - {route.model}:
+                latency = _latency.get(model)
+                # Модель почти без замеров тоже пробуем: иначе её задержку не узнать
+                if latency is None or latency < current:
+                    if _latency.bypass(route.model):
+                        route = Route(route.model, "probe")
+                    else:
+                        route = Route(model, "latency")
+                    break
+
+    route_total.inc(task=task, model=route.model, reason=route.reason)
+    return route
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    return _latency.as_dict()
+
+
+metrics.StatsGauges(
+    "bot_route_model",
+    "Сглаженная задержка и число вызовов по моделям",
+    get_stats,
+    label="model",
+)
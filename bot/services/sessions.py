@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+from uuid import uuid4
+
+from bot.config import SETTINGS, Lazy
+from bot.services import storage
+from bot.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Как часто (раз в сколько созданных сессий) чистим просроченные записи в SQLite
+_PURGE_EVERY = 100
+
+
+class ParaphraseSessionStore:
+    """
+    Хранилище сессий перефразирования (токен → исходный текст и вариант).
+
+    - в памяти: LRU с TTL и ограничением числа сессий, поэтому
+      проигнорированные кнопки не копятся бесконечно;
+    - persistent=True: сессии лежат в SQLite (таблица paraphrase_sessions)
+      и переживают перезапуск бота; просроченные периодически удаляются.
+      Методы асинхронные: SQLite не трогается из event loop напрямую,
+      записи ждём через storage.wait_durable, чтения идут в потоке.
+    """
+
+    def __init__(self, ttl: float, max_sessions: int, persistent: bool = False) -> None:
+        self.ttl = ttl
+        self.persistent = persistent
+        self._memory = TTLCache(maxsize=max_sessions, ttl=ttl)
+        self._created = 0
+
+    async def create(self, user_id: int, original: str, paraphrased: str) -> str:
+        token = str(uuid4())
+        session = {
+            "user_id": user_id,
+            "original": original,
+            "paraphrased": paraphrased,
+        }
+        if self.persistent:
+            # Ждём записи: кнопку могут нажать раньше, чем закоммитится пачка
+            await storage.wait_durable(
+                storage.session_put(token, session, expires_at=time.time() + self.ttl)
+            )
+            self._created += 1
+            if self._created % _PURGE_EVERY == 0:
+                storage.session_purge_expired()
+        else:
+            self._memory.set(token, session)
+        return token
+
+    async def restore(self, token: str, session: Dict[str, Any]) -> None:
+        """
+        Вернуть забранную сессию (например, запрос к модели не был допущен).
+        """
+        if self.persistent:
+            await storage.wait_durable(
+                storage.session_put(token, session, expires_at=time.time() + self.ttl)
+            )
+        else:
+            self._memory.set(token, session)
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        if self.persistent:
+            return await asyncio.to_thread(storage.session_get, token)
+        return self._memory.get(token)
+
+    async def pop(self, token: str) -> Optional[Dict[str, Any]]:
+        if self.persistent:
+            return await storage.wait_durable(storage.session_pop(token))
+        return self._memory.pop(token)
+
+    async def count(self) -> int:
+        if self.persistent:
+            return await asyncio.to_thread(storage.session_count)
+        return len(self._memory)
+
+
+paraphrase_sessions: ParaphraseSessionStore = Lazy(  # type: ignore[assignment]
+    lambda: ParaphraseSessionStore(
+        ttl=SETTINGS.paraphrase_session_ttl,
+        max_sessions=SETTINGS.paraphrase_session_limit,
+        persistent=SETTINGS.paraphrase_sessions_persistent,
+    )
+)
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Dict, Optional
+
+from bot.services import metrics
+from bot.services.context_window import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class _Totals:
+    """
+    Статистика спекулятивной генерации с момента запуска.
+    wasted_* — токены ответов, которые пришлось выбросить,
+    потому что модерация заблокировала сообщение.
+    """
+
+    def __init__(self) -> None:
+        self.started = 0
+        self.released = 0
+        self.discarded = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, field: str, value: int = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "started": self.started,
+                "released": self.released,
+                "discarded": self.discarded,
+                "wasted_prompt_tokens": self.wasted_prompt_tokens,
+                "wasted_completion_tokens": self.wasted_completion_tokens,
+            }
+
+
+_totals = _Totals()
+
+
+def get_stats() -> Dict[str, int]:
+    return _totals.as_dict()
+
+
+class Speculation:
+    """
+    Ответ модели, который начали генерировать заранее — параллельно
+    с модерацией. Пока решения нет, куски ответа копятся в очереди
+    и пользователю не показываются.
+
+    - release() — модерация пройдена: отдаёт уже накопленное и дальше
+      продолжает поток;
+    - discard() — сообщение заблокировано: генерация отменяется,
+      потраченные токены учитываются в статистике.
+    """
+
+    def __init__(self, chunks: AsyncIterator[str], prompt_tokens: int = 0) -> None:
+        self.prompt_tokens = prompt_tokens
+        self.produced = ""
+        self._queue: "asyncio.Queue" = asyncio.Queue()
+        self._error: Optional[BaseException] = None
+        self._task = asyncio.get_running_loop().create_task(self._pump(chunks))
+        _totals.add("started")
+
+    async def _pump(self, chunks: AsyncIterator[str]) -> None:
+        try:
+            async for delta in chunks:
+                self.produced += delta
+                self._queue.put_nowait(delta)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            self._queue.put_nowait(_END)
+
+    async def release(self) -> AsyncIterator[str]:
+        _totals.add("released")
+        while True:
+            delta = await self._queue.get()
+            if delta is _END:
+                break
+            yield delta
+        if self._error is not None:
+            raise self._error
+
+    async def result(self) -> str:
+        return "".join([delta async for delta in self.release()]).strip()
+
+    async def discard(self) -> int:
+        """
+        Отменяем генерацию. Возвращаем число выброшенных токенов ответа.
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            pass
+        wasted = count_tokens(self.produced) if self.produced else 0
+        _totals.add("discarded")
+        _totals.add("wasted_prompt_tokens", self.prompt_tokens)
+        _totals.add("wasted_completion_tokens", wasted)
+        logger.info(
+            "SPECULATION_DISCARDED prompt_tokens=%d completion_tokens=%d",
+            self.prompt_tokens,
+            wasted,
+        )
+        return wasted
+
+
+metrics.StatsGauges(
+    "bot_speculation",
+    "Спекулятивная генерация: запуски, выброшенные ответы и токены",
+    get_stats,
+)
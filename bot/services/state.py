@@ -1,15 +1,23 @@
+import threading
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Dict
+from itertools import islice
+from types import MappingProxyType
+from typing import Any, Deque, List, Dict, Mapping, MutableSequence, Optional
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
 
 
 @dataclass
 class UserState:
     user_id: int
-    name: str
-    created_at: str
-    last_reset_at: str
-    dialog_context: List[Dict[str, str]] = field(default_factory=list)
+    name: str = ""
+    created_at: str = field(default_factory=_now)
+    last_reset_at: str = field(default_factory=_now)
+    dialog_context: MutableSequence[Dict[str, str]] = field(default_factory=list)
     requests_count: int = 0
     violations_count: int = 0
     mode: str = "default"
@@ -19,3 +27,157 @@ def reset_state(state: UserState) -> UserState:
     state.dialog_context = []
     state.last_reset_at = datetime.utcnow().isoformat()
     return state
+
+
+# Примерные накладные расходы на одно сообщение в буфере (dict, строки), байт
+_MESSAGE_OVERHEAD = 300
+
+
+def chat_entry(message: Dict[str, Any]) -> Mapping[str, str]:
+    """
+    Сообщение в формате chat.completions ({role, content}). У сообщений
+    из буфера оно построено один раз при загрузке или дописывании
+    и неизменяемо, поэтому его можно отдавать в каждый промпт.
+    """
+    entry = message.get("chat")
+    if entry is None:
+        entry = MappingProxyType(
+            {"role": message["role"], "content": message["content"]}
+        )
+    return entry
+
+
+def _with_chat_entry(message: Dict[str, Any]) -> Dict[str, Any]:
+    if "chat" not in message:
+        message["chat"] = chat_entry(message)
+    return message
+
+
+# Накладные расходы на сам диалог (UserState, deque, запись в OrderedDict),
+# чтобы и пустые контексты после /reset учитывались в бюджете
+_STATE_OVERHEAD = 600
+
+
+def _message_size(message: Dict[str, str]) -> int:
+    return len(message["content"]) * 2 + _MESSAGE_OVERHEAD
+
+
+def _state_size(state: UserState) -> int:
+    return _STATE_OVERHEAD + sum(_message_size(m) for m in state.dialog_context)
+
+
+class DialogContextBuffer:
+    """
+    Буфер последних сообщений активных диалогов в памяти процесса.
+
+    Для каждого пользователя хранится UserState, в dialog_context которого
+    лежат последние capacity сообщений (deque(maxlen=capacity): старые
+    вытесняются новыми за O(1)). Пользователь попадает в буфер только целиком
+    (после загрузки из БД), поэтому наличие записи означает, что
+    контекст в ней полный.
+
+    Общий объём ограничен memory_budget байт (оценка): при превышении
+    вытесняются диалоги, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, capacity: int, memory_budget: int) -> None:
+        self.capacity = max(1, capacity)
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._states: "OrderedDict[int, UserState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, limit: int) -> Optional[List[Dict[str, str]]]:
+        """
+        Последние limit сообщений или None, если диалога нет в буфере
+        (или просят больше, чем буфер хранит).
+        """
+        with self._lock:
+            state = self._states.get(user_id) if limit <= self.capacity else None
+            if state is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._states.move_to_end(user_id)
+            context = state.dialog_context
+            if limit <= 0:
+                return []
+            return list(islice(context, max(0, len(context) - limit), None))
+
+    def load(self, user_id: int, messages: List[Dict[str, str]]) -> None:
+        """
+        Положить в буфер контекст, прочитанный из БД.
+        """
+        with self._lock:
+            self._drop(user_id)
+            state = UserState(user_id=user_id)
+            state.dialog_context = self._ring(_with_chat_entry(m) for m in messages)
+            self._states[user_id] = state
+            self.memory_used += _state_size(state)
+            self._evict()
+
+    def append(self, user_id: int, message: Dict[str, str]) -> None:
+        """
+        Дописать новое сообщение (write-through из storage.add_message).
+        Если диалога нет в буфере, он будет загружен из БД при следующем чтении.
+        """
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                return
+            context = state.dialog_context
+            if len(context) == self.capacity:
+                # deque сам вытеснит самое старое сообщение
+                self.memory_used -= _message_size(context[0])
+            context.append(_with_chat_entry(message))
+            self.memory_used += _message_size(message)
+            self._states.move_to_end(user_id)
+            self._evict()
+
+    def reset(self, user_id: int) -> None:
+        """
+        Диалог сброшен: в буфере остаётся пустой контекст,
+        чтобы не ходить за ним в БД.
+        """
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                state = UserState(user_id=user_id)
+                self._states[user_id] = state
+            else:
+                self.memory_used -= _state_size(state)
+            reset_state(state)
+            state.dialog_context = self._ring(())
+            self.memory_used += _state_size(state)
+            self._states.move_to_end(user_id)
+            self._evict()
+
+    def discard(self, user_id: int) -> None:
+        """
+        Убрать диалог из буфера: при следующем чтении он загрузится из БД.
+        """
+        with self._lock:
+            self._drop(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+            self.memory_used = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _ring(self, messages) -> Deque[Dict[str, str]]:
+        return deque(messages, maxlen=self.capacity)
+
+    def _drop(self, user_id: int) -> None:
+        state = self._states.pop(user_id, None)
+        if state is not None:
+            self.memory_used -= _state_size(state)
+
+    def _evict(self) -> None:
+        while self.memory_used > self.memory_budget and len(self._states) > 1:
+            _, state = self._states.popitem(last=False)
+            self.memory_used -= _state_size(state)
@@ -1,27 +1,68 @@
+import asyncio
+import functools
+import logging
+import os
+import queue
 import sqlite3
 import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
-from bot.config import SETTINGS
+from bot.config import SETTINGS, Lazy
+from bot.services import metrics
+from bot.services.cache import TTLCache
+from bot.services.state import DialogContextBuffer
 
-_db_lock = threading.Lock()
-_conn: Optional[sqlite3.Connection] = None
+logger = logging.getLogger(__name__)
 
+# Кэш строк users: mute-флаг, счётчики и профиль читаются на каждом
+# сообщении, а меняются редко. Все изменения users в этом модуле
+# обновляют кэш, поэтому он остаётся согласованным с БД.
+_user_cache: TTLCache = Lazy(  # type: ignore[assignment]
+    lambda: TTLCache(maxsize=SETTINGS.user_cache_size, ttl=SETTINGS.user_cache_ttl)
+)
 
-def _get_conn() -> sqlite3.Connection:
-    global _conn
-    if _conn is None:
-        _conn = sqlite3.connect(SETTINGS.db_path, check_same_thread=False)
-        _conn.row_factory = sqlite3.Row
-    return _conn
+# Последние сообщения активных диалогов: контекст для модели
+# берётся из памяти, в БД ходим только при первом обращении.
+_context_buffer: DialogContextBuffer = Lazy(  # type: ignore[assignment]
+    lambda: DialogContextBuffer(
+        capacity=SETTINGS.dialog_context_limit,
+        memory_budget=int(SETTINGS.dialog_context_memory_mb * 1024 * 1024),
+    )
+)
 
+# Summary диалогов читаются на каждом ходе, а меняются редко.
+# None в кэше означает «summary нет», поэтому храним обёртку.
+_summary_cache: TTLCache = Lazy(  # type: ignore[assignment]
+    lambda: TTLCache(maxsize=SETTINGS.user_cache_size, ttl=SETTINGS.user_cache_ttl)
+)
 
-def init_db() -> None:
-    conn = _get_conn()
-    with _db_lock:
-        cur = conn.cursor()
-        cur.execute(
+# Операция над БД: получает курсор и возвращает результат
+Operation = Callable[[sqlite3.Cursor], Any]
+
+
+# Настройки каждого соединения:
+# - synchronous=NORMAL в WAL-режиме fsync-ит только на чекпоинтах;
+# - cache_size < 0 — размер кэша страниц в КиБ (~64 МБ);
+# - mmap_size — читаем БД через отображение в память (256 МБ);
+# - busy_timeout — ждём блокировку, а не падаем с "database is locked".
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Версионированные миграции схемы: (версия, список SQL-выражений).
+# Текущая версия хранится в PRAGMA user_version. Новые миграции
+# только дописываются в конец, уже выпущенные не меняются.
+_MIGRATIONS: List[Tuple[int, List[str]]] = [
+    (
+        1,
+        [
             """
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -33,9 +74,7 @@ def init_db() -> None:
                 violations_count INTEGER DEFAULT 0,
                 is_muted INTEGER DEFAULT 0
             )
-            """
-        )
-        cur.execute(
+            """,
             """
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,23 +84,538 @@ def init_db() -> None:
                 created_at TEXT NOT NULL,
                 FOREIGN KEY(user_id) REFERENCES users(user_id)
             )
+            """,
+        ],
+    ),
+    (
+        # get_last_messages и reset_dialog ищут по user_id и сортируют по id
+        2,
+        [
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_user_id_id
+            ON messages(user_id, id)
+            """,
+        ],
+    ),
+    (
+        # Свёрнутая в краткое содержание старая часть диалога.
+        # covered_until — created_at последнего учтённого сообщения.
+        3,
+        [
+            """
+            CREATE TABLE IF NOT EXISTS dialog_summaries (
+                user_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL,
+                covered_until TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(user_id)
+            )
+            """,
+        ],
+    ),
+    (
+        # Кэш результатов внешних вызовов (модерация, перефразирование)
+        4,
+        [
             """
+            CREATE TABLE IF NOT EXISTS result_cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """,
+        ],
+    ),
+    (
+        # Сессии перефразирования (inline-кнопки), переживающие перезапуск
+        5,
+        [
+            """
+            CREATE TABLE IF NOT EXISTS paraphrase_sessions (
+                token TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                original TEXT NOT NULL,
+                paraphrased TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_paraphrase_sessions_expires_at
+            ON paraphrase_sessions(expires_at)
+            """,
+        ],
+    ),
+    (
+        # Токены каждого вызова модели: сколько промпта провайдер взял
+        # из кэша префиксов (cached_tokens) — по пользователям и моделям
+        6,
+        [
+            """
+            CREATE TABLE IF NOT EXISTS token_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                op TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                cached_tokens INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_token_usage_user_id_created_at
+            ON token_usage(user_id, created_at)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_token_usage_created_at
+            ON token_usage(created_at)
+            """,
+        ],
+    ),
+    (
+        # Граница summary — id последнего свёрнутого сообщения: у двух
+        # сообщений created_at может совпасть, id растёт строго.
+        # Для старых summary берём последнее сообщение до covered_until.
+        7,
+        [
+            """
+            ALTER TABLE dialog_summaries
+            ADD COLUMN covered_until_id INTEGER NOT NULL DEFAULT 0
+            """,
+            """
+            UPDATE dialog_summaries
+            SET covered_until_id = COALESCE(
+                (
+                    SELECT MAX(id) FROM messages
+                    WHERE messages.user_id = dialog_summaries.user_id
+                      AND messages.created_at <= dialog_summaries.covered_until
+                ),
+                0
+            )
+            """,
+        ],
+    ),
+]
+
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class _WriteBehindWriter:
+    """
+    Отдельный поток-писатель.
+
+    Изменения складываются в очередь, поток забирает их пачкой
+    (до batch_size операций или пока не истечёт interval секунд
+    с момента первой операции в пачке) и выполняет одной
+    транзакцией — один fsync на всю пачку вместо одного на каждый вызов.
+
+    Каждая операция выполняется внутри своего SAVEPOINT, поэтому
+    ошибка в одной из них не откатывает остальные.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str, batch_size: int, interval: float, index: int = 0) -> None:
+        self._path = path
+        self._batch_size = max(1, batch_size)
+        self._interval = max(0.0, interval)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"storage-writer-{index}",
+            daemon=True,
         )
-        conn.commit()
 
+    def start(self) -> None:
+        self._thread.start()
 
-def get_or_create_user(
+    def submit(self, op: Operation) -> Future:
+        fut: Future = Future()
+        self._queue.put((op, fut))
+        return fut
+
+    def stop(self) -> None:
+        # Всё, что уже в очереди, будет записано до остановки
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        conn = _connect(self._path)
+        # Транзакциями управляем сами (BEGIN/SAVEPOINT/COMMIT)
+        conn.isolation_level = None
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is self._STOP:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self._interval
+                while len(batch) < self._batch_size:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        if timeout > 0:
+                            item = self._queue.get(timeout=timeout)
+                        else:
+                            item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list) -> None:
+        results = []
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN")
+            for op, fut in batch:
+                cur.execute("SAVEPOINT op")
+                try:
+                    results.append((fut, op(cur), None))
+                    cur.execute("RELEASE op")
+                except Exception as e:
+                    cur.execute("ROLLBACK TO op")
+                    cur.execute("RELEASE op")
+                    results.append((fut, None, e))
+                    # Большинство вызывающих future не ждёт — иначе ошибка потеряется
+                    metrics.errors_total.inc(stage="storage_write")
+                    logger.error(
+                        "STORAGE_WRITE_ERROR op=%s error=%r",
+                        getattr(op, "__qualname__", op),
+                        e,
+                    )
+            cur.execute("COMMIT")
+        except Exception as e:
+            metrics.errors_total.inc(stage="storage_write")
+            logger.exception("STORAGE_BATCH_ERROR size=%d error=%s", len(batch), e)
+            if conn.in_transaction:
+                conn.rollback()
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        # Результаты отдаём только после COMMIT — значит, данные уже на диске
+        for fut, result, error in results:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+
+class _Shard:
+    """
+    Один файл SQLite: своё соединение, свой замок и свой поток-писатель.
+    Записи в разные шарды не ждут друг друга.
+    """
+
+    def __init__(self, index: int, path: str) -> None:
+        self.index = index
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        # Отдельное соединение для чтения в режиме write-behind,
+        # чтобы SELECT-ы не стояли в очереди за записью.
+        self.read_lock = threading.Lock()
+        self.read_conn: Optional[sqlite3.Connection] = None
+        self.writer: Optional[_WriteBehindWriter] = None
+
+    def get_conn(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = _connect(self.path)
+        return self.conn
+
+    def write(self, op: Operation) -> Future:
+        if self.writer is not None:
+            return self.writer.submit(op)
+
+        fut: Future = Future()
+        conn = self.get_conn()
+        with self.lock:
+            cur = conn.cursor()
+            try:
+                result = op(cur)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        fut.set_result(result)
+        return fut
+
+    def read(self, op: Operation) -> Any:
+        if self.writer is None:
+            conn = self.get_conn()
+            with self.lock:
+                return op(conn.cursor())
+
+        with self.read_lock:
+            if self.read_conn is None:
+                self.read_conn = _connect(self.path)
+            return op(self.read_conn.cursor())
+
+    def start_write_behind(self, batch_size: int, interval: float) -> None:
+        if self.writer is not None:
+            return
+        writer = _WriteBehindWriter(self.path, batch_size, interval, self.index)
+        writer.start()
+        self.writer = writer
+
+    def stop_write_behind(self) -> None:
+        writer = self.writer
+        if writer is None:
+            return
+        self.writer = None
+        writer.stop()
+        with self.read_lock:
+            if self.read_conn is not None:
+                self.read_conn.close()
+                self.read_conn = None
+
+    def close(self) -> None:
+        self.stop_write_behind()
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+# Шарды создаются при первом обращении по SETTINGS.db_path и
+# SETTINGS.db_shards и сбрасываются в close_db().
+_shards: List[_Shard] = []
+_shards_lock = threading.Lock()
+
+
+def shard_path(index: int, base_path: Optional[str] = None, shards: int = 1) -> str:
+    """
+    Путь к файлу шарда: нулевой — сам DB_PATH, остальные рядом
+    с номером перед расширением (bot.db → bot.1.db, bot.2.db, ...).
+    """
+    base_path = base_path or SETTINGS.db_path
+    if index == 0 or shards <= 1:
+        return base_path
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.{index}{ext}"
+
+
+def _get_shards() -> List[_Shard]:
+    if not _shards:
+        with _shards_lock:
+            if not _shards:
+                count = max(1, SETTINGS.db_shards)
+                _shards.extend(
+                    _Shard(i, shard_path(i, SETTINGS.db_path, count))
+                    for i in range(count)
+                )
+    return _shards
+
+
+def shard_count() -> int:
+    return len(_get_shards())
+
+
+def shard_for(user_id: int) -> int:
+    """
+    Номер шарда пользователя. Таблицы без user_id
+    (result_cache, paraphrase_sessions) живут в нулевом шарде.
+    """
+    return user_id % shard_count()
+
+
+def _get_shard(user_id: Optional[int] = None, shard: Optional[int] = None) -> _Shard:
+    shards = _get_shards()
+    if shard is None:
+        shard = 0 if user_id is None else user_id % len(shards)
+    return shards[shard]
+
+
+def _get_conn(shard: int = 0) -> sqlite3.Connection:
+    return _get_shard(shard=shard).get_conn()
+
+
+def _write(op: Operation, user_id: Optional[int] = None, shard: Optional[int] = None) -> Future:
+    """
+    Выполнить изменение БД в шарде пользователя user_id
+    (без user_id — в нулевом шарде).
+
+    В обычном режиме операция выполняется сразу и коммитится.
+    В режиме write-behind — ставится в очередь писателя шарда; возвращённый
+    Future завершится, когда пачка с этой операцией будет закоммичена.
+    """
+    return _get_shard(user_id, shard).write(op)
+
+
+def _read(op: Operation, user_id: Optional[int] = None, shard: Optional[int] = None) -> Any:
+    return _get_shard(user_id, shard).read(op)
+
+
+def _write_behind_active() -> bool:
+    return any(shard.writer is not None for shard in _shards)
+
+
+def start_write_behind(batch_size: int = 100, interval_ms: float = 5.0) -> None:
+    """
+    Включить режим write-behind: все изменения идут через потоки-писатели
+    (по одному на шард) с групповыми коммитами, чтения — через отдельные
+    соединения.
+    """
+    if _write_behind_active():
+        return
+    for shard in _get_shards():
+        shard.start_write_behind(batch_size, interval_ms / 1000)
+    logger.info(
+        "STORAGE_WRITE_BEHIND batch_size=%d interval_ms=%s shards=%d",
+        batch_size,
+        interval_ms,
+        len(_shards),
+    )
+
+
+def stop_write_behind() -> None:
+    """
+    Дописать всё из очередей и вернуться к синхронной записи.
+    """
+    for shard in _shards:
+        shard.stop_write_behind()
+
+
+def close_db() -> None:
+    _user_cache.clear()
+    _context_buffer.clear()
+    _summary_cache.clear()
+    with _shards_lock:
+        for shard in _shards:
+            shard.close()
+        _shards.clear()
+
+
+async def wait_durable(fut: Future) -> Any:
+    """
+    Дождаться, пока изменение будет закоммичено (для вызывающих,
+    которым важна гарантия записи на диск).
+    """
+    return await asyncio.wrap_future(fut)
+
+
+async def flush() -> None:
+    """
+    Дождаться записи всех изменений, поставленных в очередь до этого вызова.
+    """
+    await asyncio.gather(
+        *(wait_durable(_write(lambda cur: None, shard=i)) for i in range(shard_count()))
+    )
+
+
+def get_schema_version() -> int:
+    return _read(lambda cur: cur.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(target_version: Optional[int] = None) -> int:
+    """
+    Применить недостающие миграции (до target_version включительно,
+    по умолчанию — до последней). Возвращает итоговую версию схемы.
+    """
+    if target_version is None:
+        target_version = SCHEMA_VERSION
+
+    def op(cur: sqlite3.Cursor) -> int:
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        for migration_version, statements in _MIGRATIONS:
+            if migration_version <= version or migration_version > target_version:
+                continue
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(f"PRAGMA user_version = {migration_version:d}")
+            logger.info("STORAGE_MIGRATION version=%d", migration_version)
+            version = migration_version
+        return version
+
+    # Схема во всех шардах одинаковая, глобальные таблицы
+    # в шардах кроме нулевого просто пустые
+    versions = [_write(op, shard=i).result() for i in range(shard_count())]
+    return min(versions)
+
+
+def init_db() -> None:
+    for shard in _get_shards():
+        conn = shard.get_conn()
+        # WAL: читатели не блокируют писателя и наоборот. Режим хранится
+        # в самом файле БД, поэтому достаточно включить его один раз.
+        with shard.lock:
+            # Новая БД сразу создаётся с auto_vacuum=INCREMENTAL: место после
+            # очистки старых сообщений можно возвращать кусками
+            # (incremental_vacuum). Для уже существующей БД режим меняется
+            # только полным VACUUM — см. enable_incremental_vacuum().
+            if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+
+    version = migrate()
+    logger.info("STORAGE_READY schema_version=%d shards=%d", version, shard_count())
+
+    if SETTINGS.db_write_behind:
+        start_write_behind(SETTINGS.db_batch_size, SETTINGS.db_batch_interval_ms)
+
+
+def _timed(func: Callable) -> Callable:
+    """
+    Длительность вызова в метрике bot_storage_seconds{op=<имя функции>}.
+    Для записей через write-behind это время постановки в очередь.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with metrics.storage_seconds.time(op=name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _select_user(cur: sqlite3.Cursor, user_id: int) -> Optional[Dict[str, Any]]:
+    cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def _update_cached_user(user_id: int, **fields: Any) -> None:
+    row = _user_cache.peek(user_id)
+    if row is not None:
+        # Заменяем запись целиком: уже выданные копии не меняются
+        _user_cache.set(user_id, {**row, **fields})
+
+
+def _existing_user(
     user_id: int,
     username: Optional[str],
     first_name: Optional[str],
-) -> Dict[str, Any]:
-    conn = _get_conn()
-    now = datetime.utcnow().isoformat()
-    with _db_lock:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if row:
+) -> Optional[Dict[str, Any]]:
+    """
+    Пользователь из кэша или БД с обновлённым профилем; None — его ещё нет.
+    """
+    row = _user_cache.get(user_id)
+    if row is None:
+        row = _read(lambda cur: _select_user(cur, user_id), user_id)
+    if not row:
+        return None
+
+    # Пишем профиль, только если он действительно изменился
+    if row["username"] != username or row["first_name"] != first_name:
+        def update(cur: sqlite3.Cursor) -> None:
             cur.execute(
                 """
                 UPDATE users
@@ -70,36 +624,89 @@ def get_or_create_user(
                 """,
                 (username, first_name, user_id),
             )
-            conn.commit()
-            return dict(row)
-        else:
-            cur.execute(
-                """
-                INSERT INTO users (user_id, username, first_name, registered_at, last_reset_at)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (user_id, username, first_name, now, now),
-            )
-            conn.commit()
-            cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            return dict(cur.fetchone())
 
+        _write(update, user_id)
+        row = {**row, "username": username, "first_name": first_name}
+    _user_cache.set(user_id, row)
+    return dict(row)
 
-def increment_requests(user_id: int, delta: int = 1) -> None:
-    conn = _get_conn()
-    with _db_lock:
-        cur = conn.cursor()
+
+def _create_user(
+    user_id: int,
+    username: Optional[str],
+    first_name: Optional[str],
+) -> Future:
+    now = datetime.utcnow().isoformat()
+
+    def create(cur: sqlite3.Cursor) -> Dict[str, Any]:
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO users (user_id, username, first_name, registered_at, last_reset_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (user_id, username, first_name, now, now),
+        )
+        return _select_user(cur, user_id)
+
+    return _write(create, user_id)
+
+
+@_timed
+def get_or_create_user(
+    user_id: int,
+    username: Optional[str],
+    first_name: Optional[str],
+) -> Dict[str, Any]:
+    row = _existing_user(user_id, username, first_name)
+    if row is not None:
+        return row
+
+    row = _create_user(user_id, username, first_name).result()
+    _user_cache.set(user_id, row)
+    return dict(row)
+
+
+async def get_or_create_user_async(
+    user_id: int,
+    username: Optional[str],
+    first_name: Optional[str],
+) -> Dict[str, Any]:
+    """
+    get_or_create_user для обработчиков: запись нового пользователя
+    ждём, не блокируя event loop (в write-behind это до одной пачки).
+    """
+    with metrics.storage_seconds.time(op="get_or_create_user"):
+        row = _existing_user(user_id, username, first_name)
+        if row is not None:
+            return row
+
+        row = await wait_durable(_create_user(user_id, username, first_name))
+        _user_cache.set(user_id, row)
+        return dict(row)
+
+
+@_timed
+def increment_requests(user_id: int, delta: int = 1) -> Future:
+    def op(cur: sqlite3.Cursor) -> None:
         cur.execute(
             "UPDATE users SET total_requests = total_requests + ? WHERE user_id = ?",
             (delta, user_id),
         )
-        conn.commit()
 
+    row = _user_cache.peek(user_id)
+    if row is not None:
+        _update_cached_user(user_id, total_requests=row["total_requests"] + delta)
+    return _write(op, user_id)
 
-def increment_violations(user_id: int, delta: int = 1) -> int:
-    conn = _get_conn()
-    with _db_lock:
-        cur = conn.cursor()
+
+def _increment_violations(user_id: int, delta: int) -> Tuple[Optional[int], Future]:
+    """
+    Поставить увеличение счётчика в запись. Если счётчик известен
+    из кэша, сразу возвращаем новое значение, иначе — None, и значение
+    придёт в future.
+    """
+
+    def op(cur: sqlite3.Cursor) -> int:
         cur.execute(
             """
             UPDATE users
@@ -112,48 +719,93 @@ def increment_violations(user_id: int, delta: int = 1) -> int:
             "SELECT violations_count FROM users WHERE user_id = ?", (user_id,)
         )
         row = cur.fetchone()
-        conn.commit()
         return row["violations_count"] if row else 0
 
+    row = _user_cache.peek(user_id)
+    if row is not None:
+        # Счётчик уже известен из кэша — ждать записи в БД не нужно
+        count = row["violations_count"] + delta
+        _update_cached_user(user_id, violations_count=count)
+        return count, _write(op, user_id)
 
-def set_muted(user_id: int, muted: bool) -> None:
-    conn = _get_conn()
-    with _db_lock:
-        cur = conn.cursor()
+    return None, _write(op, user_id)
+
+
+@_timed
+def increment_violations(user_id: int, delta: int = 1) -> int:
+    count, fut = _increment_violations(user_id, delta)
+    return count if count is not None else fut.result()
+
+
+async def increment_violations_async(user_id: int, delta: int = 1) -> int:
+    """
+    increment_violations для обработчиков: без кэша ждём запись,
+    не блокируя event loop.
+    """
+    with metrics.storage_seconds.time(op="increment_violations"):
+        count, fut = _increment_violations(user_id, delta)
+        return count if count is not None else await wait_durable(fut)
+
+
+@_timed
+def set_muted(user_id: int, muted: bool) -> Future:
+    def op(cur: sqlite3.Cursor) -> None:
         cur.execute(
             "UPDATE users SET is_muted = ? WHERE user_id = ?",
             (1 if muted else 0, user_id),
         )
-        conn.commit()
 
+    _update_cached_user(user_id, is_muted=1 if muted else 0)
+    return _write(op, user_id)
 
+
+@_timed
 def get_user(user_id: int) -> Optional[Dict[str, Any]]:
-    conn = _get_conn()
-    with _db_lock:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        return dict(row) if row else None
+    row = _user_cache.get(user_id)
+    if row is None:
+        row = _read(lambda cur: _select_user(cur, user_id), user_id)
+        if row is None:
+            return None
+        _user_cache.set(user_id, row)
+    return dict(row)
+
+
+def forget_context(user_ids: Iterable[int]) -> None:
+    """
+    Сообщения пользователей удалены в обход add_message/reset_dialog
+    (очистка): их буфер контекста перечитается из БД.
+    """
+    for user_id in user_ids:
+        _context_buffer.discard(user_id)
 
 
-def reset_dialog(user_id: int) -> None:
-    conn = _get_conn()
+@_timed
+def reset_dialog(user_id: int) -> Future:
     now = datetime.utcnow().isoformat()
-    with _db_lock:
-        cur = conn.cursor()
+
+    def op(cur: sqlite3.Cursor) -> None:
         cur.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+        cur.execute("DELETE FROM dialog_summaries WHERE user_id = ?", (user_id,))
         cur.execute(
             "UPDATE users SET last_reset_at = ? WHERE user_id = ?",
             (now, user_id),
         )
-        conn.commit()
+
+    _update_cached_user(user_id, last_reset_at=now)
+    _context_buffer.reset(user_id)
+    _summary_cache.set(user_id, (None,))
+    return _write(op, user_id)
 
 
-def add_message(user_id: int, role: str, content: str) -> None:
-    conn = _get_conn()
+@_timed
+def add_message(user_id: int, role: str, content: str) -> Future:
+    """
+    Future вернёт id сообщения. В буфере контекста id появляется
+    у сообщения после записи (в write-behind — после коммита пачки).
+    """
     now = datetime.utcnow().isoformat()
-    with _db_lock:
-        cur = conn.cursor()
+
+    def op(cur: sqlite3.Cursor) -> int:
         cur.execute(
             """
             INSERT INTO messages (user_id, role, content, created_at)
@@ -161,24 +813,502 @@ def add_message(user_id: int, role: str, content: str) -> None:
             """,
             (user_id, role, content, now),
         )
-        conn.commit()
+        return cur.lastrowid
 
+    message = {"role": role, "content": content, "created_at": now}
+    _context_buffer.append(user_id, message)
+    fut = _write(op, user_id)
 
+    def set_id(done: Future) -> None:
+        if done.exception() is None:
+            message["id"] = done.result()
+
+    fut.add_done_callback(set_id)
+    return fut
+
+
+@_timed
 def get_last_messages(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    with _db_lock:
-        cur = conn.cursor()
+    """
+    Последние limit сообщений диалога в хронологическом порядке.
+    Возвращаемые словари общие с буфером контекста — их нельзя изменять.
+    """
+    buffered = _context_buffer.get(user_id, limit)
+    if buffered is not None:
+        return buffered
+
+    # Читаем сразу столько, сколько держит буфер, и кладём туда
+    fetch = max(limit, _context_buffer.capacity)
+
+    def op(cur: sqlite3.Cursor) -> List[Dict[str, Any]]:
         cur.execute(
             """
-            SELECT role, content, created_at
+            SELECT id, role, content, created_at
             FROM messages
             WHERE user_id = ?
             ORDER BY id DESC
             LIMIT ?
             """,
-            (user_id, limit),
+            (user_id, fetch),
         )
         rows = cur.fetchall()
         result = [dict(r) for r in rows]
         result.reverse()
         return result
+
+    result = _read(op, user_id)
+    _context_buffer.load(user_id, result)
+    return result[-limit:] if limit > 0 else []
+
+
+@_timed
+def get_summary(user_id: int) -> Optional[Dict[str, Any]]:
+    cached = _summary_cache.get(user_id)
+    if cached is not None:
+        return cached[0]
+
+    def op(cur: sqlite3.Cursor) -> Optional[Dict[str, Any]]:
+        cur.execute(
+            """
+            SELECT summary, covered_until, covered_until_id, updated_at
+            FROM dialog_summaries
+            WHERE user_id = ?
+            """,
+            (user_id,),
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    row = _read(op, user_id)
+    _summary_cache.set(user_id, (row,))
+    return row
+
+
+@_timed
+def save_summary(
+    user_id: int,
+    summary: str,
+    covered_until_id: int,
+    covered_until: str = "",
+) -> Future:
+    """
+    covered_until_id — id последнего свёрнутого сообщения (граница
+    для истории), covered_until — его created_at, для справки.
+    """
+    now = datetime.utcnow().isoformat()
+
+    def op(cur: sqlite3.Cursor) -> None:
+        cur.execute(
+            """
+            INSERT INTO dialog_summaries (
+                user_id, summary, covered_until, covered_until_id, updated_at
+            )
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                summary = excluded.summary,
+                covered_until = excluded.covered_until,
+                covered_until_id = excluded.covered_until_id,
+                updated_at = excluded.updated_at
+            """,
+            (user_id, summary, covered_until, covered_until_id, now),
+        )
+
+    row = {
+        "summary": summary,
+        "covered_until": covered_until,
+        "covered_until_id": covered_until_id,
+        "updated_at": now,
+    }
+    _summary_cache.set(user_id, (row,))
+    return _write(op, user_id)
+
+
+@_timed
+def record_usage(
+    user_id: int,
+    model: str,
+    operation: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int,
+) -> Future:
+    now = datetime.utcnow().isoformat()
+
+    def op(cur: sqlite3.Cursor) -> None:
+        cur.execute(
+            """
+            INSERT INTO token_usage (
+                user_id, model, op, prompt_tokens,
+                completion_tokens, cached_tokens, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                user_id,
+                model,
+                operation,
+                prompt_tokens,
+                completion_tokens,
+                cached_tokens,
+                now,
+            ),
+        )
+
+    return _write(op, user_id)
+
+
+# Колонки группировки и суммируемые колонки для usage_totals
+_USAGE_GROUPS = ("user_id", "model", "op")
+_USAGE_SUMS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def usage_totals(
+    group_by: str = "model",
+    since: Optional[str] = None,
+    user_id: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Сумма токенов из token_usage по user_id, model или op (с since
+    включительно, ISO-строка). С user_id читается только его шард,
+    иначе суммы по шардам складываются. Отсортировано по prompt_tokens.
+    """
+    if group_by not in _USAGE_GROUPS:
+        raise ValueError(f"unknown group: {group_by}")
+    conditions = []
+    params: List[Any] = []
+    if since:
+        conditions.append("created_at >= ?")
+        params.append(since)
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT {group_by} AS key,
+               COUNT(*) AS calls,
+               SUM(prompt_tokens) AS prompt_tokens,
+               SUM(completion_tokens) AS completion_tokens,
+               SUM(cached_tokens) AS cached_tokens
+        FROM token_usage {where}
+        GROUP BY {group_by}
+    """
+
+    def op(cur: sqlite3.Cursor) -> List[Dict[str, Any]]:
+        return [dict(r) for r in cur.execute(query, params).fetchall()]
+
+    if user_id is not None:
+        rows = _read(op, user_id)
+    else:
+        rows = [row for i in range(shard_count()) for row in _read(op, shard=i)]
+
+    totals: Dict[Any, Dict[str, Any]] = {}
+    for row in rows:
+        total = totals.setdefault(
+            row["key"], {group_by: row["key"], **{c: 0 for c in _USAGE_SUMS}}
+        )
+        for column in _USAGE_SUMS:
+            total[column] += row[column]
+    for total in totals.values():
+        prompt = total["prompt_tokens"]
+        total["cached_ratio"] = total["cached_tokens"] / prompt if prompt else 0.0
+    return sorted(totals.values(), key=lambda t: t["prompt_tokens"], reverse=True)
+
+
+@_timed
+def cache_get(namespace: str, key: str) -> Optional[str]:
+    def op(cur: sqlite3.Cursor) -> Optional[str]:
+        cur.execute(
+            """
+            SELECT value FROM result_cache
+            WHERE namespace = ? AND key = ? AND expires_at > ?
+            """,
+            (namespace, key, time.time()),
+        )
+        row = cur.fetchone()
+        return row["value"] if row else None
+
+    return _read(op)
+
+
+@_timed
+def cache_set(namespace: str, key: str, value: str, expires_at: float) -> Future:
+    def op(cur: sqlite3.Cursor) -> None:
+        cur.execute(
+            """
+            INSERT OR REPLACE INTO result_cache (namespace, key, value, expires_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (namespace, key, value, expires_at),
+        )
+
+    return _write(op)
+
+
+def cache_purge(namespace: Optional[str] = None, expired_only: bool = False) -> Future:
+    """
+    Удалить записи кэша: все или только просроченные,
+    во всех пространствах имён или в одном.
+    """
+    conditions = []
+    params: List[Any] = []
+    if namespace is not None:
+        conditions.append("namespace = ?")
+        params.append(namespace)
+    if expired_only:
+        conditions.append("expires_at <= ?")
+        params.append(time.time())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    def op(cur: sqlite3.Cursor) -> None:
+        cur.execute(f"DELETE FROM result_cache {where}", params)
+
+    return _write(op)
+
+
+@_timed
+def session_put(token: str, session: Dict[str, Any], expires_at: float) -> Future:
+    def op(cur: sqlite3.Cursor) -> None:
+        cur.execute(
+            """
+            INSERT OR REPLACE INTO paraphrase_sessions
+                (token, user_id, original, paraphrased, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                token,
+                session["user_id"],
+                session["original"],
+                session["paraphrased"],
+                expires_at,
+            ),
+        )
+
+    return _write(op)
+
+
+@_timed
+def session_get(token: str) -> Optional[Dict[str, Any]]:
+    def op(cur: sqlite3.Cursor) -> Optional[Dict[str, Any]]:
+        cur.execute(
+            """
+            SELECT user_id, original, paraphrased
+            FROM paraphrase_sessions
+            WHERE token = ? AND expires_at > ?
+            """,
+            (token, time.time()),
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    return _read(op)
+
+
+@_timed
+def session_pop(token: str) -> Future:
+    """
+    Забрать сессию и удалить её одной операцией записи:
+    из двух одновременных нажатий кнопки сессию получит только одно.
+    Future вернёт сессию или None.
+    """
+    def op(cur: sqlite3.Cursor) -> Optional[Dict[str, Any]]:
+        cur.execute(
+            """
+            SELECT user_id, original, paraphrased
+            FROM paraphrase_sessions
+            WHERE token = ? AND expires_at > ?
+            """,
+            (token, time.time()),
+        )
+        row = cur.fetchone()
+        cur.execute("DELETE FROM paraphrase_sessions WHERE token = ?", (token,))
+        return dict(row) if row else None
+
+    return _write(op)
+
+
+def session_count() -> int:
+    """Число непросроченных сессий перефразирования."""
+    def op(cur: sqlite3.Cursor) -> int:
+        cur.execute(
+            "SELECT COUNT(*) FROM paraphrase_sessions WHERE expires_at > ?",
+            (time.time(),),
+        )
+        return cur.fetchone()[0]
+
+    return _read(op)
+
+
+def session_purge_expired() -> Future:
+    def op(cur: sqlite3.Cursor) -> int:
+        cur.execute(
+            "DELETE FROM paraphrase_sessions WHERE expires_at <= ?", (time.time(),)
+        )
+        return cur.rowcount
+
+    return _write(op)
+
+
+# --- Очистка старых сообщений (retention) ---
+
+
+# Функции ниже работают с одним шардом (по умолчанию нулевым);
+# retention обходит шарды сам, см. shard_count().
+
+
+def db_size(shard: int = 0) -> Dict[str, int]:
+    """
+    Размер файла шарда по данным SQLite: всего страниц, свободных страниц
+    и байт. WAL-файл не учитывается.
+    """
+
+    def op(cur: sqlite3.Cursor) -> Dict[str, int]:
+        page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+        page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+        freelist = cur.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = cur.execute("PRAGMA auto_vacuum").fetchone()[0]
+        return {
+            "bytes": page_size * page_count,
+            "page_count": page_count,
+            "freelist_pages": freelist,
+            "auto_vacuum": auto_vacuum,
+        }
+
+    return _read(op, shard=shard)
+
+
+def users_with_messages_over(keep: int, shard: int = 0) -> List[int]:
+    """
+    Пользователи шарда, у которых в истории больше keep сообщений.
+    """
+
+    def op(cur: sqlite3.Cursor) -> List[int]:
+        cur.execute(
+            """
+            SELECT user_id FROM messages
+            GROUP BY user_id
+            HAVING COUNT(*) > ?
+            """,
+            (keep,),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+    return _read(op, shard=shard)
+
+
+def select_old_messages(user_id: int, keep: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    До limit самых старых сообщений пользователя за пределами последних keep.
+    """
+
+    def op(cur: sqlite3.Cursor) -> List[Dict[str, Any]]:
+        cur.execute(
+            """
+            SELECT id, user_id, role, content, created_at
+            FROM messages
+            WHERE user_id = ? AND id < (
+                SELECT id FROM messages
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT 1 OFFSET ?
+            )
+            ORDER BY id
+            LIMIT ?
+            """,
+            (user_id, user_id, keep - 1, limit),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+    return _read(op, user_id)
+
+
+def select_expired_messages(before: str, limit: int, shard: int = 0) -> List[Dict[str, Any]]:
+    """
+    До limit самых старых сообщений, созданных раньше before.
+
+    id растёт вместе с created_at, поэтому идём по первичному ключу
+    и останавливаемся на первом «свежем» сообщении, не сканируя таблицу.
+    """
+
+    def op(cur: sqlite3.Cursor) -> List[Dict[str, Any]]:
+        cur.execute(
+            """
+            SELECT id, user_id, role, content, created_at
+            FROM messages
+            ORDER BY id
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        rows = []
+        for row in cur.fetchall():
+            if row["created_at"] >= before:
+                break
+            rows.append(dict(row))
+        return rows
+
+    return _read(op, shard=shard)
+
+
+def delete_messages(ids: List[int], shard: int = 0) -> int:
+    """
+    Удалить сообщения шарда по id одной короткой транзакцией.
+    Возвращает число удалённых строк.
+    """
+    if not ids:
+        return 0
+    placeholders = ",".join("?" * len(ids))
+
+    def op(cur: sqlite3.Cursor) -> int:
+        cur.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", ids)
+        return cur.rowcount
+
+    return _write(op, shard=shard).result()
+
+
+def incremental_vacuum(pages: int, shard: int = 0) -> int:
+    """
+    Вернуть файловой системе до pages свободных страниц
+    (только при auto_vacuum=INCREMENTAL). Возвращает, сколько осталось.
+    """
+
+    def op(cur: sqlite3.Cursor) -> int:
+        cur.execute(f"PRAGMA incremental_vacuum({int(pages):d})").fetchall()
+        return cur.execute("PRAGMA freelist_count").fetchone()[0]
+
+    return _write(op, shard=shard).result()
+
+
+def enable_incremental_vacuum() -> None:
+    """
+    Перевести существующую БД в auto_vacuum=INCREMENTAL. Требует полного
+    VACUUM (перезапись всего файла), поэтому выполняется вручную,
+    при остановленном боте и без write-behind.
+    """
+    if _write_behind_active():
+        raise RuntimeError("enable_incremental_vacuum() requires write-behind to be stopped")
+    for shard in _get_shards():
+        conn = shard.get_conn()
+        with shard.lock:
+            conn.commit()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+    logger.info("STORAGE_AUTO_VACUUM_ENABLED mode=incremental shards=%d", shard_count())
+
+
+def _cache_stats() -> Dict[str, Dict[str, int]]:
+    return {
+        name: {"hits": cache.hits, "misses": cache.misses, "size": len(cache)}
+        for name, cache in (
+            ("users", _user_cache),
+            ("summaries", _summary_cache),
+            ("dialog_context", _context_buffer),
+        )
+    }
+
+
+metrics.StatsGauges(
+    "bot_storage_cache",
+    "Кэши storage в памяти: попадания, промахи, размер",
+    _cache_stats,
+    label="cache",
+)
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+# Максимальная длина одного сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Что показываем, пока модель ещё не прислала ни одного токена
+PLACEHOLDER_TEXT = "…"
+
+# Маркер «ответ ещё печатается» в промежуточных правках
+_CURSOR = " ▌"
+
+
+@dataclass
+class StreamResult:
+    text: str
+    # Через сколько секунд после начала пользователь увидел первый токен
+    first_token_latency: Optional[float]
+    total_latency: float
+    edits: int
+
+
+def _split_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    return [text[i:i + limit] for i in range(0, len(text), limit)] or [""]
+
+
+async def _safe_edit(message: Message, text: str) -> Optional[float]:
+    """
+    Редактируем сообщение, не падая на типичных ошибках Telegram.
+    Возвращаем паузу (в секундах), которую попросил Telegram, если упёрлись в лимит.
+    """
+    try:
+        await message.edit_text(text)
+    except RetryAfter as e:
+        retry_after = e.retry_after
+        if hasattr(retry_after, "total_seconds"):
+            retry_after = retry_after.total_seconds()
+        return float(retry_after)
+    except BadRequest as e:
+        # Текст не изменился с прошлой правки — это не ошибка
+        if "not modified" not in str(e).lower():
+            raise
+    return None
+
+
+async def stream_into_message(
+    placeholder: Message,
+    chunks: AsyncIterator[str],
+    min_edit_interval: float = 1.0,
+    started: Optional[float] = None,
+) -> StreamResult:
+    """
+    Читаем ответ модели по кусочкам и прогрессивно редактируем
+    заранее отправленное сообщение-заглушку.
+
+    Первая правка делается сразу, как только пришёл первый токен
+    (это и есть время до первого видимого текста). Дальше правим
+    не чаще, чем раз в min_edit_interval секунд, чтобы не упираться
+    в лимиты Telegram на редактирование.
+
+    started — момент (time.monotonic()) получения запроса пользователя,
+    от него считаются задержки в результате.
+    """
+    if started is None:
+        started = time.monotonic()
+    first_token_at: Optional[float] = None
+    next_edit_at = time.monotonic()
+    # До какого момента Telegram просил не редактировать (RetryAfter)
+    blocked_until = next_edit_at
+    edits = 0
+    text = ""
+    shown = PLACEHOLDER_TEXT
+
+    async for delta in chunks:
+        if not delta:
+            continue
+        text += delta
+        now = time.monotonic()
+        if first_token_at is None:
+            if not text.strip():
+                continue
+            first_token_at = now
+        elif now < next_edit_at:
+            continue
+        if now < blocked_until:
+            continue
+
+        preview = text[: TELEGRAM_MESSAGE_LIMIT - len(_CURSOR)] + _CURSOR
+        if preview == shown:
+            continue
+        retry_after = await _safe_edit(placeholder, preview)
+        if retry_after is not None:
+            blocked_until = time.monotonic() + retry_after
+            continue
+        shown = preview
+        edits += 1
+        next_edit_at = time.monotonic() + min_edit_interval
+
+    text = text.strip()
+    if text:
+        # Финальная правка обязательна: ждём, если Telegram попросил паузу
+        parts = _split_text(text)
+        delay = blocked_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        retry_after = await _safe_edit(placeholder, parts[0])
+        if retry_after is not None:
+            await asyncio.sleep(retry_after)
+            await _safe_edit(placeholder, parts[0])
+        edits += 1
+        # Если ответ длиннее лимита Telegram — досылаем остаток отдельными сообщениями
+        for part in parts[1:]:
+            await placeholder.reply_text(part)
+
+    return StreamResult(
+        text=text,
+        first_token_latency=(
+            first_token_at - started if first_token_at is not None else None
+        ),
+        total_latency=time.monotonic() - started,
+        edits=edits,
+    )
@@ -0,0 +1,98 @@
+"""
+Учёт токенов по ответам Chat Completions.
+
+Из блока usage каждого ответа берём prompt_tokens, completion_tokens
+и prompt_tokens_details.cached_tokens — часть промпта, которую провайдер
+взял из кэша префиксов (дешевле и быстрее). Кэш срабатывает, только если
+начало промпта байт в байт совпадает с недавним запросом, поэтому доля
+cached_tokens показывает, насколько стабилен префикс (см.
+ai_client.build_chat_input и context_window.build_window).
+
+Суммы с момента запуска — в bot_usage_*{model=...}, каждый вызов
+(если не выключен USAGE_LOG) — строкой в token_usage через очередь
+записи storage (в write-behind — пачками); агрегаты по пользователям
+и моделям: storage.usage_totals() или python -m bot.tools.usage.
+"""
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from bot.config import SETTINGS
+from bot.services import metrics, storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _ModelUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+
+_totals: Dict[str, _ModelUsage] = {}
+_lock = threading.Lock()
+
+
+def parse(usage: Any) -> Optional[Tuple[int, int, int]]:
+    """
+    (prompt, completion, cached) из usage ответа или None, если его нет
+    (совместимые API и заглушки могут не присылать usage или детали).
+    """
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return (
+        usage.prompt_tokens or 0,
+        usage.completion_tokens or 0,
+        cached or 0,
+    )
+
+
+def record(op: str, model: str, usage: Any, user_id: Optional[int] = None) -> None:
+    tokens = parse(usage)
+    if tokens is None:
+        return
+    prompt, completion, cached = tokens
+    with _lock:
+        total = _totals.setdefault(model, _ModelUsage())
+        total.calls += 1
+        total.prompt_tokens += prompt
+        total.completion_tokens += completion
+        total.cached_tokens += cached
+    logger.debug(
+        "TOKEN_USAGE op=%s model=%s user_id=%s prompt=%d completion=%d cached=%d",
+        op,
+        model,
+        user_id,
+        prompt,
+        completion,
+        cached,
+    )
+    if SETTINGS.usage_log and user_id is not None:
+        try:
+            storage.record_usage(user_id, model, op, prompt, completion, cached)
+        except Exception as e:
+            # Учёт не должен ломать ответ пользователю
+            metrics.errors_total.inc(stage="usage")
+            logger.warning("TOKEN_USAGE_WRITE_FAILED user_id=%s error=%r", user_id, e)
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    with _lock:
+        stats = {model: asdict(total) for model, total in _totals.items()}
+    for total in stats.values():
+        prompt = total["prompt_tokens"]
+        total["cached_ratio"] = total["cached_tokens"] / prompt if prompt else 0.0
+    return stats
+
+
+metrics.StatsGauges(
+    "bot_usage",
+    "Токены Chat Completions по моделям: prompt, completion, cached (из кэша префиксов)",
+    get_stats,
+    label="model",
+)
@@ -0,0 +1,42 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+
+class KeyedLock:
+    """
+    Набор asyncio-замков по ключу (user_id).
+
+    Апдейты одного пользователя обрабатываются строго по очереди, разных
+    пользователей — параллельно. Замок существует, только пока его кто-то
+    держит или ждёт: после последнего выхода запись удаляется, поэтому
+    словарь не растёт с числом пользователей.
+    """
+
+    def __init__(self) -> None:
+        # key -> [замок, сколько корутин держат или ждут его]
+        self._locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+user_locks = KeyedLock()
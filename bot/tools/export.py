@@ -0,0 +1,230 @@
+"""
+Выгрузка users, messages и token_usage для аналитики в JSONL или CSV.
+
+Строки читаются курсором пачками (fetchmany) и сразу пишутся в файл,
+поэтому память не зависит от размера таблицы. Каждый шард открывается
+отдельным соединением только на чтение: в WAL-режиме читатель видит
+снимок на начало выгрузки и не блокирует запись бота (но пока выгрузка
+идёт, WAL не может быть полностью зачекпоинчен и растёт).
+
+Запуск из корня проекта:
+
+    python -m bot.tools.export messages --output messages.jsonl.gz --since 2024-01-01
+    python -m bot.tools.export users --format csv --output - > users.csv
+    python -m bot.tools.export messages --user-id 42 --role user --output user42.csv.gz
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, IO, Iterator, List, Optional, Sequence, Tuple
+
+from bot.config import SETTINGS
+from bot.services import storage
+
+logger = logging.getLogger(__name__)
+
+# Колонка времени для --since/--until и ключ порядка выгрузки
+_TABLES = {
+    "users": ("registered_at", "user_id"),
+    "messages": ("created_at", "id"),
+    "token_usage": ("created_at", "id"),
+}
+FORMATS = ("jsonl", "csv")
+
+
+def _connect_readonly(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def build_query(
+    table: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    user_ids: Sequence[int] = (),
+    role: Optional[str] = None,
+) -> Tuple[str, List[Any]]:
+    """
+    SELECT с фильтрами: since включительно, until — нет
+    (ISO-строки, как в created_at / registered_at).
+    """
+    if table not in _TABLES:
+        raise ValueError(f"unknown table: {table}")
+    time_column, order_column = _TABLES[table]
+    conditions = []
+    params: List[Any] = []
+    if since:
+        conditions.append(f"{time_column} >= ?")
+        params.append(since)
+    if until:
+        conditions.append(f"{time_column} < ?")
+        params.append(until)
+    if user_ids:
+        conditions.append(f"user_id IN ({','.join('?' * len(user_ids))})")
+        params.extend(user_ids)
+    if role:
+        if table != "messages":
+            raise ValueError("--role applies only to messages")
+        conditions.append("role = ?")
+        params.append(role)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT * FROM {table} {where} ORDER BY {order_column}", params
+
+
+def iter_rows(
+    table: str,
+    db_path: Optional[str] = None,
+    shards: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    user_ids: Sequence[int] = (),
+    role: Optional[str] = None,
+    batch_size: int = 1000,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Строки таблицы по всем шардам (внутри шарда — по порядку ключа).
+    При фильтре по пользователям открываются только их шарды.
+    """
+    db_path = db_path or SETTINGS.db_path
+    shards = max(1, shards or SETTINGS.db_shards)
+    query, params = build_query(table, since, until, user_ids, role)
+    indexes = range(shards)
+    if user_ids:
+        indexes = sorted({user_id % shards for user_id in user_ids})
+
+    for index in indexes:
+        conn = _connect_readonly(storage.shard_path(index, db_path, shards))
+        try:
+            cur = conn.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+
+
+@contextmanager
+def _open_output(path: str, compress: bool) -> Iterator[IO[str]]:
+    if path == "-":
+        if compress:
+            with gzip.open(sys.stdout.buffer, "wt", encoding="utf-8", newline="") as f:
+                yield f
+        else:
+            yield sys.stdout
+        return
+    if compress:
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+            yield f
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            yield f
+
+
+def write_rows(rows: Iterator[Dict[str, Any]], out: IO[str], fmt: str) -> int:
+    """
+    Записать строки в JSONL или CSV (заголовок — по первой строке).
+    Возвращает число записанных строк.
+    """
+    count = 0
+    if fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(out, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def export(
+    table: str,
+    output: str,
+    fmt: str = "jsonl",
+    compress: Optional[bool] = None,
+    **filters: Any,
+) -> int:
+    """
+    Выгрузить таблицу в файл (или "-" — stdout). compress=None —
+    сжимать, если имя файла оканчивается на .gz.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    if compress is None:
+        compress = output.endswith(".gz")
+    with _open_output(output, compress) as out:
+        return write_rows(iter_rows(table, **filters), out, fmt)
+
+
+def _guess_format(output: str) -> str:
+    name = output[:-3] if output.endswith(".gz") else output
+    return "csv" if name.endswith(".csv") else "jsonl"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("table", choices=sorted(_TABLES))
+    parser.add_argument("--output", default="-", help="файл или - (stdout)")
+    parser.add_argument("--format", choices=FORMATS, help="по умолчанию — по расширению")
+    parser.add_argument("--gzip", action="store_true", help="сжать (для .gz включается сам)")
+    parser.add_argument("--db", default=SETTINGS.db_path)
+    parser.add_argument("--shards", type=int, default=SETTINGS.db_shards)
+    parser.add_argument("--since", help="ISO-дата/время, включительно")
+    parser.add_argument("--until", help="ISO-дата/время, не включительно")
+    parser.add_argument("--user-id", type=int, action="append", default=[])
+    parser.add_argument("--role", choices=("user", "assistant"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        stream=sys.stderr,
+    )
+    started = time.monotonic()
+    try:
+        rows = export(
+            args.table,
+            args.output,
+            fmt=args.format or _guess_format(args.output),
+            compress=args.gzip or None,
+            db_path=args.db,
+            shards=args.shards,
+            since=args.since,
+            until=args.until,
+            user_ids=args.user_id,
+            role=args.role,
+            batch_size=args.batch_size,
+        )
+    except (ValueError, OSError, sqlite3.Error) as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(1)
+    logger.info(
+        "EXPORT_DONE table=%s rows=%d seconds=%.1f output=%s",
+        args.table,
+        rows,
+        time.monotonic() - started,
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Перенос однофайловой БД в шардированную раскладку (DB_SHARDS > 1).
+
+users, messages, dialog_summaries и token_usage раскладываются по шардам по
+user_id % shards, result_cache и paraphrase_sessions целиком уходят
+в нулевой шард. Исходный файл не меняется: шарды создаются рядом
+с --target (bot-sharded.db, bot-sharded.1.db, ...), после проверки
+бота перезапускают с DB_PATH=--target и DB_SHARDS=--shards.
+
+Бот на время переноса нужно остановить. Запуск из корня проекта:
+
+    python -m bot.tools.reshard --source bot.db --target bot-sharded.db --shards 4
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict
+
+from bot.config import SETTINGS
+from bot.services import storage
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, которые делятся по user_id, и таблицы нулевого шарда
+_USER_TABLES = ("users", "messages", "dialog_summaries", "token_usage")
+_GLOBAL_TABLES = ("result_cache", "paraphrase_sessions")
+
+
+def _count(conn: sqlite3.Connection, schema: str, table: str) -> int:
+    return conn.execute(f"SELECT COUNT(*) FROM {schema}.{table}").fetchone()[0]
+
+
+def reshard(source: str, target: str, shards: int) -> Dict[str, int]:
+    """
+    Скопировать source в shards файлов с базовым путём target.
+    Возвращает число перенесённых строк по таблицам.
+    """
+    if shards < 2:
+        raise ValueError("shards must be at least 2")
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    paths = [storage.shard_path(i, target, shards) for i in range(shards)]
+    existing = [path for path in paths if os.path.exists(path)]
+    if existing:
+        raise FileExistsError(f"target shard already exists: {existing[0]}")
+
+    check = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    try:
+        version = check.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        check.close()
+    if version != storage.SCHEMA_VERSION:
+        raise RuntimeError(
+            f"source schema version {version}, expected {storage.SCHEMA_VERSION}: "
+            "start the bot on it once to apply migrations"
+        )
+
+    # Шарды создаём через storage: та же схема, WAL и auto_vacuum
+    storage.close_db()
+    SETTINGS.db_path = target
+    SETTINGS.db_shards = shards
+    SETTINGS.db_write_behind = False
+    storage.init_db()
+
+    copied = {table: 0 for table in _USER_TABLES + _GLOBAL_TABLES}
+    try:
+        for index in range(shards):
+            shard = storage._get_shard(shard=index)
+            conn = shard.get_conn()
+            with shard.lock:
+                conn.execute("ATTACH DATABASE ? AS src", (source,))
+                try:
+                    for table in _USER_TABLES:
+                        # В SQLite остаток от отрицательного числа отрицательный
+                        cur = conn.execute(
+                            f"""
+                            INSERT INTO main.{table}
+                            SELECT * FROM src.{table}
+                            WHERE ((user_id % ?) + ?) % ? = ?
+                            """,
+                            (shards, shards, shards, index),
+                        )
+                        copied[table] += cur.rowcount
+                    if index == 0:
+                        for table in _GLOBAL_TABLES:
+                            cur = conn.execute(
+                                f"INSERT INTO main.{table} SELECT * FROM src.{table}"
+                            )
+                            copied[table] += cur.rowcount
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("DETACH DATABASE src")
+            logger.info("RESHARD_SHARD index=%d path=%s", index, shard.path)
+
+        # Сверяем, что ни одна строка не потерялась и не задвоилась
+        conn = storage._get_conn()
+        with storage._get_shard().lock:
+            conn.execute("ATTACH DATABASE ? AS src", (source,))
+            try:
+                expected = {table: _count(conn, "src", table) for table in copied}
+            finally:
+                conn.execute("DETACH DATABASE src")
+        mismatched = {
+            table: (copied[table], expected[table])
+            for table in copied
+            if copied[table] != expected[table]
+        }
+        if mismatched:
+            raise RuntimeError(f"row count mismatch (copied, source): {mismatched}")
+    finally:
+        storage.close_db()
+    return copied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--source", default=SETTINGS.db_path)
+    parser.add_argument("--target", required=True, help="путь нулевого шарда")
+    parser.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    started = time.monotonic()
+    try:
+        copied = reshard(args.source, args.target, args.shards)
+    except (ValueError, OSError, RuntimeError) as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(1)
+    logger.info(
+        "RESHARD_DONE shards=%d seconds=%.1f %s",
+        args.shards,
+        time.monotonic() - started,
+        " ".join(f"{table}={rows}" for table, rows in copied.items()),
+    )
+    print(f"DB_PATH={args.target} DB_SHARDS={args.shards}")
+
+
+if __name__ == "__main__":
+    main()
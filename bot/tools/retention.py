@@ -0,0 +1,59 @@
+"""
+Разовая очистка старых сообщений — тот же проход, что фоновая задача
+bot.services.retention, с параметрами из командной строки (по умолчанию
+из RETENTION_*).
+
+Запуск из корня проекта:
+
+    python -m bot.tools.retention --keep 200 --archive-dir ./archive
+    python -m bot.tools.retention --days 90
+    python -m bot.tools.retention --enable-incremental-vacuum   # при остановленном боте
+"""
+import argparse
+import asyncio
+import logging
+
+from bot.config import SETTINGS
+from bot.services import retention, storage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--keep", type=int, default=SETTINGS.retention_keep_messages)
+    parser.add_argument("--days", type=float, default=SETTINGS.retention_days)
+    parser.add_argument("--batch-size", type=int, default=SETTINGS.retention_batch_size)
+    parser.add_argument("--archive-dir", default=SETTINGS.retention_archive_dir)
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="перевести существующую БД в auto_vacuum=INCREMENTAL (полный VACUUM)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    SETTINGS.db_write_behind = False
+    storage.init_db()
+    try:
+        if args.enable_incremental_vacuum:
+            storage.enable_incremental_vacuum()
+        if args.keep or args.days:
+            asyncio.run(
+                retention.run_once(
+                    keep=args.keep,
+                    days=args.days,
+                    batch_size=args.batch_size,
+                    pause=0,
+                    archive_dir=args.archive_dir,
+                )
+            )
+    finally:
+        storage.close_db()
+
+
+if __name__ == "__main__":
+    main()
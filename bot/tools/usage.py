@@ -0,0 +1,73 @@
+"""
+Сводка по token_usage: вызовы, токены промпта и ответа и доля промпта,
+взятая провайдером из кэша префиксов (cached), — по моделям,
+пользователям или операциям.
+
+Запуск из корня проекта:
+
+    python -m bot.tools.usage                       # по моделям за всё время
+    python -m bot.tools.usage --by user_id --since 2025-01-01 --limit 20
+    python -m bot.tools.usage --by op --user-id 42
+"""
+import argparse
+import sqlite3
+import sys
+from typing import Any, Dict, List
+
+from bot.config import SETTINGS
+from bot.services import storage
+
+_COLUMNS = ("calls", "prompt_tokens", "cached_tokens", "completion_tokens")
+
+
+def format_table(rows: List[Dict[str, Any]], group_by: str) -> str:
+    header = (group_by, *_COLUMNS, "cached_%")
+    lines = [header]
+    for row in rows:
+        lines.append(
+            (
+                str(row[group_by]),
+                *(str(row[column]) for column in _COLUMNS),
+                f"{100 * row['cached_ratio']:.1f}",
+            )
+        )
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(line, widths))
+        )
+        for line in lines
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--by", choices=("model", "user_id", "op"), default="model")
+    parser.add_argument("--since", help="ISO-дата/время, включительно")
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--limit", type=int, default=0, help="первые N строк (0 — все)")
+    parser.add_argument("--db", default=SETTINGS.db_path)
+    parser.add_argument("--shards", type=int, default=SETTINGS.db_shards)
+    args = parser.parse_args()
+
+    SETTINGS.db_path = args.db
+    SETTINGS.db_shards = args.shards
+    SETTINGS.db_write_behind = False
+    try:
+        storage.init_db()
+        rows = storage.usage_totals(args.by, since=args.since, user_id=args.user_id)
+    except (ValueError, OSError, sqlite3.Error) as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(1)
+    finally:
+        storage.close_db()
+    if args.limit > 0:
+        rows = rows[: args.limit]
+    print(format_table(rows, args.by))
+
+
+if __name__ == "__main__":
+    main()
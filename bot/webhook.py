@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+from queue import Empty
+from typing import Awaitable, Callable, List, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from bot.config import SETTINGS
+from bot.http_server import HttpServer, Request, Response
+from bot.services import storage
+
+logger = logging.getLogger(__name__)
+
+# Куда отдать апдейт: (разобранный JSON, исходное тело запроса)
+Sink = Callable[[dict, bytes], Awaitable[None]]
+
+_SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+# Номер текущего процесса-воркера (None — бот работает в одном процессе)
+_worker_index: Optional[int] = None
+
+
+def is_primary_worker() -> bool:
+    """
+    Фоновые задачи над общей БД (например, очистку) выполняет только
+    один процесс: единственный или воркер №0.
+    """
+    return not _worker_index
+
+
+def extract_user_id(data: dict) -> Optional[int]:
+    """
+    Достаём id пользователя из апдейта любого типа: message, callback_query,
+    inline_query и т.д. — у всех есть поле from (или user/chat).
+    """
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        for key in ("from", "user", "chat"):
+            entity = value.get(key)
+            if isinstance(entity, dict) and "id" in entity:
+                return int(entity["id"])
+    return None
+
+
+def worker_for(user_id: Optional[int], workers: int) -> int:
+    """
+    Все апдейты одного пользователя всегда уходят одному воркеру:
+    порядок сообщений и кэши в памяти воркера остаются согласованными.
+    """
+    if user_id is None or workers <= 1:
+        return 0
+    return user_id % workers
+
+
+class WebhookDispatcher:
+    """
+    Принимает POST от Telegram (или записанный JSON апдейта при локальной
+    проверке) и передаёт апдейт воркеру, выбранному по user_id.
+    """
+
+    def __init__(self, sinks: List[Sink], secret: Optional[str] = None) -> None:
+        self.sinks = sinks
+        self.secret = secret
+
+    async def handle(self, request: Request) -> Response:
+        if self.secret and request.headers.get(_SECRET_HEADER) != self.secret:
+            return Response(status=401)
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(status=400)
+        if not isinstance(data, dict):
+            return Response(status=400)
+
+        index = worker_for(extract_user_id(data), len(self.sinks))
+        await self.sinks[index](data, request.body)
+        return Response(status=200)
+
+
+def _make_server(sinks: List[Sink]) -> HttpServer:
+    server = HttpServer(SETTINGS.webhook_listen, SETTINGS.webhook_port)
+    dispatcher = WebhookDispatcher(sinks, secret=SETTINGS.webhook_secret)
+    server.route("POST", SETTINGS.webhook_path, dispatcher.handle)
+    return server
+
+
+async def _register_webhook(bot: Bot) -> None:
+    # Без WEBHOOK_URL сервер просто слушает порт — удобно для локальной
+    # проверки: апдейты можно слать curl-ом из записанных JSON.
+    if not SETTINGS.webhook_url:
+        logger.info("WEBHOOK_NOT_REGISTERED (WEBHOOK_URL is empty)")
+        return
+    await bot.set_webhook(
+        url=SETTINGS.webhook_url,
+        secret_token=SETTINGS.webhook_secret,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    logger.info("WEBHOOK_REGISTERED url=%s", SETTINGS.webhook_url)
+
+
+async def _wait_for_stop() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
+
+
+async def _start_application(application: Application) -> None:
+    # post_init тоже вызывается только в run_polling/run_webhook
+    if application.post_init is not None:
+        await application.post_init(application)
+    await application.start()
+
+
+async def _shutdown_application(application: Application) -> None:
+    await application.stop()
+    # post_shutdown вызывается только в run_polling/run_webhook — зовём сами
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)
+
+
+async def _run_single(build_application: Callable[[], Application]) -> None:
+    storage.init_db()
+    application = build_application()
+    async with application:
+        await _start_application(application)
+
+        async def sink(data: dict, raw: bytes) -> None:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+        server = _make_server([sink])
+        await server.start()
+        await _register_webhook(application.bot)
+        logger.info("Bot is running in webhook mode. Waiting for updates...")
+
+        await _wait_for_stop()
+        await server.stop()
+        await _shutdown_application(application)
+
+
+def _worker_main(
+    build_application: Callable[[], Application],
+    setup_logging: Callable[[], None],
+    index: int,
+    queue: "multiprocessing.Queue",
+) -> None:
+    # Ctrl+C и SIGTERM (systemctl/docker stop) получает вся группа процессов;
+    # воркеры останавливает диспетчер через None в очереди, чтобы они успели
+    # закрыть Application и дописать очередь write-behind
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    setup_logging()
+    asyncio.run(_run_worker(build_application, index, queue))
+
+
+# Как часто воркер, ждущий апдейт, проверяет, жив ли диспетчер, сек
+_PARENT_CHECK_INTERVAL = 1.0
+
+
+def _next_update(queue: "multiprocessing.Queue") -> Optional[bytes]:
+    """
+    Следующий апдейт из очереди; None — пора останавливаться (диспетчер
+    прислал None или умер, не успев: SIGTERM воркер теперь игнорирует).
+    """
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return queue.get(timeout=_PARENT_CHECK_INTERVAL)
+        except Empty:
+            if parent is not None and not parent.is_alive():
+                logger.warning("WEBHOOK_DISPATCHER_GONE")
+                return None
+
+
+async def _run_worker(
+    build_application: Callable[[], Application],
+    index: int,
+    queue: "multiprocessing.Queue",
+) -> None:
+    global _worker_index
+    _worker_index = index
+    storage.init_db()
+    # У каждого воркера свой /metrics: порт METRICS_PORT + номер воркера
+    if SETTINGS.metrics_port:
+        SETTINGS.metrics_port += index
+    application = build_application()
+    loop = asyncio.get_running_loop()
+    async with application:
+        await _start_application(application)
+        logger.info("WEBHOOK_WORKER_STARTED index=%d", index)
+        while True:
+            raw = await loop.run_in_executor(None, _next_update, queue)
+            if raw is None:
+                break
+            update = Update.de_json(json.loads(raw), application.bot)
+            await application.update_queue.put(update)
+        await _shutdown_application(application)
+    logger.info("WEBHOOK_WORKER_STOPPED index=%d", index)
+
+
+async def _run_dispatcher(queues: List["multiprocessing.Queue"]) -> None:
+    def make_sink(queue: "multiprocessing.Queue") -> Sink:
+        async def sink(data: dict, raw: bytes) -> None:
+            queue.put(raw)
+
+        return sink
+
+    server = _make_server([make_sink(q) for q in queues])
+    await server.start()
+    async with Bot(SETTINGS.telegram_token) as bot:
+        await _register_webhook(bot)
+    logger.info(
+        "Bot is running in webhook mode with %d workers. Waiting for updates...",
+        len(queues),
+    )
+    await _wait_for_stop()
+    await server.stop()
+
+
+def run(
+    build_application: Callable[[], Application],
+    setup_logging: Callable[[], None],
+) -> None:
+    """
+    Запуск в режиме вебхука.
+
+    WEBHOOK_WORKERS=1 — всё в одном процессе. При N > 1 текущий процесс
+    только принимает HTTP-запросы и раскладывает апдейты по N процессам-
+    воркерам по user_id; каждый воркер — отдельное Application со своими
+    кэшами и соединениями к БД.
+    """
+    workers = max(1, SETTINGS.webhook_workers)
+    if workers == 1:
+        asyncio.run(_run_single(build_application))
+        return
+
+    # Миграции применяем один раз до старта воркеров
+    storage.init_db()
+    storage.close_db()
+
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(
+            target=_worker_main,
+            args=(build_application, setup_logging, i, queue),
+            name=f"bot-worker-{i}",
+        )
+        for i, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(_run_dispatcher(queues))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
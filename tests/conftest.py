@@ -0,0 +1,13 @@
+import pytest
+
+from bot.config import SETTINGS
+from bot.services import storage
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(SETTINGS, "db_path", str(tmp_path / "test.db"))
+    storage.close_db()
+    storage.init_db()
+    yield
+    storage.close_db()
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from bot.services.admission import AdmissionController, AdmissionRejected
+
+
+def test_slots_are_shared_fairly_between_users():
+    controller = AdmissionController(max_concurrent=1, max_queue=10)
+    order = []
+
+    async def call(user_id, tag):
+        async with controller.acquire(user_id):
+            order.append(tag)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        async with controller.acquire(0):
+            # «Болтливый» пользователь 1 встал в очередь раньше пользователя 2
+            tasks = [asyncio.create_task(call(1, f"a{i}")) for i in range(3)]
+            tasks.append(asyncio.create_task(call(2, "b0")))
+            await asyncio.sleep(0)
+            assert controller.queue_depth == 4
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert controller.stats()["queue_depth"] == 0
+    assert controller.stats()["active"] == 0
+
+
+def test_full_queue_rejects_immediately():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+
+    async def scenario():
+        async with controller.acquire(1):
+            waiter = asyncio.create_task(controller.acquire(2).__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(AdmissionRejected) as exc:
+                async with controller.acquire(3):
+                    pass
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        return exc.value
+
+    rejected = asyncio.run(scenario())
+
+    assert rejected.reason == "queue_full"
+    assert controller.queue_depth == 0
+    assert controller.active == 0
+    assert controller.stats()["rejected_queue_full"] == 1
+
+
+def test_user_rate_limit():
+    controller = AdmissionController(
+        max_concurrent=10, max_queue=10, user_rate=1.0, user_burst=2
+    )
+
+    async def call(user_id):
+        async with controller.acquire(user_id):
+            pass
+
+    async def scenario():
+        await call(1)
+        await call(1)
+        with pytest.raises(AdmissionRejected) as exc:
+            await call(1)
+        # Лимит у каждого пользователя свой, фоновые задачи не ограничены
+        await call(2)
+        await call(None)
+        await call(None)
+        await call(None)
+        return exc.value
+
+    rejected = asyncio.run(scenario())
+
+    assert rejected.reason == "rate_limited"
+    assert 0 < rejected.retry_after <= 1.0
+    assert "сек" in rejected.user_text
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bot import config
+
+
+def test_import_does_not_require_tokens():
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("TELEGRAM_BOT_TOKEN", "OPENAI_API_KEY")
+    }
+    code = (
+        "import sys, bot.main, bot.config; "
+        "print('openai' in sys.modules, bot.config._settings is not None)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    # Пакет openai подгружается только при создании клиента, а настройки
+    # (и кэши, breaker-ы, контроллер допуска из них) — при первом обращении
+    assert result.stdout.strip() == "False False"
+
+
+def test_check_required_exits_without_tokens(monkeypatch):
+    monkeypatch.setattr(config.SETTINGS, "telegram_token", "")
+    with pytest.raises(SystemExit):
+        config.check_required()
+
+
+def test_settings_proxy_reads_and_writes_the_same_object(monkeypatch):
+    monkeypatch.setattr(config.SETTINGS, "chat_model", "test-model")
+    assert config.get_settings().chat_model == "test-model"
+
+
+def test_lazy_object_is_built_from_settings_on_first_use(monkeypatch):
+    built = []
+    lazy = config.Lazy(lambda: built.append(config.SETTINGS.chat_model) or [1, 2])
+
+    monkeypatch.setattr(config.SETTINGS, "chat_model", "later")
+    assert built == []
+    assert len(lazy) == 2
+    assert lazy.count(1) == 1
+    assert built == ["later"]
@@ -0,0 +1,119 @@
+from bot.config import SETTINGS
+from bot.services import context_window, storage
+
+
+def _dialog(n):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": "слово " * 30,
+            "created_at": f"2025-01-01T00:00:{i:02d}",
+            "id": i + 1,
+        }
+        for i in range(n)
+    ]
+
+
+def test_history_is_fitted_into_token_budget(db, monkeypatch):
+    dialog = _dialog(10)
+    per_message = context_window.count_message_tokens(dialog[0])
+    monkeypatch.setattr(SETTINGS, "context_token_budget", per_message * 3)
+
+    window = context_window.build_window(1, dialog, "вопрос")
+
+    assert window.history == dialog[-3:]
+    assert window.overflow == dialog[:-3]
+    assert window.stats.history_tokens == per_message * 3
+    assert window.stats.saved_tokens == per_message * 7
+
+
+def test_summarized_messages_are_not_resent(db, monkeypatch):
+    dialog = _dialog(10)
+    monkeypatch.setattr(SETTINGS, "context_token_budget", 10_000)
+    storage.get_or_create_user(1, "user", "User")
+    storage.save_summary(1, "Обсуждали погоду.", covered_until_id=dialog[5]["id"])
+
+    window = context_window.build_window(1, dialog, "вопрос")
+
+    assert window.summary == "Обсуждали погоду."
+    assert window.history == dialog[6:]
+    assert window.overflow == []
+
+
+def test_window_start_is_kept_between_turns(db, monkeypatch):
+    dialog = _dialog(40)
+    per_message = context_window.count_message_tokens(dialog[0])
+    monkeypatch.setattr(SETTINGS, "context_token_budget", per_message * 8)
+    monkeypatch.setattr(SETTINGS, "context_prefix_slack", 0.5)
+    monkeypatch.setattr(context_window, "_window_starts", context_window.TTLCache(10))
+
+    starts = []
+    for turn in range(10, 40, 2):
+        window = context_window.build_window(1, dialog[:turn], "вопрос")
+        assert window.stats.history_tokens <= per_message * 8
+        starts.append(window.history[0]["created_at"])
+
+    # Окно сдвигается рывками по половине бюджета и держится три хода,
+    # а не меняется на каждом из 15
+    assert len(set(starts)) == 6
+    assert starts[1] == starts[2] == starts[3] != starts[4]
+
+
+def test_window_start_is_kept_when_dialog_limit_slides(db, monkeypatch):
+    dialog = _dialog(60)
+    monkeypatch.setattr(SETTINGS, "context_token_budget", 100_000)
+    monkeypatch.setattr(SETTINGS, "context_prefix_slack", 0.5)
+    monkeypatch.setattr(context_window, "_window_starts", context_window.TTLCache(10))
+
+    starts = []
+    for turn in range(20, 60, 2):
+        # Как get_last_messages с DIALOG_CONTEXT_LIMIT=20
+        window = context_window.build_window(1, dialog[turn - 20 : turn], "вопрос")
+        starts.append(window.history[0]["created_at"])
+
+    assert len(set(starts)) < len(starts) // 2
+
+
+def test_messages_with_same_timestamp_are_not_lost(db, monkeypatch):
+    monkeypatch.setattr(SETTINGS, "context_token_budget", 10_000)
+    dialog = _dialog(4)
+    # Вопрос и ответ записаны с одинаковым created_at
+    dialog[2]["created_at"] = dialog[1]["created_at"]
+    storage.get_or_create_user(1, "user", "User")
+    storage.save_summary(1, "кратко", covered_until_id=dialog[1]["id"])
+
+    window = context_window.build_window(1, dialog, "вопрос")
+
+    assert window.history == dialog[2:]
+
+
+def test_every_fresh_message_is_in_history_or_overflow(db, monkeypatch):
+    dialog = _dialog(40)
+    per_message = context_window.count_message_tokens(dialog[0])
+    monkeypatch.setattr(SETTINGS, "context_token_budget", per_message * 8)
+    monkeypatch.setattr(SETTINGS, "context_prefix_slack", 0.5)
+    monkeypatch.setattr(context_window, "_window_starts", context_window.TTLCache(10))
+
+    shifted = False
+    for turn in range(10, 40):
+        window = context_window.build_window(1, dialog[:turn], "вопрос")
+        assert window.overflow + window.history == dialog[:turn]
+        shifted = shifted or len(window.history) < 8
+    # Проверка имеет смысл, только если окно сдвигалось с запасом
+    assert shifted
+
+
+def test_window_anchor_survives_same_timestamps(db, monkeypatch):
+    dialog = _dialog(12)
+    # Все сообщения записаны в одну и ту же секунду
+    for message in dialog:
+        message["created_at"] = "2025-01-01T00:00:00"
+    per_message = context_window.count_message_tokens(dialog[0])
+    monkeypatch.setattr(SETTINGS, "context_token_budget", per_message * 4)
+    monkeypatch.setattr(context_window, "_window_starts", context_window.TTLCache(10))
+
+    first = context_window.build_window(1, dialog[:8], "вопрос")
+    second = context_window.build_window(1, dialog[:8], "ещё вопрос")
+
+    # Окно держится на том же сообщении, а не на первом с тем же created_at
+    assert first.history == second.history == dialog[4:8]
@@ -0,0 +1,57 @@
+import csv
+import gzip
+import json
+
+from bot.config import SETTINGS
+from bot.services import storage
+from bot.tools import export
+
+
+def _fill():
+    for user_id in (1, 2, 3):
+        storage.get_or_create_user(user_id, f"user{user_id}", None)
+        storage.add_message(user_id, "user", f"вопрос {user_id}")
+        storage.add_message(user_id, "assistant", f"ответ {user_id}")
+
+
+def test_export_messages_jsonl_gz_with_filters(db, tmp_path):
+    _fill()
+    output = tmp_path / "messages.jsonl.gz"
+
+    rows = export.export(
+        "messages", str(output), user_ids=[2, 3], role="user", since="2000-01-01"
+    )
+
+    with gzip.open(output, "rt", encoding="utf-8") as f:
+        exported = [json.loads(line) for line in f]
+    assert rows == 2
+    assert [row["content"] for row in exported] == ["вопрос 2", "вопрос 3"]
+
+
+def test_export_users_csv_while_writer_is_active(db, tmp_path):
+    _fill()
+    storage.start_write_behind(batch_size=10, interval_ms=5)
+    storage.add_message(1, "user", "ещё")
+    output = tmp_path / "users.csv"
+
+    assert export.export("users", str(output), fmt="csv") == 3
+    with open(output, encoding="utf-8") as f:
+        exported = list(csv.DictReader(f))
+    assert [row["username"] for row in exported] == ["user1", "user2", "user3"]
+
+
+def test_iter_rows_reads_all_shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(SETTINGS, "db_path", str(tmp_path / "test.db"))
+    monkeypatch.setattr(SETTINGS, "db_shards", 2)
+    storage.close_db()
+    storage.init_db()
+    _fill()
+    storage.close_db()
+
+    rows = list(export.iter_rows("messages", batch_size=1))
+
+    assert sorted(row["content"] for row in rows if row["role"] == "user") == [
+        "вопрос 1",
+        "вопрос 2",
+        "вопрос 3",
+    ]
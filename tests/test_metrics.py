@@ -0,0 +1,51 @@
+import asyncio
+
+import httpx
+
+from bot.services import admission, metrics, result_cache, storage  # noqa: F401
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram(
+        "test_latency_seconds", "test", ("stage",), buckets=(0.1, 1.0)
+    )
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5.0, stage="a")
+
+    lines = histogram.render()
+
+    assert 'test_latency_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{stage="a",le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{stage="a"} 3' in lines
+
+
+def test_storage_calls_are_timed(db):
+    before = metrics.storage_seconds.count(op="get_or_create_user")
+
+    storage.get_or_create_user(1, "user", "User")
+
+    assert metrics.storage_seconds.count(op="get_or_create_user") == before + 1
+
+
+def test_metrics_endpoint_serves_prometheus_text():
+    metrics.errors_total.inc(stage="test")
+
+    async def fetch():
+        server = metrics.HttpServer("127.0.0.1", 0)
+        server.route("GET", "/metrics", metrics._handle_metrics)
+        await server.start()
+        try:
+            async with httpx.AsyncClient() as http:
+                return await http.get(f"http://127.0.0.1:{server.port}/metrics")
+        finally:
+            await server.stop()
+
+    response = asyncio.run(fetch())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'bot_errors_total{stage="test"}' in response.text
+    assert "bot_admission_queue_depth" in response.text
+    assert 'bot_result_cache_hits{namespace="moderation"}' in response.text
@@ -9,3 +9,27 @@ def test_moderation_clean_text():
 def test_moderation_profanity_text():
     text = "ты блядь"
     assert moderation.contains_local_profanity(text) is True
+
+
+def test_moderation_catches_simple_evasions():
+    assert moderation.contains_local_profanity("б л я, опять") is True
+    assert moderation.contains_local_profanity("ну ты и cука") is True
+    assert moderation.contains_local_profanity("бляяяя") is True
+
+
+def test_moderation_english_words_match_whole_words_only():
+    assert moderation.contains_local_profanity("what an ass") is True
+    assert moderation.contains_local_profanity("first class ticket") is False
+
+
+def test_lexicon_reload(tmp_path):
+    lexicon = tmp_path / "lexicon.txt"
+    lexicon.write_text("# тест\nкозявка\n=бяка\n", encoding="utf-8")
+    try:
+        moderation.reload_lexicon(str(lexicon))
+        assert moderation.contains_local_profanity("одни козявками") is True
+        assert moderation.contains_local_profanity("ты бяка") is True
+        assert moderation.contains_local_profanity("бякать") is False
+    finally:
+        moderation.reload_lexicon()
+    assert moderation.contains_local_profanity("ты бяка") is False
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.config import SETTINGS
+from bot.services import moderation, openai_client, result_cache
+from bot.services.result_cache import ResultCache
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+class FakeModerations:
+    def __init__(self, fail_batches=False, poisoned=None):
+        self.fail_batches = fail_batches
+        self.poisoned = poisoned
+        self.inputs = []
+
+    async def create(self, model, input):
+        self.inputs.append(input)
+        if isinstance(input, list) and self.fail_batches:
+            raise ConnectionError("batch failed")
+        if self.poisoned is not None and self.poisoned in input:
+            raise BadRequest("invalid input")
+        texts = input if isinstance(input, list) else [input]
+        return SimpleNamespace(
+            results=[
+                SimpleNamespace(flagged="плохо" in text, categories={})
+                for text in texts
+            ]
+        )
+
+
+def _setup(monkeypatch, fake):
+    monkeypatch.setattr(openai_client, "_client", SimpleNamespace(moderations=fake))
+    monkeypatch.setattr(
+        result_cache,
+        "moderation_cache",
+        ResultCache("moderation", maxsize=10, ttl=60),
+    )
+    monkeypatch.setattr(SETTINGS, "moderation_batch_size", 8)
+    monkeypatch.setattr(SETTINGS, "moderation_batch_window_ms", 50)
+
+
+async def _check_all(texts):
+    return await asyncio.gather(
+        *(moderation.check_openai_moderation(t) for t in texts)
+    )
+
+
+def test_concurrent_checks_share_one_request(monkeypatch):
+    fake = FakeModerations()
+    _setup(monkeypatch, fake)
+
+    results = asyncio.run(_check_all(["привет", "это плохо", "как дела"]))
+
+    assert fake.inputs == [["привет", "это плохо", "как дела"]]
+    assert [r.blocked for r in results] == [False, True, False]
+
+
+def test_failed_batch_falls_back_to_local_check(monkeypatch):
+    fake = FakeModerations(fail_batches=True)
+    _setup(monkeypatch, fake)
+    monkeypatch.setattr(SETTINGS, "openai_max_retries", 1)
+    monkeypatch.setattr(moderation.resilience, "backoff", lambda attempt: 0)
+    monkeypatch.setattr(
+        moderation.resilience,
+        "moderation_breaker",
+        moderation.resilience.CircuitBreaker("moderation", 100, 10),
+    )
+
+    results = asyncio.run(_check_all(["привет", "это плохо"]))
+
+    # Повтор тоже идёт пакетом, поштучных запросов нет
+    assert fake.inputs == [["привет", "это плохо"]] * 2
+    assert [r.source for r in results] == ["none", "none"]
+
+
+def test_rejected_batch_is_rechecked_one_by_one(monkeypatch):
+    fake = FakeModerations(poisoned="\x00")
+    _setup(monkeypatch, fake)
+    monkeypatch.setattr(
+        moderation.resilience,
+        "moderation_breaker",
+        moderation.resilience.CircuitBreaker("moderation", 100, 10),
+    )
+
+    results = asyncio.run(_check_all(["привет", "это плохо", "\x00"]))
+
+    assert fake.inputs[0] == ["привет", "это плохо", "\x00"]
+    assert sorted(fake.inputs[1:4]) == sorted(["привет", "это плохо", "\x00"])
+    # Только «плохой» текст остаётся без ответа OpenAI и проверяется локально
+    assert [r.source for r in results] == ["none", "openai", "none"]
+    assert [r.blocked for r in results] == [False, True, False]
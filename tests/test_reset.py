@@ -1,4 +1,4 @@
-from bot.services.state import UserState, reset_state
+from bot.services.state import DialogContextBuffer, UserState, reset_state
 
 
 def test_reset_clears_dialog_and_updates_time():
@@ -20,3 +20,35 @@ def test_reset_clears_dialog_and_updates_time():
 
     assert new_state.dialog_context == []
     assert new_state.last_reset_at != old_reset
+
+
+def test_dialog_buffer_keeps_last_messages_within_budget():
+    buffer = DialogContextBuffer(capacity=2, memory_budget=10_000)
+    buffer.load(1, [{"role": "user", "content": "раз"}])
+    buffer.append(1, {"role": "assistant", "content": "два"})
+    buffer.append(1, {"role": "user", "content": "три"})
+
+    assert [m["content"] for m in buffer.get(1, 2)] == ["два", "три"]
+
+    # Второй большой диалог не помещается в бюджет — первый вытесняется
+    buffer.load(2, [{"role": "user", "content": "x" * 5000}])
+    assert buffer.get(1, 2) is None
+    assert buffer.get(2, 2) is not None
+
+
+def test_dialog_buffer_reset_counts_towards_budget():
+    buffer = DialogContextBuffer(capacity=3, memory_budget=2_000)
+    buffer.load(1, [{"role": "user", "content": "раз"}])
+    for user_id in range(2, 100):
+        buffer.reset(user_id)
+
+    # Пустые контексты после /reset тоже вытесняются по LRU
+    assert len(buffer) < 10
+    assert buffer.get(1, 3) is None
+    assert buffer.get(99, 3) == []
+
+    buffer.reset(99)
+    for i in range(10):
+        buffer.append(99, {"role": "user", "content": str(i)})
+    assert [m["content"] for m in buffer.get(99, 3)] == ["7", "8", "9"]
+    assert buffer.memory_used <= buffer.memory_budget
@@ -0,0 +1,40 @@
+import pytest
+
+from bot.config import SETTINGS
+from bot.services import storage
+from bot.tools import reshard
+
+
+def test_reshard_splits_users_and_keeps_global_tables(db, tmp_path, monkeypatch):
+    for user_id in range(1, 11):
+        storage.get_or_create_user(user_id, None, None)
+        for i in range(3):
+            storage.add_message(user_id, "user", f"{user_id}:{i}")
+    storage.save_summary(4, "кратко", covered_until_id=1)
+    storage.cache_set("moderation", "key", "{}", expires_at=2e9)
+    source = SETTINGS.db_path
+    storage.close_db()
+
+    monkeypatch.setattr(SETTINGS, "db_shards", 1)
+    monkeypatch.setattr(SETTINGS, "db_write_behind", False)
+    target = str(tmp_path / "sharded.db")
+    copied = reshard.reshard(source, target, 2)
+
+    assert copied["users"] == 10
+    assert copied["messages"] == 30
+    assert copied["result_cache"] == 1
+
+    # Бот на новой раскладке видит те же данные
+    monkeypatch.setattr(SETTINGS, "db_path", target)
+    monkeypatch.setattr(SETTINGS, "db_shards", 2)
+    storage.init_db()
+    assert [m["content"] for m in storage.get_last_messages(7)] == ["7:0", "7:1", "7:2"]
+    assert storage.get_summary(4)["summary"] == "кратко"
+    assert storage.cache_get("moderation", "key") == "{}"
+    assert storage.users_with_messages_over(0, shard=1) == [1, 3, 5, 7, 9]
+
+
+def test_reshard_refuses_to_overwrite(db, tmp_path):
+    (tmp_path / "sharded.1.db").touch()
+    with pytest.raises(FileExistsError):
+        reshard.reshard(SETTINGS.db_path, str(tmp_path / "sharded.db"), 2)
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from bot.config import SETTINGS
+from bot.services import moderation, openai_client, resilience, result_cache
+from bot.services.resilience import CircuitBreaker, CircuitOpen
+from bot.services.result_cache import ResultCache
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class Flaky:
+    def __init__(self, failures, delay=0.0):
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise ServerError("unavailable")
+        return "ok"
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "_BACKOFF_BASE", 0.001)
+
+
+def _call(factory, breaker, **kwargs):
+    kwargs.setdefault("deadline", 1.0)
+    return asyncio.run(resilience.call("test", factory, breaker=breaker, **kwargs))
+
+
+def test_retries_transient_errors():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=10)
+    flaky = Flaky(failures=2)
+
+    assert _call(flaky, breaker, retries=2) == "ok"
+    assert flaky.calls == 3
+    assert breaker.state == breaker.CLOSED
+
+
+def test_client_errors_are_not_retried():
+    class BadRequest(Exception):
+        status_code = 400
+
+    async def bad():
+        raise BadRequest()
+
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    with pytest.raises(BadRequest):
+        _call(bad, breaker, retries=3)
+    assert breaker.state == breaker.CLOSED
+
+
+def test_deadline_covers_all_attempts():
+    breaker = CircuitBreaker("test", failure_threshold=100, reset_timeout=10)
+    slow = Flaky(failures=0, delay=1.0)
+
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        _call(slow, breaker, retries=5, deadline=0.1)
+    assert time.monotonic() - started < 0.5
+
+
+def test_breaker_opens_fails_fast_and_recovers():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    flaky = Flaky(failures=2)
+
+    with pytest.raises(ServerError):
+        _call(flaky, breaker, retries=5)
+    assert flaky.calls == 2
+    assert breaker.state == breaker.OPEN
+
+    with pytest.raises(CircuitOpen):
+        _call(flaky, breaker)
+    assert flaky.calls == 2
+
+    time.sleep(0.06)
+    assert _call(flaky, breaker) == "ok"
+    assert breaker.state == breaker.CLOSED
+
+
+def test_hedged_request_cuts_the_tail():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=10)
+    window = resilience._windows.setdefault("hedge", resilience.LatencyWindow())
+    for _ in range(50):
+        window.observe(0.01)
+    delays = iter([1.0, 0.0])
+
+    async def request():
+        await asyncio.sleep(next(delays))
+        return "fast"
+
+    started = time.monotonic()
+    result = asyncio.run(
+        resilience.call("hedge", request, breaker=breaker, deadline=2.0, hedge=True)
+    )
+
+    assert result == "fast"
+    assert time.monotonic() - started < 0.5
+    assert resilience.get_stats()["hedge"]["hedge_wins"] == 1
+
+
+def test_moderation_falls_back_to_local_while_circuit_is_open(monkeypatch):
+    calls = []
+
+    async def create(model, input):
+        calls.append(input)
+        raise AssertionError("must not be called")
+
+    monkeypatch.setattr(
+        openai_client, "_client", SimpleNamespace(moderations=SimpleNamespace(create=create))
+    )
+    monkeypatch.setattr(
+        result_cache, "moderation_cache", ResultCache("moderation", maxsize=10, ttl=60)
+    )
+    monkeypatch.setattr(SETTINGS, "moderation_batch_size", 1)
+    breaker = CircuitBreaker("moderation", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    monkeypatch.setattr(resilience, "moderation_breaker", breaker)
+
+    clean = asyncio.run(moderation.check_openai_moderation("как дела"))
+    profane = asyncio.run(moderation.check_openai_moderation("ну ты и сука"))
+
+    assert calls == []
+    assert (clean.blocked, clean.source) == (False, "none")
+    assert (profane.blocked, profane.source) == (True, "local")
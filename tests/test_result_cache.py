@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.config import SETTINGS
+from bot.services import ai_client, moderation, openai_client, result_cache
+from bot.services.result_cache import ResultCache
+
+
+class FakeModerations:
+    def __init__(self, flagged):
+        self.flagged = flagged
+        self.calls = 0
+
+    async def create(self, model, input):
+        self.calls += 1
+        inputs = input if isinstance(input, list) else [input]
+        return SimpleNamespace(
+            results=[
+                SimpleNamespace(
+                    flagged=self.flagged,
+                    categories={"harassment": self.flagged},
+                )
+                for _ in inputs
+            ]
+        )
+
+
+def test_key_ignores_case_and_whitespace():
+    assert result_cache.make_key("Привет   МИР ") == result_cache.make_key("привет мир")
+    assert result_cache.make_key("привет", "a") != result_cache.make_key("привет", "b")
+
+
+def test_persistent_cache_survives_memory_loss(db):
+    cache = ResultCache("test", maxsize=10, ttl=60, persistent=True)
+    key = result_cache.make_key("текст")
+    cache.set(key, {"blocked": True})
+
+    restarted = ResultCache("test", maxsize=10, ttl=60, persistent=True)
+
+    assert restarted.get(key) == {"blocked": True}
+    assert restarted.hits == 1
+
+
+def test_moderation_calls_are_cached(monkeypatch):
+    fake = FakeModerations(flagged=True)
+    monkeypatch.setattr(openai_client, "_client", SimpleNamespace(moderations=fake))
+    monkeypatch.setattr(
+        result_cache,
+        "moderation_cache",
+        ResultCache("moderation", maxsize=10, ttl=60),
+    )
+
+    first = asyncio.run(moderation.check_openai_moderation("Ты ужасен"))
+    second = asyncio.run(moderation.check_openai_moderation("ты  ужасен"))
+
+    assert fake.calls == 1
+    assert first == second
+    assert second.blocked is True
+    assert result_cache.moderation_cache.stats()["hits"] == 1
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, model, messages, stream=False):
+        self.calls += 1
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"ответ {self.calls}"))]
+        )
+
+
+def _fake_chat(monkeypatch):
+    fake = FakeCompletions()
+    monkeypatch.setattr(
+        openai_client, "_client", SimpleNamespace(chat=SimpleNamespace(completions=fake))
+    )
+    monkeypatch.setattr(
+        result_cache, "answer_cache", ResultCache("answer", maxsize=10, ttl=60)
+    )
+    monkeypatch.setattr(SETTINGS, "answer_cache_enabled", True)
+    return fake
+
+
+def test_answers_are_cached_only_without_context(monkeypatch):
+    fake = _fake_chat(monkeypatch)
+    history = [{"role": "user", "content": "меня зовут Аня"}]
+
+    first = asyncio.run(ai_client.generate_answer([], "Что ты умеешь?"))
+    second = asyncio.run(ai_client.generate_answer([], "что ты  умеешь?"))
+    with_context = asyncio.run(ai_client.generate_answer(history, "что ты умеешь?"))
+
+    assert first == second == "ответ 1"
+    assert with_context == "ответ 2"
+    assert fake.calls == 2
+    assert result_cache.answer_cache.stats()["hit_rate"] == 0.5
+
+
+def test_answer_cache_is_invalidated_when_prompt_changes(monkeypatch):
+    fake = _fake_chat(monkeypatch)
+
+    asyncio.run(ai_client.generate_answer([], "привет"))
+    monkeypatch.setattr(SETTINGS, "system_prompt", "Отвечай стихами.")
+    answer = asyncio.run(ai_client.generate_answer([], "привет"))
+
+    assert answer == "ответ 2"
+    assert fake.calls == 2
+    assert result_cache.answer_cache.stats()["size"] == 1
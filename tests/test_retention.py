@@ -0,0 +1,78 @@
+import asyncio
+import gzip
+import json
+
+from bot.services import retention, storage
+
+
+def _count(user_id=None):
+    if user_id is None:
+        return storage._read(lambda cur: cur.execute("SELECT COUNT(*) FROM messages").fetchone()[0])
+    return storage._read(
+        lambda cur: cur.execute(
+            "SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+    )
+
+
+def test_keeps_last_messages_and_archives_the_rest(db, tmp_path):
+    for i in range(60):
+        storage.add_message(1, "user", f"старое {i}")
+    for i in range(5):
+        storage.add_message(2, "user", f"сообщение {i}")
+
+    report = asyncio.run(
+        retention.run_once(keep=25, batch_size=10, pause=0, archive_dir=str(tmp_path / "archive"))
+    )
+
+    assert report.pruned == 35
+    assert _count(1) == 25
+    assert _count(2) == 5
+    # Контекст для модели не пострадал
+    storage.close_db()
+    storage.init_db()
+    assert storage.get_last_messages(1, limit=20)[-1]["content"] == "старое 59"
+
+    segments = list((tmp_path / "archive").glob("messages-*.jsonl.gz"))
+    assert len(segments) == 1
+    with gzip.open(segments[0], "rt", encoding="utf-8") as f:
+        archived = [json.loads(line) for line in f]
+    assert [row["content"] for row in archived] == [f"старое {i}" for i in range(35)]
+
+
+def test_time_window_and_incremental_vacuum(db):
+    assert storage.db_size()["auto_vacuum"] == 2  # INCREMENTAL
+
+    def insert_old(cur):
+        cur.executemany(
+            "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            [(1, "user", "x" * 500, "2020-01-01T00:00:00") for _ in range(500)],
+        )
+
+    storage._write(insert_old).result()
+    storage.add_message(1, "user", "свежее")
+
+    report = asyncio.run(retention.run_once(days=30, batch_size=100, pause=0))
+
+    assert report.pruned == 500
+    assert _count() == 1
+    assert report.freelist_pages == 0
+    assert report.db_bytes_after < report.db_bytes_before
+    assert retention.get_stats()["pruned_total"] >= 500
+
+
+def test_pruned_messages_are_not_served_from_context_buffer(db):
+    def insert_old(cur):
+        cur.executemany(
+            "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            [(1, "user", f"старое {i}", "2020-01-01T00:00:00") for i in range(3)],
+        )
+
+    storage._write(insert_old).result()
+    storage.add_message(1, "user", "свежее")
+    # Диалог уже в буфере контекста работающего бота
+    assert len(storage.get_last_messages(1, limit=20)) == 4
+
+    asyncio.run(retention.run_once(days=30, batch_size=2, pause=0))
+
+    assert [m["content"] for m in storage.get_last_messages(1, limit=20)] == ["свежее"]
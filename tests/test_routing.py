@@ -0,0 +1,78 @@
+import pytest
+
+from bot.config import SETTINGS
+from bot.services import routing
+
+
+@pytest.fixture(autouse=True)
+def models(monkeypatch):
+    monkeypatch.setattr(SETTINGS, "chat_model", "big")
+    monkeypatch.setattr(SETTINGS, "fast_model", "small")
+    monkeypatch.setattr(SETTINGS, "paraphrase_model", None)
+    monkeypatch.setattr(SETTINGS, "route_short_chars", 50)
+    monkeypatch.setattr(SETTINGS, "route_max_context", 2)
+    monkeypatch.setattr(SETTINGS, "route_latency_slo", 0.0)
+    monkeypatch.setattr(routing, "_latency", routing._LatencyEWMA())
+
+
+def test_short_question_goes_to_fast_model():
+    assert routing.choose("answer", "сколько будет 2+2?") == routing.Route("small", "short")
+
+
+def test_long_or_contextual_question_goes_to_chat_model():
+    context = [{"role": "user", "content": "привет"}] * 3
+
+    assert routing.choose("answer", "а" * 51).model == "big"
+    assert routing.choose("answer", "а почему?", context).model == "big"
+    assert routing.choose("answer", "а почему?", summary="раньше обсуждали").model == "big"
+
+
+def test_background_tasks_use_fast_or_dedicated_model(monkeypatch):
+    assert routing.choose("summary") == routing.Route("small", "background")
+    assert routing.choose("paraphrase", "текст").model == "small"
+
+    monkeypatch.setattr(SETTINGS, "paraphrase_model", "tiny")
+    assert routing.choose("paraphrase", "текст").model == "tiny"
+
+
+def test_without_fast_model_everything_uses_chat_model(monkeypatch):
+    monkeypatch.setattr(SETTINGS, "fast_model", None)
+
+    assert routing.choose("answer", "да").model == "big"
+    assert routing.choose("summary").model == "big"
+    assert routing.choose("paraphrase", "текст").model == "big"
+
+
+def test_slow_model_is_bypassed_when_slo_is_set(monkeypatch):
+    for _ in range(5):
+        routing.observe("small", 3.0)
+        routing.observe("big", 1.0)
+
+    assert routing.choose("answer", "да").model == "small"
+
+    monkeypatch.setattr(SETTINGS, "route_latency_slo", 2.0)
+    assert routing.choose("answer", "да") == routing.Route("big", "latency")
+    assert routing.get_stats()["small"]["calls"] == 5
+
+
+def test_single_slow_sample_does_not_bypass_model(monkeypatch):
+    monkeypatch.setattr(SETTINGS, "route_latency_slo", 2.0)
+    routing.observe("small", 30.0)
+
+    assert routing.choose("answer", "да") == routing.Route("small", "short")
+
+
+def test_bypassed_model_is_probed_and_recovers(monkeypatch):
+    monkeypatch.setattr(SETTINGS, "route_latency_slo", 2.0)
+    for _ in range(5):
+        routing.observe("small", 3.0)
+        routing.observe("big", 1.0)
+
+    routes = [routing.choose("answer", "да") for _ in range(routing._PROBE_EVERY)]
+    assert routes[-1] == routing.Route("small", "probe")
+    assert {r.reason for r in routes[:-1]} == {"latency"}
+
+    # Пробы показывают, что модель снова быстрая, — трафик возвращается
+    for _ in range(5):
+        routing.observe("small", 0.5)
+    assert routing.choose("answer", "да") == routing.Route("small", "short")
@@ -0,0 +1,57 @@
+import asyncio
+
+from bot.services import storage
+from bot.services.sessions import ParaphraseSessionStore
+
+
+def test_memory_sessions_are_bounded_and_expire():
+    store = ParaphraseSessionStore(ttl=0.05, max_sessions=2)
+
+    async def scenario():
+        first = await store.create(1, "a", "b")
+        await store.create(1, "c", "d")
+        third = await store.create(1, "e", "f")
+
+        assert await store.get(first) is None
+        assert await store.count() == 2
+
+        await asyncio.sleep(0.06)
+        assert await store.get(third) is None
+
+    asyncio.run(scenario())
+
+
+def _persistent_scenario():
+    async def scenario():
+        token = await ParaphraseSessionStore(
+            ttl=60, max_sessions=10, persistent=True
+        ).create(1, "исходный", "вежливый")
+
+        restarted = ParaphraseSessionStore(ttl=60, max_sessions=10, persistent=True)
+        # Сразу после create сессия уже в базе, даже в write-behind
+        assert (await restarted.get(token))["paraphrased"] == "вежливый"
+
+        await restarted.create(2, "старый", "истёк")
+        await storage.wait_durable(
+            storage.session_put(
+                "expired",
+                {"user_id": 3, "original": "a", "paraphrased": "b"},
+                expires_at=0,
+            )
+        )
+        assert await restarted.count() == 2
+
+        assert (await restarted.pop(token))["user_id"] == 1
+        assert await restarted.pop(token) is None
+        assert await restarted.count() == 1
+
+    asyncio.run(scenario())
+
+
+def test_persistent_sessions_survive_restart(db):
+    _persistent_scenario()
+
+
+def test_persistent_sessions_with_write_behind(db):
+    storage.start_write_behind(batch_size=10, interval_ms=50)
+    _persistent_scenario()
@@ -0,0 +1,36 @@
+import asyncio
+
+from bot.services import speculation
+from bot.services.speculation import Speculation
+
+
+async def _chunks(parts, delay=0.0):
+    for part in parts:
+        await asyncio.sleep(delay)
+        yield part
+
+
+def test_released_speculation_returns_full_answer():
+    async def run():
+        spec = Speculation(_chunks(["Ответ", " готов"]))
+        await asyncio.sleep(0)
+        return await spec.result()
+
+    assert asyncio.run(run()) == "Ответ готов"
+
+
+def test_discarded_speculation_counts_wasted_tokens():
+    before = speculation.get_stats()
+
+    async def run():
+        spec = Speculation(_chunks(["раз ", "два ", "три"], delay=0.01), prompt_tokens=50)
+        await asyncio.sleep(0.025)
+        return await spec.discard()
+
+    wasted = asyncio.run(run())
+    after = speculation.get_stats()
+
+    assert wasted > 0
+    assert after["discarded"] == before["discarded"] + 1
+    assert after["wasted_prompt_tokens"] == before["wasted_prompt_tokens"] + 50
+    assert after["wasted_completion_tokens"] == before["wasted_completion_tokens"] + wasted
@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from bot.config import SETTINGS
+from bot.services import metrics, storage
+
+
+def test_messages_roundtrip(db):
+    storage.get_or_create_user(1, "user", "User")
+    storage.add_message(1, "user", "Привет")
+    storage.add_message(1, "assistant", "Здравствуйте")
+
+    dialog = storage.get_last_messages(1, limit=20)
+
+    assert [m["content"] for m in dialog] == ["Привет", "Здравствуйте"]
+
+
+def test_write_behind_batches_and_flushes(db):
+    storage.start_write_behind(batch_size=50, interval_ms=20)
+    storage.get_or_create_user(1, "user", "User")
+
+    futures = [storage.add_message(1, "user", f"msg {i}") for i in range(10)]
+    asyncio.run(storage.flush())
+
+    assert all(f.done() for f in futures)
+    assert len(storage.get_last_messages(1, limit=20)) == 10
+    assert storage.increment_violations(1) == 1
+
+
+def test_write_behind_failed_op_does_not_break_batch(db, caplog):
+    storage.start_write_behind(batch_size=50, interval_ms=20)
+    errors_before = metrics.errors_total.value(stage="storage_write")
+
+    bad = storage._write(lambda cur: cur.execute("INSERT INTO nope VALUES (1)"))
+    good = storage.add_message(2, "user", "ok")
+
+    with pytest.raises(Exception):
+        bad.result()
+    good.result()
+    assert len(storage.get_last_messages(2)) == 1
+    # Ошибку видно, даже если future никто не ждёт
+    assert metrics.errors_total.value(stage="storage_write") == errors_before + 1
+    assert "STORAGE_WRITE_ERROR" in caplog.text
+
+
+def test_async_user_writes_do_not_block_event_loop(db):
+    # Пачка собирается 200 мс: .result() простоял бы всё это время
+    storage.start_write_behind(batch_size=50, interval_ms=200)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        row = await storage.get_or_create_user_async(1, "user", "User")
+        storage._user_cache.clear()
+        count = await storage.increment_violations_async(1)
+        task.cancel()
+        return row, count, ticks
+
+    row, count, ticks = asyncio.run(scenario())
+
+    assert row["user_id"] == 1
+    assert count == 1
+    assert ticks >= 10
+
+
+def test_init_db_applies_migrations(db):
+    assert storage.get_schema_version() == storage.SCHEMA_VERSION
+
+    plan = storage._read(
+        lambda cur: cur.execute(
+            "EXPLAIN QUERY PLAN SELECT role FROM messages WHERE user_id = ? ORDER BY id DESC",
+            (1,),
+        ).fetchall()
+    )
+    assert "idx_messages_user_id_id" in " ".join(row[-1] for row in plan)
+
+
+def test_user_cache_skips_unchanged_profile_writes(db):
+    storage.get_or_create_user(1, "user", "User")
+
+    statements = []
+    storage._get_conn().set_trace_callback(statements.append)
+    row = storage.get_or_create_user(1, "user", "User")
+    assert row["username"] == "user"
+    assert statements == []
+
+    row = storage.get_or_create_user(1, "renamed", "User")
+    assert row["username"] == "renamed"
+    assert any(s.lstrip().startswith("UPDATE") for s in statements)
+
+
+def test_user_cache_stays_coherent_with_db(db):
+    storage.get_or_create_user(1, "user", "User")
+
+    assert storage.increment_violations(1) == 1
+    assert storage.increment_violations(1) == 2
+    storage.set_muted(1, True)
+
+    cached = storage.get_or_create_user(1, "user", "User")
+    storage._user_cache.clear()
+    stored = storage.get_user(1)
+
+    assert cached["violations_count"] == stored["violations_count"] == 2
+    assert cached["is_muted"] == stored["is_muted"] == 1
+
+
+def test_dialog_context_is_served_from_buffer(db):
+    storage.get_or_create_user(1, "user", "User")
+    storage.add_message(1, "user", "Привет")
+    storage.get_last_messages(1)
+
+    statements = []
+    storage._get_conn().set_trace_callback(statements.append)
+    storage.add_message(1, "assistant", "Здравствуйте")
+    dialog = storage.get_last_messages(1)
+
+    assert [m["content"] for m in dialog] == ["Привет", "Здравствуйте"]
+    assert not any(s.lstrip().startswith("SELECT") for s in statements)
+
+    storage.reset_dialog(1)
+    assert storage.get_last_messages(1) == []
+
+
+@pytest.fixture
+def sharded_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(SETTINGS, "db_path", str(tmp_path / "test.db"))
+    monkeypatch.setattr(SETTINGS, "db_shards", 3)
+    storage.close_db()
+    storage.init_db()
+    yield tmp_path
+    storage.close_db()
+
+
+def test_sharded_storage_routes_by_user_id(sharded_db):
+    for user_id in range(1, 7):
+        storage.get_or_create_user(user_id, f"user{user_id}", "User")
+        storage.add_message(user_id, "user", f"привет от {user_id}")
+    storage.reset_dialog(3)
+    storage._context_buffer.clear()
+
+    assert sorted(p.name for p in sharded_db.glob("*.db")) == ["test.1.db", "test.2.db", "test.db"]
+    assert storage.get_last_messages(5)[0]["content"] == "привет от 5"
+    assert storage.get_last_messages(3) == []
+    for shard in range(3):
+        user_ids = storage._read(
+            lambda cur: [row[0] for row in cur.execute("SELECT user_id FROM users")],
+            shard=shard,
+        )
+        assert all(user_id % 3 == shard for user_id in user_ids)
+        assert len(user_ids) == 2
+
+
+def test_write_behind_runs_one_writer_per_shard(sharded_db):
+    storage.start_write_behind(batch_size=50, interval_ms=20)
+    futures = [storage.add_message(user_id, "user", "msg") for user_id in range(9)]
+    asyncio.run(storage.flush())
+
+    assert all(f.done() for f in futures)
+    assert sum(storage.users_with_messages_over(0, shard) != [] for shard in range(3)) == 3
+
+
+def test_buffered_messages_get_ids_and_summary_marker_is_migrated(tmp_path, monkeypatch):
+    monkeypatch.setattr(SETTINGS, "db_path", str(tmp_path / "old.db"))
+    storage.close_db()
+    storage.migrate(target_version=6)
+    conn = storage._get_conn()
+    conn.execute("INSERT INTO users (user_id) VALUES (1)")
+    conn.executemany(
+        "INSERT INTO messages (user_id, role, content, created_at) VALUES (1, 'user', ?, ?)",
+        [("раз", "2025-01-01T00:00:01"), ("два", "2025-01-01T00:00:02")],
+    )
+    conn.execute(
+        "INSERT INTO dialog_summaries VALUES (1, 'кратко', '2025-01-01T00:00:01', '')"
+    )
+    conn.commit()
+
+    storage.migrate()
+    assert storage.get_summary(1)["covered_until_id"] == 1
+
+    storage.get_last_messages(1)
+    storage.add_message(1, "assistant", "три")
+    assert [m["id"] for m in storage.get_last_messages(1)] == [1, 2, 3]
+    storage.close_db()
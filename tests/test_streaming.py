@@ -0,0 +1,48 @@
+import asyncio
+
+from bot.services.streaming import stream_into_message
+
+
+class FakeMessage:
+    def __init__(self):
+        self.edits = []
+        self.replies = []
+
+    async def edit_text(self, text):
+        self.edits.append(text)
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+
+async def _chunks(parts):
+    for part in parts:
+        yield part
+
+
+def test_stream_edits_are_throttled_and_final_text_is_shown():
+    placeholder = FakeMessage()
+    parts = ["Привет", ",", " как", " дела", "?"]
+
+    result = asyncio.run(
+        stream_into_message(placeholder, _chunks(parts), min_edit_interval=60)
+    )
+
+    # Первая правка — сразу на первом токене, потом только финальная
+    assert len(placeholder.edits) == 2
+    assert placeholder.edits[-1] == "Привет, как дела?"
+    assert result.text == "Привет, как дела?"
+    assert result.first_token_latency is not None
+
+
+def test_stream_long_answer_is_split():
+    placeholder = FakeMessage()
+    parts = ["a" * 3000, "b" * 3000]
+
+    result = asyncio.run(
+        stream_into_message(placeholder, _chunks(parts), min_edit_interval=60)
+    )
+
+    assert len(result.text) == 6000
+    assert len(placeholder.edits[-1]) == 4096
+    assert placeholder.replies == ["b" * 1904]
@@ -0,0 +1,131 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot.config import SETTINGS
+from bot.services import ai_client, openai_client, storage, usage
+
+
+def _usage(prompt, completion, cached=None):
+    details = None if cached is None else SimpleNamespace(cached_tokens=cached)
+    return SimpleNamespace(
+        prompt_tokens=prompt, completion_tokens=completion, prompt_tokens_details=details
+    )
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.kwargs = []
+
+    async def create(self, **kwargs):
+        self.kwargs.append(kwargs)
+        if kwargs.get("stream"):
+            return FakeStream(
+                [
+                    SimpleNamespace(
+                        choices=[SimpleNamespace(delta=SimpleNamespace(content="при"))],
+                        usage=None,
+                    ),
+                    SimpleNamespace(
+                        choices=[SimpleNamespace(delta=SimpleNamespace(content="вет"))],
+                        usage=None,
+                    ),
+                    SimpleNamespace(choices=[], usage=_usage(1200, 2, cached=1024)),
+                ]
+            )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="ответ"))],
+            usage=_usage(1500, 10, cached=1280),
+        )
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+@pytest.fixture
+def fake_chat(monkeypatch):
+    fake = FakeCompletions()
+    monkeypatch.setattr(
+        openai_client, "_client", SimpleNamespace(chat=SimpleNamespace(completions=fake))
+    )
+    monkeypatch.setattr(usage, "_totals", {})
+    monkeypatch.setattr(SETTINGS, "chat_model", "big")
+    monkeypatch.setattr(SETTINGS, "fast_model", None)
+    monkeypatch.setattr(SETTINGS, "answer_cache_enabled", False)
+    return fake
+
+
+def test_prompt_prefix_is_shared_between_turns(db):
+    storage.get_or_create_user(1, "user", "User")
+    storage.get_last_messages(1)
+    storage.add_message(1, "user", "привет")
+    storage.add_message(1, "assistant", "здравствуй")
+    first = ai_client.build_chat_input(
+        storage.get_last_messages(1), "как дела?", summary="кратко"
+    )
+    storage.add_message(1, "user", "как дела?")
+    second = ai_client.build_chat_input(
+        storage.get_last_messages(1), "что нового?", summary="кратко"
+    )
+
+    assert second[: len(first)] == first
+    assert "created_at" not in second[2]
+    # История не пересобирается: те же неизменяемые записи из буфера контекста
+    assert all(a is b for a, b in zip(first[2:-1], second[2:]))
+    with pytest.raises(TypeError):
+        second[2]["content"] = "изменено"
+
+
+def test_answer_and_stream_usage_is_recorded(db, fake_chat):
+    answer = asyncio.run(ai_client.generate_answer([], "вопрос", user_id=7))
+
+    async def read_stream():
+        parts = ai_client.stream_answer([], "вопрос", user_id=7)
+        return "".join([part async for part in parts])
+
+    streamed = asyncio.run(read_stream())
+
+    assert (answer, streamed) == ("ответ", "привет")
+    assert fake_chat.kwargs[1]["stream_options"] == {"include_usage": True}
+    assert usage.get_stats()["big"]["cached_tokens"] == 1280 + 1024
+
+    by_op = {row["op"]: row for row in storage.usage_totals("op", user_id=7)}
+    assert by_op["answer"]["cached_tokens"] == 1280
+    assert by_op["answer_stream"]["cached_tokens"] == 1024
+    [by_user] = storage.usage_totals("user_id")
+    assert (by_user["calls"], by_user["prompt_tokens"]) == (2, 2700)
+    assert by_user["cached_ratio"] == pytest.approx(2304 / 2700)
+
+
+def test_usage_totals_add_up_across_shards(db, monkeypatch):
+    monkeypatch.setattr(SETTINGS, "db_shards", 2)
+    storage.close_db()
+    storage.init_db()
+    monkeypatch.setattr(usage, "_totals", {})
+
+    usage.record("answer", "big", _usage(100, 5, cached=64), user_id=1)
+    usage.record("answer", "big", _usage(100, 5), user_id=2)
+    usage.record("answer", "small", _usage(50, 5, cached=0), user_id=2)
+    usage.record("answer", "small", None, user_id=2)
+
+    by_model = {row["model"]: row for row in storage.usage_totals("model")}
+    assert by_model["big"]["calls"] == 2
+    assert by_model["big"]["cached_tokens"] == 64
+    assert by_model["small"]["prompt_tokens"] == 50
+    assert [row["user_id"] for row in storage.usage_totals("user_id")] == [2, 1]
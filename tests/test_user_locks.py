@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.handlers import commands
+from bot.services import storage
+from bot.services.user_locks import KeyedLock, user_locks
+
+
+def test_same_user_is_serialized_other_users_run_in_parallel():
+    locks = KeyedLock()
+    events = []
+
+    async def handle(user_id, tag, delay):
+        async with locks.hold(user_id):
+            events.append(("start", tag))
+            await asyncio.sleep(delay)
+            events.append(("end", tag))
+
+    async def scenario():
+        await asyncio.gather(
+            handle(1, "first", 0.02),
+            handle(1, "second", 0),
+            handle(2, "other", 0),
+        )
+
+    asyncio.run(scenario())
+
+    # Второе сообщение пользователя 1 начинается только после первого,
+    # а пользователь 2 не ждёт пользователя 1
+    assert events.index(("start", "second")) > events.index(("end", "first"))
+    assert events.index(("end", "other")) < events.index(("end", "first"))
+    assert len(locks) == 0
+
+
+def test_reset_command_waits_for_message_in_progress(monkeypatch):
+    events = []
+    monkeypatch.setattr(storage, "reset_dialog", lambda user_id: events.append("reset"))
+
+    async def reply_text(text, **kwargs):
+        events.append("reply")
+
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=7),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+
+    async def message_in_progress():
+        async with user_locks.hold(7):
+            await asyncio.sleep(0.02)
+            events.append("message")
+
+    async def scenario():
+        handling = asyncio.create_task(message_in_progress())
+        await asyncio.sleep(0)
+        await commands.reset_command(update, None)
+        await handling
+
+    asyncio.run(scenario())
+
+    assert events == ["message", "reset", "reply"]
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import signal
+from queue import Queue
+
+import httpx
+
+from bot.http_server import HttpServer, Response
+from bot import webhook
+from bot.webhook import WebhookDispatcher, extract_user_id, worker_for
+
+
+MESSAGE_UPDATE = {
+    "update_id": 1001,
+    "message": {
+        "message_id": 7,
+        "date": 1700000000,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Айдар"},
+        "text": "Привет",
+    },
+}
+
+CALLBACK_UPDATE = {
+    "update_id": 1002,
+    "callback_query": {
+        "id": "cb1",
+        "chat_instance": "1",
+        "from": {"id": 43, "is_bot": False, "first_name": "Алсу"},
+        "data": "p:accept:token",
+    },
+}
+
+
+def test_extract_user_id():
+    assert extract_user_id(MESSAGE_UPDATE) == 42
+    assert extract_user_id(CALLBACK_UPDATE) == 43
+    assert extract_user_id({"update_id": 1}) is None
+
+
+def test_worker_for_is_stable():
+    assert worker_for(42, 4) == worker_for(42, 4) == 2
+    assert worker_for(None, 4) == 0
+    assert worker_for(42, 1) == 0
+
+
+def test_updates_are_routed_by_user():
+    received = {0: [], 1: []}
+
+    def make_sink(index):
+        async def sink(data, raw):
+            received[index].append(data["update_id"])
+
+        return sink
+
+    async def scenario():
+        server = HttpServer("127.0.0.1", 0)
+        dispatcher = WebhookDispatcher([make_sink(0), make_sink(1)], secret="s3cret")
+        server.route("POST", "/telegram", dispatcher.handle)
+        await server.start()
+        url = f"http://127.0.0.1:{server.port}/telegram"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+        try:
+            async with httpx.AsyncClient() as http:
+                ok = [
+                    await http.post(url, content=json.dumps(update), headers=headers)
+                    for update in (MESSAGE_UPDATE, CALLBACK_UPDATE)
+                ]
+                forbidden = await http.post(url, content=json.dumps(MESSAGE_UPDATE))
+                missing = await http.get(f"http://127.0.0.1:{server.port}/nope")
+        finally:
+            await server.stop()
+        return ok, forbidden, missing
+
+    ok, forbidden, missing = asyncio.run(scenario())
+
+    assert [r.status_code for r in ok] == [200, 200]
+    assert forbidden.status_code == 401
+    assert missing.status_code == 404
+    assert received == {0: [1001], 1: [1002]}
+
+
+def _raw_exchange(payload):
+    async def scenario():
+        server = HttpServer("127.0.0.1", 0)
+
+        async def echo(request):
+            return Response(body=request.body)
+
+        server.route("POST", "/echo", echo)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(payload)
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+        finally:
+            await server.stop()
+        return int(status_line.split()[1])
+
+    return asyncio.run(scenario())
+
+
+def test_malformed_requests_get_client_errors():
+    head = b"POST /echo HTTP/1.1\r\n"
+
+    assert _raw_exchange(head + b"Content-Length: 2\r\n\r\nok") == 200
+    assert _raw_exchange(head + b"Content-Length: abc\r\n\r\n") == 400
+    assert _raw_exchange(head + b"Content-Length: -1\r\n\r\n") == 400
+    assert _raw_exchange(b"garbage\r\n\r\n") == 400
+    assert _raw_exchange(head + b"Content-Length: 99999999\r\n\r\n") == 413
+    assert _raw_exchange(head + b"X-Pad: " + b"a" * 100_000 + b"\r\n\r\n") == 413
+
+
+def test_worker_ignores_group_stop_signals(monkeypatch):
+    handlers = {}
+    monkeypatch.setattr(webhook.signal, "signal", handlers.__setitem__)
+    monkeypatch.setattr(webhook.asyncio, "run", lambda coro: coro.close())
+
+    webhook._worker_main(None, lambda: None, 0, None)
+
+    # Останавливает воркер только диспетчер: иначе теряется очередь write-behind
+    assert handlers[signal.SIGINT] is signal.SIG_IGN
+    assert handlers[signal.SIGTERM] is signal.SIG_IGN
+
+
+def test_worker_stops_when_queue_is_closed():
+    queue = Queue()
+    queue.put(b"update")
+    queue.put(None)
+
+    assert webhook._next_update(queue) == b"update"
+    assert webhook._next_update(queue) is None
+
+
+def test_stop_closes_idle_keep_alive_connections():
+    errors = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        server = HttpServer("127.0.0.1", 0)
+
+        async def echo(request):
+            return Response(body=request.body)
+
+        server.route("POST", "/echo", echo)
+        await server.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"POST /echo HTTP/1.1\r\nContent-Length: 2\r\n\r\nok")
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        await reader.readexactly(2)
+
+        # Соединение осталось открытым (keep-alive) и простаивает
+        await asyncio.wait_for(server.stop(), timeout=2)
+        eof = await asyncio.wait_for(reader.read(), timeout=2)
+        writer.close()
+        return head, eof
+
+    head, eof = asyncio.run(scenario())
+
+    assert b"Connection: keep-alive" in head
+    assert eof == b""
+    assert errors == []